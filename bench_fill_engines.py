@@ -0,0 +1,85 @@
+"""
+填充引擎基准测试：openpyxl 填充 与 XML 直接改写（xlsx_patch）
+使用随机生成的装箱数据和临时产品表，不连接数据库，不插入产品图片。
+
+用法: python bench_fill_engines.py [箱数] [每箱产品数] [重复次数]
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+import statistics
+import contextlib
+
+from generator import InvoiceGenerator
+from get_ticket_data import PackingListBox, PackingListItem
+from product_cache import ProductTable, write_product_table
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '表格模版')
+TEMPLATES = ('叮铛卡航限时达', 'UPS(美洲)')
+ENGINES = ('openpyxl', 'xml')
+
+
+def build_products(count):
+    return [{
+        'msku': f'BENCH-{i}', 'productNameZh': f'测试产品{i}', 'productNameEn': f'Product {i}',
+        'useEn': 'daily use', 'useZh': '日用', 'materialEn': 'plastic', 'materialZh': '塑料',
+        'HS': f'{392690 + i}', 'brand': '无', 'model': f'M-{i}', 'productLink': 'https://example.com',
+        'askprice': round(1 + i * 0.37, 2), 'electrified': '否', 'magnetic': '否', 'weight': 0.2,
+    } for i in range(count)]
+
+
+def build_boxes(box_count, items_per_box, product_count, seed=1):
+    rng = random.Random(seed)
+    box_data = {}
+    sequence_no = 0
+    for box_number in range(1, box_count + 1):
+        box = PackingListBox(box_number)
+        box.set_dimensions(60, 40, 40)
+        box.set_weight(round(rng.uniform(8, 22), 2))
+        for msku_index in rng.sample(range(product_count), items_per_box):
+            sequence_no += 1
+            box.add_item(PackingListItem(sequence_no, f'BENCH-{msku_index}', f'X00{msku_index}', f'产品{msku_index}',
+                                         f'SKU-{msku_index}', 0, {box_number: rng.randint(1, 50)}))
+        box_data[box_number] = box
+    return box_data
+
+
+def run(box_count=200, items_per_box=3, repeat=5):
+    work_dir = tempfile.mkdtemp(prefix='bench_fill_')
+    try:
+        table_path = os.path.join(work_dir, 'product_table.bin')
+        write_product_table(build_products(100), table_path)
+        generator = InvoiceGenerator(work_dir, work_dir, db_connector=contextlib.nullcontext(),
+                                     product_table=ProductTable(table_path))
+        generator.image_folder = os.path.join(work_dir, 'images')
+        box_data = build_boxes(box_count, items_per_box, 100)
+        rows = sum(len(box.items) for box in box_data.values())
+        print(f"箱数 {box_count}，数据行 {rows}，每项重复 {repeat} 次")
+        print(f"{'模板':<16}{'引擎':<10}{'中位数(ms)':>12}{'最快(ms)':>12}{'文件(KB)':>12}")
+
+        for template in TEMPLATES:
+            template_path = os.path.join(TEMPLATE_DIR, f'{template}.xlsx')
+            spec = generator._get_template_handler(template_path).spec
+            for engine in ENGINES:
+                spec.output = engine
+                timings = []
+                for i in range(repeat + 1):
+                    started = time.perf_counter()
+                    output_path = generator.generate_invoice(template_path, box_data, 'FBA000BENCH',
+                                                             name_suffix=f'_{engine}_{i}')
+                    elapsed = time.perf_counter() - started
+                    # 第一次包含模板解析，不计入
+                    if i:
+                        timings.append(elapsed * 1000)
+                size = os.path.getsize(output_path) / 1024
+                print(f"{template:<16}{engine:<10}{statistics.median(timings):>12.1f}"
+                      f"{min(timings):>12.1f}{size:>12.1f}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    run(*(int(arg) for arg in sys.argv[1:4]))
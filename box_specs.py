@@ -0,0 +1,225 @@
+"""
+箱规目录
+箱规保存在数据库 box_specs 集合中（首次使用时用内置箱规初始化），进程内缓存并定期重新加载。
+查找顺序：
+1. 名称/别名精确匹配（预编译的哈希索引）
+2. 箱规名称包含在表格写法中，如“定制64箱”（Aho-Corasick 多模式匹配，取最长的名称）
+3. 表格写法是某个箱规名称的一部分（预编译的子串索引）
+每次查找与箱规数量无关，新增箱型只需在数据库中添加记录。
+"""
+import time
+import hashlib
+import threading
+import unicodedata
+from collections import deque
+from typing import Dict, List, Optional
+
+from task_log import get_logger
+
+logger = get_logger(__name__)
+
+# 内置箱规，数据库为空时用于初始化，数据库不可用时作为后备
+DEFAULT_BOX_SPECS = {
+    "中号": {"length": 51, "width": 41, "height": 41, "weight": 1.102},
+    "1号": {"length": 54, "width": 30, "height": 38, "weight": 0.843},
+    "2号": {"length": 54, "width": 24, "height": 30, "weight": 0.631},
+    "3号": {"length": 44, "width": 22, "height": 28, "weight": 0.458},
+    "4号": {"length": 36, "width": 20, "height": 24, "weight": 0.283},
+    "定制49": {"length": 50, "width": 50, "height": 40, "weight": 1.2},
+    "定制55": {"length": 56, "width": 46, "height": 51, "weight": 1.6},
+    "搬家大": {"length": 61, "width": 41, "height": 51, "weight": 1.45},
+    "定制64": {"length": 65, "width": 40, "height": 45, "weight": 1.4},
+    "圣诞树": {"length": 91, "width": 49.5, "height": 37, "weight": 1.7},
+    "定制59": {"length": 59, "width": 48, "height": 39, "weight": 1.35}
+}
+
+SPEC_FIELDS = ('length', 'width', 'height', 'weight')
+
+
+def normalize_box_type(text) -> str:
+    """统一全角/半角、大小写并去掉空白"""
+    if text is None:
+        return ''
+    return ''.join(unicodedata.normalize('NFKC', str(text)).lower().split())
+
+
+class _AhoCorasick:
+    """多模式子串匹配自动机，一次扫描找出文本中出现的所有模式"""
+
+    def __init__(self, patterns: List[str]):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        for index, pattern in enumerate(patterns):
+            state = 0
+            for ch in pattern:
+                if ch not in self._goto[state]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                    self._goto[state][ch] = len(self._goto) - 1
+                state = self._goto[state][ch]
+            self._output[state].append(index)
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(ch, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def find_all(self, text: str) -> List[int]:
+        """返回文本中出现的模式序号"""
+        found = []
+        state = 0
+        for ch in text:
+            while state and ch not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(ch, 0)
+            found.extend(self._output[state])
+        return found
+
+
+class _CatalogIndex:
+    """一次加载的箱规及其预编译索引（不可变，重新加载时整体替换）"""
+
+    def __init__(self, specs: List[dict]):
+        self.specs = specs
+        self.exact: Dict[str, dict] = {}
+        self.substrings: Dict[str, dict] = {}
+        patterns = []
+        self._pattern_specs = []
+        for spec in specs:
+            for key in [spec['name']] + list(spec.get('aliases') or []):
+                key = normalize_box_type(key)
+                if not key:
+                    continue
+                self.exact.setdefault(key, spec)
+                patterns.append(key)
+                self._pattern_specs.append(spec)
+                # 表格写法可能只是箱规名称的一部分（如只写“定制”），按目录顺序取第一个
+                for i in range(len(key)):
+                    for j in range(i + 1, len(key) + 1):
+                        self.substrings.setdefault(key[i:j], spec)
+        self._patterns = patterns
+        self._matcher = _AhoCorasick(patterns)
+        digest = hashlib.sha256(repr([(s['name'], sorted(s.get('aliases') or []),
+                                       [s[f] for f in SPEC_FIELDS]) for s in specs]).encode('utf-8'))
+        self.version = digest.hexdigest()[:16]
+
+    def match(self, box_type) -> Optional[dict]:
+        key = normalize_box_type(box_type)
+        if not key:
+            return None
+        spec = self.exact.get(key)
+        if spec is not None:
+            return spec
+        found = self._matcher.find_all(key)
+        if found:
+            # 最长的名称优先，长度相同时按目录顺序
+            best = min(found, key=lambda i: (-len(self._patterns[i]), i))
+            return self._pattern_specs[best]
+        return self.substrings.get(key)
+
+
+class BoxSpecCatalog:
+    """数据库中的箱规目录，进程内缓存"""
+
+    def __init__(self, db_connector=None, ttl=300, collection='box_specs'):
+        """
+        :param db_connector: 数据库连接器（默认在首次加载时创建）
+        :param ttl: 缓存有效期（秒），过期后重新从数据库加载
+        :param collection: 箱规集合名称
+        """
+        self._db_connector = db_connector
+        self.ttl = ttl
+        self.collection = collection
+        self._index: Optional[_CatalogIndex] = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def db_connector(self):
+        if self._db_connector is None:
+            from db_connector import MongoDBConnector
+            self._db_connector = MongoDBConnector()
+        return self._db_connector
+
+    @staticmethod
+    def default_specs() -> List[dict]:
+        return [dict(name=name, aliases=[], **spec) for name, spec in DEFAULT_BOX_SPECS.items()]
+
+    def _load_specs(self) -> List[dict]:
+        """从数据库读取箱规，集合为空时写入内置箱规"""
+        with self.db_connector as db:
+            collection = db[self.collection]
+            docs = list(collection.find({'disabled': {'$ne': True}}, {'_id': 0}).sort('order', 1))
+            if not docs and collection.estimated_document_count() == 0:
+                seed = [dict(spec, order=i) for i, spec in enumerate(self.default_specs())]
+                collection.insert_many([dict(doc) for doc in seed])
+                collection.create_index('name', unique=True)
+                logger.info("箱规集合为空，已写入 %s 个内置箱规", len(seed))
+                docs = seed
+        specs = []
+        for doc in docs:
+            try:
+                specs.append({
+                    'name': str(doc['name']).strip(),
+                    'aliases': [str(a).strip() for a in doc.get('aliases') or []],
+                    **{f: doc[f] if isinstance(doc[f], (int, float)) else float(doc[f]) for f in SPEC_FIELDS},
+                })
+            except (KeyError, TypeError, ValueError) as e:
+                logger.warning("忽略无效箱规 %s: %s", doc.get('name'), str(e))
+        return specs
+
+    def _get_index(self) -> _CatalogIndex:
+        index = self._index
+        if index is not None and time.monotonic() < self._expires_at:
+            return index
+        with self._lock:
+            if self._index is not None and time.monotonic() < self._expires_at:
+                return self._index
+            try:
+                specs = self._load_specs()
+            except Exception as e:
+                logger.warning("加载箱规失败，使用%s: %s", '上次加载的箱规' if self._index else '内置箱规', str(e))
+                specs = self._index.specs if self._index else self.default_specs()
+            if not specs:
+                logger.warning("箱规目录为空，使用内置箱规")
+                specs = self.default_specs()
+            self._index = _CatalogIndex(specs)
+            self._expires_at = time.monotonic() + self.ttl
+            return self._index
+
+    def invalidate(self):
+        """下次查找时重新从数据库加载"""
+        self._expires_at = 0.0
+
+    @property
+    def version(self) -> str:
+        """当前箱规内容的版本（参与装箱单解析缓存的键）"""
+        return self._get_index().version
+
+    @property
+    def default(self) -> dict:
+        """目录中的第一个箱规"""
+        return self._get_index().specs[0]
+
+    def match(self, box_type) -> Optional[dict]:
+        """
+        查找箱规
+        :param box_type: 装箱单中的箱规写法
+        :return: {'name', 'aliases', 'length', 'width', 'height', 'weight'}，未找到返回None
+        """
+        return self._get_index().match(box_type)
+
+    def all(self) -> List[dict]:
+        return list(self._get_index().specs)
+
+
+# 默认箱规目录，供简单装箱单处理器共用
+box_spec_catalog = BoxSpecCatalog()
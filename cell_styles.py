@@ -0,0 +1,138 @@
+"""
+命名样式注册表
+发票模板常用的样式（数据行、小字号、汇总页脚等）在这里统一定义，样式对象只创建一次。
+每个工作簿绑定一次注册表：每种样式在工作簿的字体/边框/对齐表中各登记一次，
+之后给单元格设置样式只是写入样式索引，不再逐个赋值 Font/Border/Alignment
+（openpyxl 每次赋值都要哈希查重），同一行的多个单元格可以一次设置。
+"""
+from typing import Dict, Iterable
+
+from openpyxl.styles import Font, Border, Side, Alignment
+from openpyxl.styles.cell_style import StyleArray
+
+_THIN = Side(border_style='thin')
+_NONE = Side(border_style=None)
+
+THIN_BORDER = Border(left=_THIN, right=_THIN, top=_THIN, bottom=_THIN)
+NO_BORDER = Border(left=_NONE, right=_NONE, top=_NONE, bottom=_NONE)
+CENTER = Alignment(horizontal='center', vertical='center')
+
+# 内置样式，模板可以追加或覆盖
+STYLE_DEFINITIONS = {
+    'data': {'font': {'name': 'Arial', 'size': 10}, 'border': 'thin', 'alignment': 'center'},
+    'small': {'font': {'name': 'Arial', 'size': 9}},
+    'large': {'font': {'name': 'Arial', 'size': 12}},
+    'footer': {'font': {'name': 'Arial', 'size': 12, 'bold': True}, 'border': 'none'},
+    'grid': {'border': 'thin'},
+    'center': {'alignment': 'center'},
+}
+
+# 样式属性 -> (工作簿中的样式表, StyleArray 中的索引字段)
+_STYLE_TABLES = {
+    'font': ('_fonts', 'fontId'),
+    'border': ('_borders', 'borderId'),
+    'alignment': ('_alignments', 'alignmentId'),
+}
+
+
+def build_style(definition: dict) -> dict:
+    """
+    样式配置 -> openpyxl 样式对象
+    :param definition: {'font': {...}, 'border': 'thin'/'none', 'alignment': 'center'/{...}}
+    :return: {'font': Font, 'border': Border, 'alignment': Alignment}（只包含定义了的属性）
+    """
+    style = {}
+    if 'font' in definition:
+        style['font'] = Font(**definition['font'])
+    border = definition.get('border')
+    if border == 'thin':
+        style['border'] = THIN_BORDER
+    elif border == 'none':
+        style['border'] = NO_BORDER
+    elif border is not None:
+        raise ValueError(f"未知边框样式: {border}")
+    alignment = definition.get('alignment')
+    if alignment == 'center':
+        style['alignment'] = CENTER
+    elif isinstance(alignment, dict):
+        style['alignment'] = Alignment(**alignment)
+    elif alignment is not None:
+        raise ValueError(f"未知对齐方式: {alignment}")
+    return style
+
+
+class WorkbookStyles:
+    """绑定到一个工作簿的样式，每种样式只在工作簿中登记一次"""
+
+    def __init__(self, wb, styles: Dict[str, dict]):
+        self.wb = wb
+        self.styles = dict(styles)
+        self._ids = {}
+
+    def define(self, name, font=None, border=None, alignment=None):
+        """
+        追加一个只在当前工作簿中使用的样式（如从模板单元格读取的字体）
+        :param name: 样式名称
+        """
+        style = {attr: value for attr, value in
+                 (('font', font), ('border', border), ('alignment', alignment)) if value is not None}
+        self.styles[name] = style
+        self._ids.pop(name, None)
+        return name
+
+    def _style_ids(self, name):
+        ids = self._ids.get(name)
+        if ids is None:
+            ids = []
+            for attr, value in self.styles[name].items():
+                table, field = _STYLE_TABLES[attr]
+                ids.append((field, getattr(self.wb, table).add(value)))
+            self._ids[name] = ids
+        return ids
+
+    def apply(self, cell, name):
+        """设置单元格样式（只覆盖样式中定义的属性）"""
+        ids = self._style_ids(name)
+        if not cell._style:
+            cell._style = StyleArray()
+        for field, style_id in ids:
+            setattr(cell._style, field, style_id)
+
+    def apply_row(self, sheet, row, columns: Iterable[int], name):
+        """给一行中的多个单元格设置同一样式"""
+        ids = self._style_ids(name)
+        for col in columns:
+            cell = sheet.cell(row=row, column=col)
+            if not cell._style:
+                cell._style = StyleArray()
+            for field, style_id in ids:
+                setattr(cell._style, field, style_id)
+
+    def set_value(self, sheet, row, column, value, name):
+        """写入单元格的值并设置样式"""
+        cell = sheet.cell(row=row, column=column)
+        cell.value = value
+        self.apply(cell, name)
+        return cell
+
+
+class StyleRegistry:
+    """命名样式注册表（样式对象在创建时构建一次，可供多个工作簿共用）"""
+
+    def __init__(self, definitions: Dict[str, dict] = None):
+        """
+        :param definitions: 追加或覆盖的样式配置
+        """
+        merged = {**STYLE_DEFINITIONS, **(definitions or {})}
+        self.styles = {name: build_style(definition) for name, definition in merged.items()}
+
+    def __contains__(self, name):
+        return name in self.styles
+
+    def bind(self, wb) -> WorkbookStyles:
+        """绑定到工作簿，每次填充模板时调用一次"""
+        return WorkbookStyles(wb, self.styles)
+
+
+# 默认样式注册表
+style_registry = StyleRegistry()
@@ -35,6 +35,7 @@ MONGO_CONFIG = {
         'use_auth': True,     # 使用认证
         'collections': {
             'msku_info': 'msku_info',
+            'box_specs': 'box_specs',
             'ssh': 'ssh'
         }
     },
@@ -46,6 +47,7 @@ MONGO_CONFIG = {
         'use_auth': False,       # 不使用认证
         'collections': {
             'msku_info': 'msku_info',
+            'box_specs': 'box_specs',
             'ssh': 'ssh'
         }
     }
@@ -0,0 +1,139 @@
+"""
+装箱单Excel流式读取
+按行流式读取工作表（优先使用 python-calamine，否则使用 openpyxl 只读模式），
+由调用方的停止条件决定读到哪一行为止，不再把整个工作簿读成 DataFrame。
+返回的数据与 pd.read_excel(file_path) 的布局一致：第一行作为表头被跳过，行号从0开始。
+"""
+import os
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+import pandas as pd
+from openpyxl import load_workbook
+
+try:
+    from python_calamine import CalamineWorkbook
+except ImportError:  # 可选依赖，未安装时使用 openpyxl
+    CalamineWorkbook = None
+
+# openpyxl 能直接读取的格式，其余格式（如 .xls）交给 calamine 或 pandas
+OPENPYXL_EXTENSIONS = ('.xlsx', '.xlsm', '.xltx', '.xltm')
+
+
+def _normalize(value):
+    """与 pandas 读取Excel时的单元格转换保持一致：空值为None，整数值的浮点数转为int"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _iter_openpyxl_rows(file_path, sheet_name=None) -> Iterator[tuple]:
+    wb = load_workbook(file_path, read_only=True, data_only=True, keep_links=False)
+    try:
+        sheet = wb[sheet_name] if sheet_name is not None else wb.worksheets[0]
+        for row in sheet.iter_rows(values_only=True):
+            yield row
+    finally:
+        wb.close()
+
+
+def _iter_calamine_sheet(sheet) -> Iterator[list]:
+    # calamine 的行从第一个有数据的列开始，需要补齐左侧空列
+    padding = [None] * (sheet.start[1] if sheet.start else 0)
+    for row in sheet.iter_rows():
+        yield padding + row if padding else row
+
+
+def _iter_calamine_rows(file_path, sheet_name=None) -> Iterator[list]:
+    wb = CalamineWorkbook.from_path(file_path)
+    sheet = wb.get_sheet_by_name(sheet_name) if sheet_name is not None else wb.get_sheet_by_index(0)
+    return _iter_calamine_sheet(sheet)
+
+
+def _frame_rows(df) -> Iterator[tuple]:
+    return df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+
+
+def iter_rows(file_path, sheet_name=None) -> Iterator[tuple]:
+    """
+    逐行读取工作表（包含表头行），单元格已做与 pandas 一致的转换
+    :param file_path: Excel文件路径
+    :param sheet_name: 工作表名称（默认第一个工作表）
+    """
+    if CalamineWorkbook is not None:
+        rows = _iter_calamine_rows(file_path, sheet_name)
+    elif os.path.splitext(file_path)[1].lower() in OPENPYXL_EXTENSIONS:
+        rows = _iter_openpyxl_rows(file_path, sheet_name)
+    else:
+        rows = _frame_rows(pd.read_excel(file_path, sheet_name=sheet_name or 0, header=None))
+    for row in rows:
+        yield tuple(_normalize(value) for value in row)
+
+
+def sheet_names(file_path) -> List[str]:
+    """获取工作簿中的工作表名称（只读取工作簿目录，不读取单元格）"""
+    if CalamineWorkbook is not None:
+        return list(CalamineWorkbook.from_path(file_path).sheet_names)
+    if os.path.splitext(file_path)[1].lower() in OPENPYXL_EXTENSIONS:
+        wb = load_workbook(file_path, read_only=True, keep_links=False)
+        try:
+            return list(wb.sheetnames)
+        finally:
+            wb.close()
+    return list(pd.ExcelFile(file_path).sheet_names)
+
+
+def read_all_sheets(file_path) -> Dict[str, List[tuple]]:
+    """
+    只打开一次工作簿，读取所有工作表的全部行（包含表头行）
+    :param file_path: Excel文件路径
+    :return: {工作表名称: 行列表}，按工作表顺序
+    """
+    sheets = {}
+    if CalamineWorkbook is not None:
+        wb = CalamineWorkbook.from_path(file_path)
+        for name in wb.sheet_names:
+            sheets[name] = list(_iter_calamine_sheet(wb.get_sheet_by_name(name)))
+    elif os.path.splitext(file_path)[1].lower() in OPENPYXL_EXTENSIONS:
+        wb = load_workbook(file_path, read_only=True, data_only=True, keep_links=False)
+        try:
+            for sheet in wb.worksheets:
+                sheets[sheet.title] = list(sheet.iter_rows(values_only=True))
+        finally:
+            wb.close()
+    else:
+        for name, df in pd.read_excel(file_path, sheet_name=None, header=None).items():
+            sheets[name] = list(_frame_rows(df))
+    return {name: [tuple(_normalize(value) for value in row) for row in rows] for name, rows in sheets.items()}
+
+
+def read_rows(file_path, stop: Optional[Callable[[int, tuple], bool]] = None,
+              sheet_name=None, rows: Optional[Iterable[tuple]] = None) -> pd.DataFrame:
+    """
+    流式读取装箱单，直到停止条件满足为止
+    :param file_path: Excel文件路径
+    :param stop: 停止条件 stop(行号, 行数据)，返回True时不再读取该行及之后的行；
+                 行号与 pd.read_excel 的 DataFrame 行号一致（不含表头行）
+    :param sheet_name: 工作表名称（默认第一个工作表）
+    :param rows: 已读取的工作表行（包含表头行，见 read_all_sheets），传入时不再读取文件
+    :return: 与 pd.read_excel 布局一致的 DataFrame（列名为列序号）
+    """
+    rows_iter = iter(rows) if rows is not None else iter_rows(file_path, sheet_name)
+    data: List[tuple] = []
+    width = 0
+    last_non_empty = -1
+    next(rows_iter, None)  # 第一行是表头，与 pd.read_excel 保持一致
+    for index, row in enumerate(rows_iter):
+        if stop is not None and stop(index, row):
+            break
+        data.append(row)
+        # 与 pandas 一致：去掉行尾空单元格后计算列数，丢弃末尾的空行
+        for col in range(len(row) - 1, -1, -1):
+            if row[col] is not None:
+                width = max(width, col + 1)
+                last_non_empty = index
+                break
+    data = data[:last_non_empty + 1]
+    return pd.DataFrame([row[:width] + (None,) * (width - len(row[:width])) for row in data],
+                        columns=range(width))
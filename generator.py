@@ -2,15 +2,28 @@ from numpy import add
 from openpyxl import Workbook, load_workbook
 from openpyxl.styles import Font, Border, Side, Alignment, PatternFill
 from openpyxl.drawing.image import Image as XLImage
-from PIL import Image as PILImage
 import os
-import traceback
 import json
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 from db_connector import MongoDBConnector
+from product_cache import ProductTable
+from task_log import get_logger, debug_sampled
 from io import BytesIO
 from openpyxl.utils import get_column_letter
 import re
+from template_engine import load_template_specs
+from template_manifest import TEMPLATE_EXTENSIONS
+from xlsx_patch import XlsxPatchError
+from template_cache import template_cache as default_template_cache
+from image_cache import embed_image_cache as default_image_cache
+from workbook_writer import save_workbook
+from image_index import image_index_for
+from cell_styles import style_registry as default_style_registry, CENTER
+from merged_ranges import MergedRangeIndex
+
+logger = get_logger(__name__)
 
 
 class ProcessingError(Exception):
@@ -18,1118 +31,77 @@ class ProcessingError(Exception):
     pass
 
 
-def template_handler(keyword):
-    """模板处理器装饰器"""
+# 代码实现的模板处理器 {关键字: 方法名}，由 template_handler 装饰器在定义类时登记
+_HANDLER_METHODS = {}
+
+
+def template_handler(keyword, sheet=None):
+    """
+    模板处理器装饰器
+    :param keyword: 模板文件名中的关键字
+    :param sheet: 处理器填充的工作表（生成模板清单时检查模板中是否有该工作表）
+    """
     def decorator(func):
         func._template_keyword = keyword
+        func._template_sheet = sheet
+        _HANDLER_METHODS[keyword] = func.__name__
         return func
     return decorator
 
 
 class InvoiceGenerator:
-    def __init__(self, upload_folder, output_folder, db_connector=None, image_folder=None):
+    def __init__(self, upload_folder, output_folder, db_connector=None, image_folder=None, product_table=None,
+                 template_cache=None, style_registry=None, template_folder=None, image_cache=None):
         """
         初始化发票生成器
         :param upload_folder: 上传文件夹路径
         :param output_folder: 输出文件夹路径
         :param db_connector: 数据库连接器（可选）
         :param image_folder: 图片文件夹路径（可选）
+        :param product_table: 产品共享表（可选，默认映射本机共享表文件）
+        :param template_cache: 模板工作簿缓存（可选，默认使用进程内共享缓存）
+        :param style_registry: 命名样式注册表（可选，默认使用 cell_styles 中的内置样式）
+        :param template_folder: 模板目录（可选，启动时按目录中的模板文件预先计算处理器分派表）
+        :param image_cache: 缩放后的插图缓存（可选，默认使用进程内共享缓存）
         """
         self.db_connector = db_connector if db_connector else MongoDBConnector()
+        # 渲染线程各自创建连接器（MongoDBConnector 每次进入都会替换并在退出时关闭自己的 client，
+        # 多个模板并行渲染时不能共用一个）；外部传入的连接器由调用方负责，直接共用
+        self._db_connector_factory = None if db_connector else MongoDBConnector
+        self.product_table = product_table if product_table else ProductTable()
+        self.template_cache = template_cache if template_cache else default_template_cache
+        self.style_registry = style_registry if style_registry else default_style_registry
+        self.image_cache = image_cache if image_cache else default_image_cache
         self.upload_folder = upload_folder
         self.output_folder = output_folder
+        # 当前线程共用的预取产品信息（shared_products）和当前线程的数据库连接器
+        self._local = threading.local()
         # 获取当前文件所在的目录
         current_dir = os.path.dirname(os.path.abspath(__file__))
         self.image_folder = os.path.join(current_dir, '产品图片(1)')  # 图片文件夹路径
+        self.template_folder = template_folder if template_folder else os.path.join(current_dir, '表格模版')
         
         # 定义模板配置，只列出不需要编码的模板
         self.template_config = {
             "依诺达": {"requires_code": False}  # 不需要编码的模板
         }
         
-        # 初始化模板处理器字典
+        # 初始化模板处理器字典 {关键字: 处理器}
         self._template_handlers = {}
-        # 注册所有带有_template_keyword属性的方法
-        print("开始注册模板处理器...")
-        for name in dir(self):
-            method = getattr(self, name)
-            if hasattr(method, '_template_keyword'):
-                keyword = method._template_keyword
-                self._template_handlers[keyword] = method
-                print(f"注册模板处理器: {name} -> {keyword}")
-        print(f"已注册的模板处理器: {list(self._template_handlers.keys())}")
-
-    @template_handler("叮铛卡航限时达")
-    def _fill_dingdang_template(self, wb, box_data, code=None, address_info=None):
-        """
-        填充叮铛卡航限时达模板
-        :param wb: 工作簿对象
-        :param box_data: 箱子数据
-        :param code: 编码（可选）
-        :param address_info: 地址信息（可选）
-        """
-        with self.db_connector as db:
-            try:
-                sheet = wb['模板']  # 获取模板工作表
-
-                print("开始写入模版信息")
-
-                # 定义样式信息
-                style_info = {
-                    'font': Font(name='Arial', size=10),
-                    'border': Border(left=Side(border_style='thin'),
-                                     right=Side(border_style='thin'),
-                                     top=Side(border_style='thin'),
-                                     bottom=Side(border_style='thin')),
-                    'alignment': Alignment(horizontal='center', vertical='center')
-                }
-
-
-                # 在第一行B列填充编码
-                if code:
-                    cell = sheet.cell(row=1, column=2)  # B列是第2列
-                    cell.value = code
-                    cell.font = Font(name='Arial', size=9)
-
-                # 如果有地址信息，填充到相应的单元格
-                if address_info:
-                    address_info_detail = address_info['address_info']
-                    try:
-                        # 填充收件人信息，这里收件人和
-                        if 'name' in address_info_detail:
-                            cell = sheet.cell(row=4, column=2)  # B2单元格
-                            cell.value = address_info_detail['name']
-
-                            cell = sheet.cell(row=3, column=2)  # B2单元格
-                            cell.value = address_info_detail['name']
-
-                        # 填充地址信息
-                        address_parts = []
-                        if 'addressLine1' in address_info_detail:
-                            address_parts.append(address_info_detail['addressLine1'])
-                        if 'city' in address_info_detail:
-                            address_parts.append(address_info_detail['city'])
-                        if 'stateOrProvinceCode' in address_info_detail:
-                            address_parts.append(address_info_detail['stateOrProvinceCode'])
-                        if 'postalCode' in address_info_detail:
-                            address_parts.append(address_info_detail['postalCode'])
-                        if 'countryCode' in address_info_detail:
-                            address_parts.append(address_info_detail['countryCode'])
-
-                        # 填充地址信息
-                        if 'addressLine1' in address_info_detail:
-                            cell = sheet.cell(row=6, column=2)  # B3单元格
-                            cell.value = address_info_detail['addressLine1']
-
-                        # 城市
-                        if 'city' in address_info_detail:
-                            cell = sheet.cell(row=8, column=2)  # B4单元格
-                            cell.value = address_info_detail['city']
-
-                        #邮政编码
-                        if 'postalCode' in address_info_detail:
-                            cell = sheet.cell(row=10, column=2)  # B6单元格
-                            cell.value = address_info_detail['postalCode']
-
-                        #国家代码
-                        if 'countryCode' in address_info_detail:
-                            cell = sheet.cell(row=11, column=2)  # B7单元格
-                            cell.value = address_info_detail['countryCode']
-
-                        if address_parts:
-                            cell = sheet.cell(row=6, column=2)  # B3单元格
-                            cell.value = ', '.join(address_parts)
-                    except Exception as e:
-                        print(f"填充地址信息时发生错误: {str(e)}")
-
-                try:
-                    total_boxes = len(box_data.keys())
-                    cell = sheet.cell(row=16, column=2)  # 在第7行B列填充箱数
-                    cell.value = str(total_boxes)
-                    cell.font = Font(name='Arial', size=9)
-                except Exception as e:
-                    print(f"填充箱数时发生错误: {str(e)}")
-
-                # 检查所有产品的电磁属性
-                has_electric = False
-                has_magnetic = False
-                for box in box_data.values():
-                    for item in box.items:
-                        product_info = self._get_product_info(item.msku, db)
-                        if product_info:
-                            if product_info.get('electrified', '') == '是':
-                                has_electric = True
-                            if product_info.get('magnetic', '') == '是':
-                                has_magnetic = True
-                            if has_electric and has_magnetic:
-                                break
-                    if has_electric and has_magnetic:
-                        break
-
-                # 在表格顶部添加电磁属性标记
-                if has_electric:
-                    cell = sheet.cell(row=1, column=6)  # F列第1行
-                    cell.value = "是"
-                    cell.font = Font(name='Arial', size=9)
-                
-                if has_magnetic:
-                    cell = sheet.cell(row=2, column=6)  # F列第2行
-                    cell.value = "是"
-                    cell.font = Font(name='Arial', size=9)
-
-                # 填充数据
-                row_num = 18  # 从第18行开始填充
-                index = 1    # 添加序号计数器，从1开始
-
-                # 遍历每个箱子
-
-                sorted_boxes = sorted(box_data.items(), key=lambda x: int(x[0]))
-                
-                # 遍历排序后的箱子
-                for box_number, box in sorted_boxes:
-                    print(f"处理箱子 {box_number}")
-
-                    # 遍历箱子中的每个产品
-                    for item in box.items:
-                        # 从数据库获取产品信息
-                        product_info = self._get_product_info(item.msku, db)
-                        # 处理产品信息为None的情况
-                        if product_info is None:
-                            print(f"警告: 未找到产品 {item.msku} 的信息")
-                            price = 0
-                            total_price = 0
-                        else:
-                            price = product_info.get('price', 0)
-                            total_price = float(price) * item.box_quantities.get(box_number, 0) if price else 0
-                            item.product_name = product_info.get('cn_name', item.product_name)
-                        
-                        # 设置单元格值和样式ç
-                        cell_data = [
-                            (1, box_number),                    # 货箱编号 (A列)
-                            (2, box.weight if box.weight is not None else ""),  # 重量 (B列)
-                            (3,product_info.get('en_name', '') if product_info else ''),  # 链接 (D列)
-                            (4, product_info.get('cn_name', '') if product_info else ''),  # 链接 (D列)
-                            (5, product_info.get('price', '') if product_info else ''),   # 仅在总价格大于0时填入
-                            (6, item.box_quantities.get(box_number, 0)),  # 数量 (F列)
-                            (7, str(product_info.get('material_en', '')+'/'+product_info.get('material_cn', '')) if product_info else ''),  # 材料 (D列) 
-                            (8, product_info.get('hs_code', '') if product_info else ''),  # HS编码 (G列)
-                            (9, str(product_info.get('usage_en', '')+'/'+product_info.get('usage_cn', '' ))if product_info else ''),    # 用途 (H列)
-                            (10, product_info.get('brand', '') if product_info else ''),    # 品牌 (I列)
-                            (11, product_info.get('model', '') if product_info else ''),   # 型号 (J列)
-                            (12, product_info.get('link', '') if product_info else ''),
-                            (14, ''),  # 图片列 (N列)
-                            (15, total_price if total_price > 0 else ""),  # 仅在总价格大于0时填入
-                            (17, box.length if box.length is not None else ""),  # 长度 (Q列)
-                            (18, box.width if box.width is not None else ""),    # 宽度 (R列)
-                            (19, box.height if box.height is not None else "")   # 高度 (S列)
-                        ]
-
-                        # 批量设置单元格值和样式
-                        for column, value in cell_data:
-                            self._set_cell_value(sheet, row_num, column, value, style_info)
-
-                        # 插入产品图片
-                        if item.msku and hasattr(self, 'image_folder'):
-                            try:
-                                image_cell = f"N{row_num}"  # 图片列（第14列）
-                                self.insert_product_image(sheet, image_cell, item.msku, self.image_folder)
-                            except Exception as e:
-                                print(f"插入图片时发生错误: {str(e)}")
-
-                        row_num += 1
-
-            except Exception as e:
-                print(f"填充模板时发生错误: {str(e)}")
-                raise
-
-    @template_handler("顺丰")
-    def _fill_sf_template(self, wb, box_data, code=None, address_info=None):
-        """填充顺丰模板"""
-        """
-        填充顺丰模板
-        :param wb: 工作簿对象
-        :param box_data: 箱子数据
-        :param code: 编码（可选）
-        :param address_info: 地址信息（可选）
-        """
-        with self.db_connector as db:
-            try:
-                sheet = wb['Sheet1']  # 获取模板工作表
-                # box_Reference_id = ''  # 在方法开始时就初始化
-                print("开始写入模版信息")
-
-                # 定义样式信息
-                style_info = {
-                    'font': Font(name='Arial', size=10),
-                    'border': Border(left=Side(border_style='thin'),
-                                     right=Side(border_style='thin'),
-                                     top=Side(border_style='thin'),
-                                     bottom=Side(border_style='thin')),
-                    'alignment': Alignment(horizontal='center', vertical='center')
-                }
-
-                self.unmerge_cells_in_range(sheet, 2, 4, 2, 9)
-
-                # 如果有地址信息，填充到相应的单元格
-                if address_info:
-                    address_info_detail = address_info['address_info']
-                    # if 'seller_info' in address_info:
-                    #     box_Reference_id = address_info['seller_info']['amazonReferenceId']
-                    try:
-                        # 填充收件人信息
-                        if 'name' in address_info_detail:
-                            cell = sheet.cell(row=2, column=2)  
-                            cell.value = address_info_detail['name']
-
-                            cell = sheet.cell(row=3, column=2)  
-                            cell.value = address_info_detail['name']
-                        
-                        # 填充地址信息
-                        address_parts = []
-                        if 'addressLine1' in address_info_detail:
-                            address_parts.append(address_info_detail['addressLine1'])
-                        if 'city' in address_info_detail:
-                            address_parts.append(address_info_detail['city'])
-                        if 'stateOrProvinceCode' in address_info_detail:
-                            address_parts.append(address_info_detail['stateOrProvinceCode'])
-                        if 'postalCode' in address_info_detail:
-                            address_parts.append(address_info_detail['postalCode'])
-                        if 'countryCode' in address_info_detail:
-                            address_parts.append(address_info_detail['countryCode'])
-
-                        if address_parts:
-                            cell = sheet.cell(row=4, column=2)  
-                            cell.value = ', '.join(address_parts)
-  
-                    except Exception as e:
-                        print(f"填充地址信息时发生错误: {str(e)}")
-
-                # 填充数据
-                row_num = 12  
-                index = 1    # 添加序号计数器，从1开始
-
-                # 将box_data按箱号排序
-                sorted_boxes = sorted(box_data.items(), key=lambda x: int(x[0]))
-                
-                # 遍历排序后的箱子
-                for box_number, box in sorted_boxes:
-                    print(f"处理箱子 {box_number}")
-
-                    # 遍历箱子中的每个产品
-                    for item in box.items:
-                        # 从数据库获取产品信息
-                        product_info = self._get_product_info(item.msku, db)
-                        # print(f"产品信息：{product_info}")
-                        # price = product_info.get('price', 0)
-                        # total_price = float(price) * item.box_quantities.get(box_number, 0) if price else 0
-                        price = 0
-                        total_price = 0
-                        # if product_info:
-                        #     item.product_name = product_info.get('cn_name', item.product_name)
-
-
-                        # print(f"产品信息：{product_info}")
-                        if product_info is not None:
-                            item.product_name = product_info.get('cn_name', item.product_name)
-                            print(f"产品信息：{product_info}")
-                        else:
-                        # 处理未找到产品信息的情况
-                            print(f"未找到产品信息，MSKU: {item.msku}")
-                            item.product_name = "需要补数据"  # 可以设置一个默认值
-                        
-                        # box_number_str = code+f"{box_number:05d}" 
-                        box_number_str = code+'00000'+str(box_number)
-                        # Reference_id = ''  # 初始化为None
-                        # if box_Reference_id:
-                        #     Reference_id = box_Reference_id
-                        
-                        # 设置单元格值和样式
-                        cell_data = [
-                            # 基本信息
-                            (1, box_number_str),                                   # 货箱编号
-                            # (2, Reference_id),                                    # 参考编号
-                            (3, item.msku),                                       # 商品编码
-                            # 产品名称信息
-                            (4, product_info.get('en_name', '') if product_info else ''),                 # 英文名称
-                            (5, product_info.get('cn_name', '') if product_info else ''),                 # 中文名称
-                            (6, product_info.get('brand', '') if product_info else ''),                   # 品牌
-                            (7, product_info.get('model', '') if product_info else ''),                   # 型号
-                            
-                            # 产品材料和用途
-                            (8, product_info.get('material_cn', '') if product_info else ''),             # 中文材料
-                            (9, product_info.get('material_en', '') if product_info else ''),             # 英文材料
-                            (10, str(product_info.get('usage_en', '') + 
-                                   product_info.get('usage_cn', '')) if product_info else ''),            # 用途
-                            (11, '纸箱'),                                         # 包装类型
-                            
-                            # 产品规格信息
-                            (12, product_info.get('hs_code', '') if product_info else ''),                # HS编码
-                            (13, item.box_quantities.get(box_number, 0)),         # 数量
-                            
-                            # 箱体信息
-                            (16, box.length if box.length is not None else ""),   # 长度
-                            (17, box.width if box.width is not None else ""),     # 宽度
-                            (18, box.height if box.height is not None else ""),   # 高度
-                            (19, box.weight if box.weight is not None else ""),   # 重量
-                            
-                            # 其他信息
-                            (20, product_info.get('link', '') if product_info else ''),                   # 链接
-                            (21, '')                                              # 图片占位
-                        ]
-                        # 批量设置单元格值和样式
-                        for column, value in cell_data:
-                            self._set_cell_value(sheet, row_num, column, value, style_info)
-
-                        sheet.row_dimensions[row_num].height = sheet.row_dimensions[12].height
-                        
-                        # 插入产品图片
-                        if item.msku and hasattr(self, 'image_folder'):
-                            try:
-                                image_cell = f"U{row_num}"  # 图片列（第14列）
-                                self.insert_product_image(sheet, image_cell, item.msku, self.image_folder)
-                            except Exception as e:
-                                print(f"插入图片时发生错误: {str(e)}")
-
-                        row_num += 1
-                
-                self.merge_cells_in_range(sheet, 2, 2, 2, 9)
-                self.merge_cells_in_range(sheet, 3, 3, 2, 9)
-                self.merge_cells_in_range(sheet, 4, 4, 2, 9)
-
-            except Exception as e:
-                print(f"填充模板时发生错误: {str(e)}")
-                raise
-
-    @template_handler("依诺达")
-    def _fill_ynd_template(self, wb, box_data, code=None, address_info=None):
-        """
-        填充叮铛卡航限时达模板
-        :param wb: 工作簿对象
-        :param box_data: 箱子数据
-        :param code: 编码（可选）
-        :param address_info: 地址信息（可选）
-        """
-        with self.db_connector as db:
-            try:
-                sheet = wb['模板']  # 获取模板工作表
-                self.unmerge_cells_in_range(sheet, 15, 15, 2, 4)
-                self.unmerge_cells_in_range(sheet, 1, 1, 6, 8)
-                self.unmerge_cells_in_range(sheet, 2, 2, 6, 8)
-                print("开始写入模版信息")
-
-                # 定义样式信息
-                style_info = {
-                    'font': Font(name='Arial', size=10),
-                    'border': Border(left=Side(border_style='thin'),
-                                     right=Side(border_style='thin'),
-                                     top=Side(border_style='thin'),
-                                     bottom=Side(border_style='thin')),
-                    'alignment': Alignment(horizontal='center', vertical='center')
-                }
-
-                try:
-                    total_boxes = len(box_data.keys())
-                    cell = sheet.cell(row=15, column=2)  #填充箱数
-                    cell.value = str(total_boxes)
-                    cell.font = Font(name='Arial', size=9)
-                except Exception as e:
-                    print(f"填充箱数时发生错误: {str(e)}")
-
-                # 检查所有产品的电磁属性
-                has_electric = False
-                has_magnetic = False
-                for box in box_data.values():
-                    for item in box.items:
-                        product_info = self._get_product_info(item.msku, db)
-                        if product_info:
-                            if product_info.get('electrified', '') == '是':
-                                has_electric = True
-                            if product_info.get('magnetic', '') == '是':
-                                has_magnetic = True
-                            if has_electric and has_magnetic:
-                                break
-                    if has_electric and has_magnetic:
-                        break
-
-                # 在表格顶部添加电磁属性标记
-                if has_electric:
-                    cell = sheet.cell(row=1, column=6)  # F列第1行
-                    cell.value = "是"
-                    cell.font = Font(name='Arial', size=9)
-                
-                if has_magnetic:
-                    cell = sheet.cell(row=2, column=6)  # F列第2行
-                    cell.value = "是"
-                    cell.font = Font(name='Arial', size=9)
-
-                # 填充数据
-                row_num = 17  # 从第18行开始填充
-                index = 1    # 添加序号计数器，从1开始
-                row_height = sheet.row_dimensions[17].height
-
-                # 遍历每个箱子
-                sorted_boxes = sorted(box_data.items(), key=lambda x: int(x[0]))
-                
-                # 遍历排序后的箱子
-                for box_number, box in sorted_boxes:
-                    print(f"处理箱子 {box_number}")
-
-                    # 遍历箱子中的每个产品
-                    for item in box.items:
-                        # 从数据库获取产品信息
-                        product_info = self._get_product_info(item.msku, db)
-                        # 处理产品信息为None的情况
-                        if product_info is None:
-                            print(f"警告: 未找到产品 {item.msku} 的信息")
-                            price = 0
-                            total_price = 0
-                        else:
-                            price = product_info.get('price', 0)
-                            total_price = float(price) * item.box_quantities.get(box_number, 0) if price else 0
-                            item.product_name = product_info.get('cn_name', item.product_name)
-                        
-                        # 设置单元格值和样式ç
-                        cell_data = [
-                            (1, box_number),                    # 货箱编号 (A列)
-                            (2, box.weight if box.weight is not None else ""),  # 重量 
-                            (3, box.length if box.length is not None else ""),  # 长度 
-                            (4, box.width if box.width is not None else ""),    # 宽度 
-                            (5, box.height if box.height is not None else "") ,  # 高度 
-                            (6, item.msku),                    
-                            (7,product_info.get('en_name', '') if product_info else ''),  # 链接 (D列)
-                            (8, product_info.get('cn_name', '') if product_info else ''),  # 链接 (D列)
-                            # (5, product_info.get('price', '') if product_info else ''),   # 仅在总价格大于0时填入
-                            (10, item.box_quantities.get(box_number, 0)),  # 数量 (F列)
-                            (11, str(product_info.get('material_en', '')+'/'+product_info.get('material_cn', '')) if product_info else ''),  # 材料 (D列) 
-                            (13, product_info.get('hs_code', '') if product_info else ''),  # HS编码 (G列)
-                            (12, str(product_info.get('usage_en', '')+'/'+product_info.get('usage_cn', '' ))if product_info else ''),    # 用途 (H列)
-                            (14, product_info.get('brand', '') if product_info else ''),    # 品牌 (I列)
-                            (15, product_info.get('model', '') if product_info else ''),   # 型号 (J列)
-                            (16, product_info.get('link', '') if product_info else ''),
-                            (17, ''),  # 图片列 (N列)
-                            # (15, total_price if total_price > 0 else ""),  # 仅在总价格大于0时填入
-                          
-                        ]
-
-                        # 批量设置单元格值和样式
-                        for column, value in cell_data:
-                            self._set_cell_value(sheet, row_num, column, value, style_info)
-
-                        sheet.row_dimensions[row_num].height = row_height
-                        # 插入产品图片
-                        if item.msku and hasattr(self, 'image_folder'):
-                            try:
-                                image_cell = f"Q{row_num}"  # 图片列（第14列）
-                                self.insert_product_image(sheet, image_cell, item.msku, self.image_folder)
-                            except Exception as e:
-                                print(f"插入图片时发生错误: {str(e)}")
-
-                        row_num += 1
-
-                self.merge_cells_in_range(sheet, 15, 15, 2, 4)
-                self.merge_cells_in_range(sheet, 1, 1, 6, 8)
-                self.merge_cells_in_range(sheet, 2, 2, 6, 8)
-
-
-            except Exception as e:
-                print(f"填充模板时发生错误: {str(e)}")
-                raise
-
-    @template_handler("叮铛(美洲)")
-    def _fill_ddmz_template(self, wb, box_data, code=None, address_info=None):
-        """
-        填充叮铛卡航限时达模板
-        :param wb: 工作簿对象
-        :param box_data: 箱子数据
-        :param code: 编码（可选）
-        :param address_info: 地址信息（可选）
-        """
-        with self.db_connector as db:
-            try:
-                sheet = wb['清关发票']  # 获取模板工作表
-
-                print("开始写入模版信息")
-
-                # 定义样式信息
-                style_info = {
-                    'font': Font(name='Arial', size=10),
-                    'border': Border(left=Side(border_style='thin'),
-                                     right=Side(border_style='thin'),
-                                     top=Side(border_style='thin'),
-                                     bottom=Side(border_style='thin')),
-                    'alignment': Alignment(horizontal='center', vertical='center')
-                }
-
-                self.unmerge_cells_in_range(sheet, 3, 3, 8, 15)
-                self.unmerge_cells_in_range(sheet, 4, 4, 8, 15)
-                self.unmerge_cells_in_range(sheet, 5, 5, 8, 11)
-                self.unmerge_cells_in_range(sheet, 5, 5, 13, 15)
-                self.unmerge_cells_in_range(sheet, 6, 6, 8, 15)
-                self.unmerge_cells_in_range(sheet, 7, 7, 8, 11)
-                self.unmerge_cells_in_range(sheet, 7, 7,13, 15)
-                self.unmerge_cells_in_range(sheet, 8, 8,13, 15)
-
-                # 在第一行B列填充编码
-                if code:
-                    cell = sheet.cell(row=3, column=2)  # B列是第2列
-                    cell.value = code
-                    cell.font = Font(name='Arial', size=9)
-
-                # 如果有地址信息，填充到相应的单元格
-                if address_info:
-                    address_info_detail = address_info['address_info']
-                    try:
-                        # 填充收件人信息，这里收件人和
-                        if 'name' in address_info_detail:
-                            cell = sheet.cell(row=3, column=8)  # B2单元格
-                            cell.value = address_info_detail['name']
-
-                            cell = sheet.cell(row=4, column=8)  # B2单元格
-                            cell.value = address_info_detail['name']
-
-                            cell = sheet.cell(row=8, column=13)  # B2单元格
-                            cell.value = address_info_detail['name']
-
-                        # 填充地址信息
-                        address_parts = []
-                        if 'addressLine1' in address_info_detail:
-                            address_parts.append(address_info_detail['addressLine1'])
-                        if 'city' in address_info_detail:
-                            address_parts.append(address_info_detail['city'])
-                        if 'stateOrProvinceCode' in address_info_detail:
-                            address_parts.append(address_info_detail['stateOrProvinceCode'])
-                        if 'postalCode' in address_info_detail:
-                            address_parts.append(address_info_detail['postalCode'])
-                        if 'countryCode' in address_info_detail:
-                            address_parts.append(address_info_detail['countryCode'])
-
-                        # 填充地址信息
-                        # if 'addressLine1' in address_info_detail:
-                        #     cell = sheet.cell(row=6, column=2)  # B3单元格
-                        #     cell.value = address_info_detail['addressLine1']
-
-                        # 城市
-                        if 'city' in address_info_detail:
-                            cell = sheet.cell(row=7, column=8)  # B4单元格
-                            cell.value = address_info_detail['city']
-
-                        #省份
-                        if 'stateOrProvinceCode' in address_info_detail:
-                            cell = sheet.cell(row=7, column=13)  # B5单元格
-                            cell.value = address_info_detail['stateOrProvinceCode']
-
-                        #邮政编码
-                        if 'postalCode' in address_info_detail:
-                            cell = sheet.cell(row=5, column=13)  # B6单元格
-                            cell.value = address_info_detail['postalCode']
-
-                        #国家代码
-                        if 'countryCode' in address_info_detail:
-                            cell = sheet.cell(row=5, column=8)  # B7单元格
-                            cell.value = address_info_detail['countryCode']
-
-                        if address_parts:
-                            cell = sheet.cell(row=6, column=8)  # B3单元格
-                            cell.value = ', '.join(address_parts)
-                    except Exception as e:
-                        print(f"填充地址信息时发生错误: {str(e)}")
-
-                try:
-                    total_boxes = len(box_data.keys())
-                    cell = sheet.cell(row=3, column=6)  # 在第7行B列填充箱数
-                    cell.value = str(total_boxes)
-                    cell.font = Font(name='Arial', size=9)
-                except Exception as e:
-                    print(f"填充箱数时发生错误: {str(e)}")
-
-
-                # 填充数据
-                row_num = 12  # 从第18行开始填充
-                index = 1    # 添加序号计数器，从1开始
-                row_height = sheet.row_dimensions[12].height
-                Reference_id = ''
-
-                # 遍历每个箱子
-                sorted_boxes = sorted(box_data.items(), key=lambda x: int(x[0]))
-                
-                # 遍历排序后的箱子
-                for box_number, box in sorted_boxes:
-                    print(f"处理箱子 {box_number}")
-
-                    # 遍历箱子中的每个产品
-                    for item in box.items:
-                        # 从数据库获取产品信息
-                        product_info = self._get_product_info(item.msku, db)
-                        # 处理产品信息为None的情况
-                        if product_info is None:
-                            print(f"警告: 未找到产品 {item.msku} 的信息")
-                            price = 0
-                            total_price = 0
-                        else:
-                            price = product_info.get('price', 0)
-                            total_price = float(price) * item.box_quantities.get(box_number, 0) if price else 0
-                            item.product_name = product_info.get('cn_name', item.product_name)
-                        Reference_id = address_info['address_info'].get('amazonReferenceId','')
-
-                        # 设置单元格值和样式
-                        cell_data = [
-                            (1, code+f"{box_number:05d}"),                    
-                            # (2, box.weight if box.weight is not None else ""),  
-                            (2,Reference_id),  
-                            (3,f"{box.length}*{box.width}*{box.height}"),  
-                            (4,box_number), 
-                            (5,box.weight), 
-                            (6, product_info.get('hs_code', '') if product_info else ''),  
-                            (8,product_info.get('en_name', '') if product_info else ''),  
-                            (7, product_info.get('cn_name', '') if product_info else ''), 
-                            (9, item.box_quantities.get(box_number, 0)),
-                            (10,''),
-                            (11, product_info.get('brand', '') if product_info else ''),    
-                            (12, product_info.get('model', '') if product_info else ''),  
-                            (13, str(product_info.get('material_cn', '')) if product_info else ''),  
-                            (14, str(product_info.get('usage_cn', '')+product_info.get('usage_en', '' ))if product_info else ''),    # 用途 (H列)
-                            (15, ''),  
-                        ]
-
-                        # 批量设置单元格值和样式
-                        for column, value in cell_data:
-                            self._set_cell_value(sheet, row_num, column, value, style_info)
-
-                        sheet.row_dimensions[row_num].height = row_height
-
-                        # 插入产品图片
-                        if item.msku and hasattr(self, 'image_folder'):
-                            try:
-                                image_cell = f"O{row_num}"  # 图片列（第14列）
-                                self.insert_product_image(sheet, image_cell, item.msku, self.image_folder)
-                            except Exception as e:
-                                print(f"插入图片时发生错误: {str(e)}")
-
-                        row_num += 1
-                
-                self.merge_cells_in_range(sheet, 3, 3, 8, 15)
-                self.merge_cells_in_range(sheet, 4, 4, 8, 15)
-                self.merge_cells_in_range(sheet, 5, 5, 8, 11)
-                self.merge_cells_in_range(sheet, 5, 5, 13, 15)
-                self.merge_cells_in_range(sheet, 6, 6, 8, 15)
-                self.merge_cells_in_range(sheet, 7, 7, 8, 11)
-                self.merge_cells_in_range(sheet, 7, 7,13, 15)
-                self.merge_cells_in_range(sheet, 8, 8,13, 15)
-                
-            except Exception as e:
-                print(f"填充模板时发生错误: {str(e)}")
-                raise
-
-    @template_handler("UPS(美洲)")
-    def _fill_ups_template(self, wb, box_data, code=None, address_info=None):
-        """
-        填充UPS美洲模板
-        :param wb: 工作簿对象
-        :param box_data: 箱子数据
-        :param code: 编码（可选）
-        :param address_info: 地址信息（可选）
-        """
-        with self.db_connector as db:
-            try:
-                sheet = wb['发票']  # 获取发票工作表
-                
-                # 定义样式信息
-                style_info = {
-                    'font': Font(name='Arial', size=10),
-                    'border': Border(left=Side(border_style='thin'),
-                                     right=Side(border_style='thin'),
-                                     top=Side(border_style='thin'),
-                                     bottom=Side(border_style='thin')),
-                    'alignment': Alignment(horizontal='center', vertical='center')
-                }
-
-
-                # 解除合并单元格
-                print("正在解除合并单元格...")
-                # self.unmerge_cells_in_range(sheet, 13, 16, 1, 15)
-                self.unmerge_cells_in_range(sheet, 4, 4, 1, 3)
-                self.unmerge_cells_in_range(sheet, 7, 11, 1, 3)
-                self.unmerge_cells_in_range(sheet, 7, 11, 4, 15)
-                
-                row_num = 13  # 从第13行开始填充数据
-                total_quantity = 0
-                total_amount = 0
-                total_weight = 0
-                
-                
-                if code:
-                    cell = sheet.cell(row=4, column=1)  # B列是第2列
-                    cell.value = f"运单号码:{code}"
-                    cell.font = Font(name='Arial', size=12)
-
-                    cell_another = sheet.cell(row=7, column=1)  # B列是第2列
-                    cell_another.value = f"FBA编号:{code}"
-                    cell_another.font = Font(name='Arial', size=12)
-                
-                  # 如果有地址信息，填充到相应的单元格
-                if address_info:
-                    address_info_detail = address_info['address_info']
-                    try:
-
-                        # 填充地址信息
-                        address_parts = []
-                        if 'addressLine1' in address_info_detail:
-                            address_parts.append(address_info_detail['addressLine1'])
-                        if 'city' in address_info_detail:
-                            address_parts.append(address_info_detail['city'])
-                        if 'stateOrProvinceCode' in address_info_detail:
-                            address_parts.append(address_info_detail['stateOrProvinceCode'])
-                        if 'postalCode' in address_info_detail:
-                            address_parts.append(address_info_detail['postalCode'])
-                        if 'countryCode' in address_info_detail:
-                            address_parts.append(address_info_detail['countryCode'])
-
-                        if address_parts:
-                            cell = sheet.cell(row=7, column=4)  # B3单元格
-                            cell.value = ', '.join(address_parts)
-                            cell.font = Font(name='Arial', size=12)
-                    except Exception as e:
-                        print(f"填充地址信息时发生错误: {str(e)}")
-            
-                # 遍历每个箱子
-                sorted_boxes = sorted(box_data.items(), key=lambda x: int(x[0]))
-                row_height = sheet.row_dimensions[13].height
-                
-                # 遍历排序后的箱子
-                for box_number, box in sorted_boxes:
-                    if not box.items:
-                        continue
-                    
-                    start_row = row_num  # 记录当前箱子的起始行
-                    box_items_count = len(box.items)
-                    
-                    for item in box.items:
-                        # 获取产品信息
-                        product_info = self._get_product_info(item.msku, db)
-                        # 处理产品信息为None的情况
-                        if product_info is None:
-                            print(f"警告: 未找到产品 {item.msku} 的信息")
-                            price = 0
-                            total_price = 0
-                        else:
-                            price = product_info.get('price', 0)
-                            total_price = float(price) * item.box_quantities.get(box_number, 0) if price else 0
-                            item.product_name = product_info.get('cn_name', item.product_name)
-                        
-                        # 累计总数和总金额
-                        total_quantity += item.box_quantities.get(box_number, 0)
-                        total_amount += total_price
-                        total_weight += box.weight
-
-                        # 设置单元格值
-                        cell_data = [
-                            (1, f"{code}00000{box_number}" if item == box.items[0] else ""),  # FBA号,只在第一行显示
-                            (2, box_number if item == box.items[0] else ""),  # 箱号,只在第一行显示
-                            (3, product_info.get('cn_name', '') if product_info else ''),  # 中文品名
-                            (4, product_info.get('en_name', '') if product_info else ''),  # 英文品名
-                            (5, price),  # 单价
-                            (6, item.box_quantities.get(box_number, 0)),  # 数量
-                            (7, total_price),  # 总价
-                            (8, f"{product_info.get('material_cn', '')}/{product_info.get('material_en', '')}" if product_info else ''),  # 材质
-                            (9, f"{product_info.get('usage_cn', '')}/{product_info.get('usage_en', '')}" if product_info else ''),  # 用途
-                            (10, box.weight if item == box.items[0] else ""),  # 毛重,只在第一行显示
-                            (11, box.length if item == box.items[0] else ""),  # 长,只在第一行显示
-                            (12, box.width if item == box.items[0] else ""),  # 宽,只在第一行显示
-                            (13, box.height if item == box.items[0] else ""),  # 高,只在第一行显示
-                            (14, product_info.get('brand', '') if product_info else ''),  # 品牌
-                            (15, product_info.get('hs_code', '') if product_info else '')  # HS编码
-                        ]
-                        
-                        # 批量设置单元格值和样式
-                        for column, value in cell_data:
-                            self._set_cell_value(sheet, row_num, column, value, style_info)
-
-                        sheet.row_dimensions[row_num].height = row_height
-                        row_num += 1
-                    
-                    # 如果这个箱子有多个产品,需要合并单元格
-                    if box_items_count > 1:
-                        merge_columns = [1, 2, 10, 11, 12, 13]  # 需要合并的列
-                        for col in merge_columns:
-                            self.merge_cells_in_range(sheet, start_row, row_num-1, col, col)
-
-                # 添加总计行
-                total_row = row_num
-                self._set_cell_value(sheet, total_row, 1, "总件数", style_info)
-                self._set_cell_value(sheet, total_row, 2, len(box_data), style_info)
-                self._set_cell_value(sheet, total_row, 6, total_quantity, style_info)
-                self._set_cell_value(sheet, total_row, 7, total_amount, style_info)
-                self._set_cell_value(sheet, total_row, 9, "总重", style_info)
-                self._set_cell_value(sheet, total_row, 10, total_weight, style_info)
-                
-                def set_cell_value(sheet, row, column, value, font_size=12):
-                    cell = sheet.cell(row=row, column=column)
-                    cell.value = value
-                    cell.font = Font(name='Arial', size=font_size,bold=True)
-                    no_border = Border(left=Side(border_style=None),
-                                right=Side(border_style=None),
-                                top=Side(border_style=None),
-                                bottom=Side(border_style=None))
-                    cell.border = no_border
-                    
-                def add_border_to_range(sheet, start_row, end_row, start_col, end_col):
-                    border = Border(
-                        left=Side(style='thin'),
-                        right=Side(style='thin'),
-                        top=Side(style='thin'),
-                        bottom=Side(style='thin')
-                    )
-                    for row in range(start_row, end_row + 1):
-                        for col in range(start_col, end_col + 1):
-                            cell = sheet.cell(row=row, column=col)
-                            cell.border = border
-
-                    # 为数据区域添加边框（从表头到合计行）
-                add_border_to_range(sheet,total_row, total_row, 1, 15)
-
-                # 使用辅助函数设置单元格
-                made_in_row = total_row + 2
-                current_date = datetime.now().strftime("%Y.%m.%d")
-                set_cell_value(sheet, made_in_row, 11, "DATE")
-                set_cell_value(sheet, made_in_row+1, 11, f"签字日期:{current_date}")
-                set_cell_value(sheet, made_in_row, 1, "Made in China")
-
-                # 设置行高
-                # for row in range(13, row_num):
-                #     sheet.row_dimensions[row].height = 
-                self.merge_cells_in_range(sheet, 4, 4, 1, 3)
-                self.merge_cells_in_range(sheet, 7, 11, 1, 3)
-                self.merge_cells_in_range(sheet, 7, 11, 4, 15)
-
-            except Exception as e:
-                print(f"填充模板时发生错误: {str(e)}")
-                raise
-
-    @template_handler("林道")
-    def _fill_lindao_template(self, wb, box_data, code=None, address_info=None):
-        """
-        填充叮铛卡航限时达模板
-        :param wb: 工作簿对象
-        :param box_data: 箱子数据
-        :param code: 编码（可选）
-        :param address_info: 地址信息（可选）
-        """
-        with self.db_connector as db:
-            try:
-                sheet = wb['模板']  # 获取模板工作表
-                self.unmerge_cells_in_range(sheet, 3, 3, 2, 4)
-                self.unmerge_cells_in_range(sheet, 4, 4, 2, 4)
-                self.unmerge_cells_in_range(sheet, 5, 5, 2, 4)
-                self.unmerge_cells_in_range(sheet, 6, 6, 2, 4)
-                self.unmerge_cells_in_range(sheet, 9, 9, 2, 4)
-                self.unmerge_cells_in_range(sheet, 11, 11, 2, 4)
-                self.unmerge_cells_in_range(sheet, 12, 12, 2, 4)
-                self.unmerge_cells_in_range(sheet, 15, 15, 2, 4)
-
-                self.unmerge_cells_in_range(sheet, 13, 13, 6, 8)
-                self.unmerge_cells_in_range(sheet, 14, 14, 6, 8)
-                self.unmerge_cells_in_range(sheet, 15, 15, 6, 8)
-                print("开始写入林道模版信息")
-
-                box_Reference_id = '' 
-
-                # 定义样式信息
-                style_info = {
-                    'font': Font(name='Arial', size=10),
-                    'border': Border(left=Side(border_style='thin'),
-                                     right=Side(border_style='thin'),
-                                     top=Side(border_style='thin'),
-                                     bottom=Side(border_style='thin')),
-                    'alignment': Alignment(horizontal='center', vertical='center')
-                }
-
-
-                # 在第一行B列填充编码
-                if code:
-                    cell = sheet.cell(row=1, column=2)  # B列是第2列
-                    cell.value = code
-                    cell.font = Font(name='Arial', size=9)
-
-                # 如果有地址信息，填充到相应的单元格
-                if address_info:
-                    address_info_detail = address_info['address_info']
-
-                    if address_info_detail['amazonReferenceId']:
-                        box_Reference_id =address_info_detail['amazonReferenceId']
-                    try:
-                        # 填充收件人信息，这里收件人和
-                        if 'name' in address_info_detail:
-                            cell = sheet.cell(row=4, column=2)  # B2单元格
-                            cell.value = address_info_detail['name']
-
-                            cell = sheet.cell(row=3, column=2)  # B2单元格
-                            cell.value = address_info_detail['name']
-
-                            cell = sheet.cell(row=5, column=2)  # B2单元格
-                            cell.value = address_info_detail['name']
-
-                        # 填充地址信息
-                        address_parts = []
-                        if 'addressLine1' in address_info_detail:
-                            address_parts.append(address_info_detail['addressLine1'])
-                        if 'city' in address_info_detail:
-                            address_parts.append(address_info_detail['city'])
-                        if 'stateOrProvinceCode' in address_info_detail:
-                            address_parts.append(address_info_detail['stateOrProvinceCode'])
-                        if 'postalCode' in address_info_detail:
-                            address_parts.append(address_info_detail['postalCode'])
-                        if 'countryCode' in address_info_detail:
-                            address_parts.append(address_info_detail['countryCode'])
-
-                        # 填充地址信息
-                        if 'addressLine1' in address_info_detail:
-                            cell = sheet.cell(row=6, column=2)  # B3单元格
-                            cell.value = address_info_detail['addressLine1']
-
-                        # 城市
-                        if 'city' in address_info_detail:
-                            cell = sheet.cell(row=9, column=2)  # B4单元格
-                            cell.value = address_info_detail['city']
-
-                        #邮政编码
-                        if 'postalCode' in address_info_detail:
-                            cell = sheet.cell(row=11, column=2)  # B6单元格
-                            cell.value = address_info_detail['postalCode']
-
-                        #国家代码
-                        if 'countryCode' in address_info_detail:
-                            cell = sheet.cell(row=12, column=2)  # B7单元格
-                            cell.value = address_info_detail['countryCode']
-
-                        if address_parts:
-                            cell = sheet.cell(row=7, column=2)  # B3单元格
-                            cell.value = ', '.join(address_parts)
-                    except Exception as e:
-                        print(f"填充地址信息时发生错误: {str(e)}")
-
-                try:
-                    total_boxes = len(box_data.keys())
-                    cell = sheet.cell(row=15, column=2)  # 在第7行B列填充箱数
-                    cell.value = str(total_boxes)
-                    cell.font = Font(name='Arial', size=9)
-                except Exception as e:
-                    print(f"填充箱数时发生错误: {str(e)}")
-
-                # 检查所有产品的电磁属性
-                has_electric = False
-                has_magnetic = False
-                for box in box_data.values():
-                    for item in box.items:
-                        product_info = self._get_product_info(item.msku, db)
-                        if product_info:
-                            if product_info.get('electrified', '') == '是':
-                                has_electric = True
-                            if product_info.get('magnetic', '') == '是':
-                                has_magnetic = True
-                            if has_electric and has_magnetic:
-                                break
-                    if has_electric and has_magnetic:
-                        break
-
-                # 在表格顶部添加电磁属性标记
-                if has_electric:
-                    cell = sheet.cell(row=1, column=6)  # F列第1行
-                    cell.value = "是"
-                    cell.font = Font(name='Arial', size=9)
-                
-                if has_magnetic:
-                    cell = sheet.cell(row=2, column=6)  # F列第2行
-                    cell.value = "是"
-                    cell.font = Font(name='Arial', size=9)
-
-                # 填充数据
-                row_num = 17  # 从第18行开始填充
-                index = 1    # 添加序号计数器，从1开始
-                row_height = sheet.row_dimensions[17].height
-
-                # 遍历每个箱子
-
-                sorted_boxes = sorted(box_data.items(), key=lambda x: int(x[0]))
-                
-                # 遍历排序后的箱子
-                for box_number, box in sorted_boxes:
-                    print(f"处理箱子 {box_number}")
-
-                    # 遍历箱子中的每个产品
-                    for item in box.items:
-                        # 从数据库获取产品信息
-                        product_info = self._get_product_info(item.msku, db)
-
-                        Reference_id = None  # 初始化为None
-                        if box_Reference_id:
-                            Reference_id = box_Reference_id
-                        # 处理产品信息为None的情况
-                        if product_info is None:
-                            print(f"警告: 未找到产品 {item.msku} 的信息")
-                            price = 0
-                            total_price = 0
-                        else:
-                            price = product_info.get('price', 0)
-                            total_price = float(price) * item.box_quantities.get(box_number, 0) if price else 0
-                            item.product_name = product_info.get('cn_name', item.product_name)
-
-                        
-                        # 设置单元格值和样式ç
-                        cell_data = [
-                            (1, box_number),                    # 货箱编号 (A列)
-                            (2, code),
-                            (3,Reference_id if Reference_id is not None else ""), 
-                            (4, box.weight if box.weight is not None else ""),  # 重量 (B列)
-                            (5, box.length if box.length is not None else ""),  # 长度 (Q列)
-                            (6, box.width if box.width is not None else ""),    # 宽度 (R列)
-                            (7, box.height if box.height is not None else ""),   # 高度 (S列)
-                            (8,product_info.get('en_name', '') if product_info else ''),  # 链接 (D列)
-                            (9, product_info.get('cn_name', '') if product_info else ''),  # 链接 (D列)
-                            (10, product_info.get('price', '') if product_info else ''),   # 仅在总价格大于0时填入
-                            (11,"美元"),  
-                            (12, item.box_quantities.get(box_number, 0)),  # 数量 (F列)
-                            (13, str(product_info.get('material_en', '')+'/'+product_info.get('material_cn', '')) if product_info else ''),  # 材料 (D列) 
-                            (14, product_info.get('hs_code', '') if product_info else ''),  # HS编码 (G列)
-                            (15, str(product_info.get('usage_en', '')+'/'+product_info.get('usage_cn', '' ))if product_info else ''),    # 用途 (H列)
-                            (16, product_info.get('brand', '') if product_info else ''),    # 品牌 (I列)
-                            (17, product_info.get('model', '') if product_info else ''),   # 型号 (J列)
-                            # (12, product_info.get('link', '') if product_info else ''),
-                            (18, ''),  # 图片列 (N列)
-                            # (15, total_price if total_price > 0 else ""),  # 仅在总价格大于0时填入
-                            # (24,item.SKU)
-                        ]
-
-                        # 批量设置单元格值和样式
-                        for column, value in cell_data:
-                            self._set_cell_value(sheet, row_num, column, value, style_info)
-
-                        sheet.row_dimensions[row_num].height = row_height
-                        # 插入产品图片
-                        if item.msku and hasattr(self, 'image_folder'):
-                            try:
-                                image_cell = f"R{row_num}" 
-                                self.insert_product_image(sheet, image_cell, item.msku, self.image_folder)
-                            except Exception as e:
-                                print(f"插入图片时发生错误: {str(e)}")
-
-                        row_num += 1
-
-                self.merge_cells_in_range(sheet, 3, 3, 2, 4)
-                self.merge_cells_in_range(sheet, 4, 4, 2, 4)
-                self.merge_cells_in_range(sheet, 5, 5, 2, 4)
-                self.merge_cells_in_range(sheet, 6, 6, 2, 4)
-                self.merge_cells_in_range(sheet, 9, 9, 2, 4)
-                self.merge_cells_in_range(sheet, 11, 11, 2, 4)
-                self.merge_cells_in_range(sheet, 12, 12, 2, 4)
-                self.merge_cells_in_range(sheet, 15, 15, 2, 4)
-                self.merge_cells_in_range(sheet, 13, 13, 6, 8)
-                self.merge_cells_in_range(sheet, 14, 14, 6, 8)
-                self.merge_cells_in_range(sheet, 15, 15, 6, 8)
-            except Exception as e:
-                print(f"填充模板时发生错误: {str(e)}")
-                raise
-
-    @template_handler("林道UPS")
+        # 注册 template_handler 装饰器登记的方法
+        for keyword, method_name in _HANDLER_METHODS.items():
+            self._template_handlers[keyword] = getattr(self, method_name)
+            logger.debug("注册模板处理器: %s -> %s", method_name, keyword)
+        # 注册 template_specs/ 中的声明式模板（启动时编译一次）
+        for spec in load_template_specs().values():
+            for keyword in spec.keywords:
+                self._template_handlers[keyword] = spec.bind(self)
+                logger.debug("注册模板配置: %s -> %s", spec.name, keyword)
+        logger.debug("已注册的模板处理器: %s", list(self._template_handlers.keys()))
+        # 模板名称 -> 关键字 的分派表（生成发票时只查一次字典）
+        self._dispatch = self._build_dispatch(self.template_folder)
+
+    @template_handler("林道UPS", sheet='发票')
     def _fill_lindaoUPS_template(self, wb, box_data, code=None, address_info=None):
         """
         填充林道UPS模板
@@ -1140,16 +112,12 @@ class InvoiceGenerator:
         """
         try:
             sheet = wb['发票']
-            
+            styles = self.style_registry.bind(wb)
+
             # 解除单元格合并
             ranges_to_unmerge = ['A22:D22', 'A23:D23', 'A24:D24', 'A25:D25',
                                'A26:D26', 'A27:D27']
-            for range_str in ranges_to_unmerge:
-                try:
-                    start_row, end_row, start_col, end_col = self._parse_range(range_str)
-                    self.unmerge_cells_in_range(sheet, start_row, end_row, start_col, end_col)
-                except Exception as e:
-                    print(f"解除单元格合并时出错 {range_str}: {str(e)}")
+            MergedRangeIndex(sheet).unmerge(*(self._parse_range(r) for r in ranges_to_unmerge))
 
             # 保存特定行的高度
             row_23_height = sheet.row_dimensions[23].height if 23 in sheet.row_dimensions else 15
@@ -1200,16 +168,18 @@ class InvoiceGenerator:
                 vertAlign=cell_style.font.vertAlign,
                 color=cell_style.font.color
             )
-            cell_alignment = Alignment(horizontal='center', vertical='center')
-            # 填充数据
+            styles.define('row', font=cell_font, border=cell_border, alignment=CENTER)
+            styles.define('text', font=cell_font, alignment=CENTER)
+            styles.define('e24', font=cell_font_e24, alignment=cell_alignment_e24)
+            # 填充数据（产品信息按 MSKU 一次取出）
+            products = self._get_products(item.msku for box in box_data.values() for item in box.items)
             num_row = 19
             for box_number, box in box_data.items():
                 if not box.items:
                     continue
                 for product_info in box.items:
                     # 获取产品信息
-                    # 获取产品信息
-                    db_product_info = self._get_product_info(product_info.msku)
+                    db_product_info = products.get(product_info.msku)
                     if not db_product_info:
                         continue
 
@@ -1220,81 +190,71 @@ class InvoiceGenerator:
 
                     # 设置单元格值
                     cell_values = [
-                        (1, name), 
-                        (2, quantity), 
-                        (3, price), 
+                        (1, name),
+                        (2, quantity),
+                        (3, price),
                         (4, quantity * price),
-                        ('CN', 5)
+                        (5, 'CN')
                     ]
-                    
-                    for value, col in cell_values:
-                        cell = sheet.cell(row=num_row, column=col, value=value)
-                        cell.font = cell_font
-                        cell.alignment = cell_alignment
-                        cell.border = cell_border
+
+                    for col, value in cell_values:
+                        sheet.cell(row=num_row, column=col).value = value
+                    styles.apply_row(sheet, num_row, range(1, 6), 'row')
                     num_row += 1
 
-            # 设置行高和边框
+            # 设置行高
             for row in range(19, num_row + 8):
                 sheet.row_dimensions[row].height = row_height
-                for col in range(1, 6):
-                    cell = sheet.cell(row=row, column=col)
-                    if not cell.border:
-                        cell.border = cell_border
 
             # 添加底部文本
             declarations = [
-                ('THESE COMMODITIES ARE LICENSED FOR THE UNTIMATE DESTINATION SHOWN.', cell_font),
-                ('以上商品已有到最终目的地的许可。', cell_font),
+                ('THESE COMMODITIES ARE LICENSED FOR THE UNTIMATE DESTINATION SHOWN.', 'text'),
+                ('以上商品已有到最终目的地的许可。', 'text'),
                 ('', None),
                 ('I DECLARE ALL THE INFORMATION CONTAINED IN THIS INVOICE LIST TO BE TRUE AND CORRECT.',
-                 Font(name='Arial', size=9, color='000080')),
-                ('以上申报均属实。', Font(name='宋体', size=11, color='FF0000', bold=True)),
+                 styles.define('declare_en', font=Font(name='Arial', size=9, color='000080'), alignment=CENTER)),
+                ('以上申报均属实。',
+                 styles.define('declare_cn', font=Font(name='宋体', size=11, color='FF0000', bold=True), alignment=CENTER)),
                 ('', None),
                 ('SIGNATURE OF SHIPPER/EXPORTER(TYPE NAME TITLE AND SIGN):    ',
-                 Font(name='Arial', size=9, color='000080', bold=True)),
-                ('寄件人/出口商签名(正楷和职位)', Font(name='宋体', size=9, color='000080', bold=True))
+                 styles.define('sign_en', font=Font(name='Arial', size=9, color='000080', bold=True), alignment=CENTER)),
+                ('寄件人/出口商签名(正楷和职位)',
+                 styles.define('sign_cn', font=Font(name='宋体', size=9, color='000080', bold=True), alignment=CENTER))
             ]
 
-            for i, (text, font) in enumerate(declarations):
+            for i, (text, style) in enumerate(declarations):
                 if text:
-                    cell = sheet.cell(row=num_row + i, column=1, value=text)
-                    if font:
-                        cell.font = font
-                    cell.alignment = cell_alignment
+                    styles.set_value(sheet, num_row + i, 1, text, style)
                     if i == 1:
                         sheet.row_dimensions[num_row + i].height = row_23_height
                     elif i == 6:
                         sheet.row_dimensions[num_row + i].height = row_28_height
 
             # 合并单元格
+            # 签名两行的D列写日期，只合并A:C
+            merges = MergedRangeIndex(sheet)
             for row in range(num_row, num_row + 8):
-                try:
-                    self.merge_cells_in_range(sheet, row, row, 1, 4)
-                except Exception as e:
-                    print(f"合并单元格时出错 row {row}: {str(e)}")
+                merges.merge(row, row, 1, 4 if row < num_row + 6 else 3)
+            merges.apply()
 
             # 设置右侧文本
             right_text = [
-                (num_row, 5, 'CHECK ONE', cell_font),
-                (num_row + 1, 5, '□ F.O.B', cell_font),
-                (num_row + 2, 5, '', cell_font_e24),
-                (num_row + 6, 4, 'DATE:', cell_font),
-                (num_row + 7, 4, '日期', cell_font)
+                (num_row, 5, 'CHECK ONE', 'text'),
+                (num_row + 1, 5, '□ F.O.B', 'text'),
+                (num_row + 2, 5, '', 'e24'),
+                (num_row + 6, 4, 'DATE:', 'text'),
+                (num_row + 7, 4, '日期', 'text')
             ]
 
-            for row, col, text, font in right_text:
-                cell = sheet.cell(row=row, column=col, value=text)
-                cell.font = font
-                cell.alignment = (cell_alignment_e24 if col == 5 and row == num_row + 2 
-                                else cell_alignment)
+            for row, col, text, style in right_text:
+                styles.set_value(sheet, row, col, text, style)
 
         except Exception as e:
-            print(f"填充林道UPS模板时发生错误: {str(e)}")
+            logger.error("填充林道UPS模板时发生错误: %s", str(e))
             raise
 
    
-    @template_handler("递信")
+    @template_handler("递信", sheet='FBA对应贴标资料')
     def _fill_dixing_template(self, wb, box_data, code=None, address_info=None):
         """
         填充递信模板
@@ -1303,360 +263,169 @@ class InvoiceGenerator:
         :param code: 编码（可选）
         :param address_info: 地址信息（可选）
         """
-        with self.db_connector as db:
-            try:
-                sheet = wb['FBA对应贴标资料']  # 获取模板工作表
-                print("开始写入递信模版信息")
-                current_date = datetime.now().strftime("%Y.%m.%d")
-                cell = sheet.cell(row=1, column=4)
-                cell.value = current_date
-                cell.font = Font(name='Arial', size=12)
-
-                # 记录第3行的格式信息
-                row_height = sheet.row_dimensions[3].height
-
-                # 查找并取消合并单元格
-                merged_cells = sheet.merged_cells
-                cells_to_unmerge = []
-                for merged_cell in merged_cells:
-                    if merged_cell.min_row >= 3:
-                        cells_to_unmerge.append(merged_cell)
-
-                for cell_range in cells_to_unmerge:
-                    sheet.unmerge_cells(str(cell_range))
-
-                # 保存最后一行的高度
-                last_height = sheet.row_dimensions[21].height
-
-                # 删除原来的内容
-                sheet.delete_rows(3, 20)
-
-                # 设置行高
-                for r in range(3, 21):
-                    sheet.row_dimensions[r].height = sheet.row_dimensions[25].height
-
-                # 初始化统计数据
-                total_weight = 0
-                total_quantity = 0
-                row_num = 3
-                ticket = str(code)+"00000"
-
-                # 设置单元格对齐方式
-                center_alignment = Alignment(horizontal='center', vertical='center')
-
-                # 遍历每个箱子
-                for box_number, box in sorted(box_data.items(), key=lambda x: int(x[0])):
-                    print(f"处理箱子 {box_number}")
-                    
-                    if not hasattr(box, 'items') or not box.items:
-                        continue
+        try:
+            sheet = wb['FBA对应贴标资料']  # 获取模板工作表
+            # 产品信息按 MSKU 一次取出（预取结果和共享表中没有的才查询数据库）
+            products = self._get_products(item.msku for box in box_data.values() for item in box.items)
+            styles = self.style_registry.bind(wb)
+            logger.info("开始写入递信模版信息")
+            current_date = datetime.now().strftime("%Y.%m.%d")
+            styles.set_value(sheet, 1, 4, current_date, 'large')
 
-                    # 计算箱子中的产品数量
-                    box_products = box.items
-                    is_mixed = len(box_products) >= 2
-                    identifier = f"{len(box_data)}-{box_number}{'(混装)' if is_mixed else ''}"
+            # 记录第3行的格式信息
+            row_height = sheet.row_dimensions[3].height
 
-                    merge_start_row = row_num
-                    
-                    # 遍历箱子中的每个产品
-                    for product_info in box_products:
-                        if hasattr(product_info, 'msku'):
-                            db_product_info = self._get_product_info(product_info.msku, db)
-                            if db_product_info:
-                                # 更新产品信息
-                                for key, value in db_product_info.items():
-                                    setattr(product_info, key, value)
-
-                        # 设置单元格值
-                        cell_data = [
-                            (1, identifier),  # 标识符
-                            (2, f"{getattr(product_info, 'cn_name', '')}\n{getattr(product_info, 'en_name', '')}"),  # 品名
-                            (3, f"{getattr(product_info, 'material_cn', '')}\n{getattr(product_info, 'material_en', '')}"),  # 材质
-                            (4, f"{getattr(product_info, 'usage_en', '')}, {getattr(product_info, 'usage_cn', '')}"),  # 用途
-                            (5, box_number),  # 箱号
-                            (6, getattr(box, 'weight', '')),  # 重量
-                            (7, f"{getattr(box, 'length', '')}*{getattr(box, 'width', '')}*{getattr(box, 'height', '')}"),  # 尺寸
-                            # (8,item.box_quantities.get(box_number, 0)),
-                            # (11,item.fnsku),
-                        ]
-
-                        # 处理数量信息
-                        quantity = getattr(product_info, 'box_quantities', {}).get(box_number, 0)
-                        if quantity:
-                            quantity_str = str(quantity)
-                            match = re.match(r'^([A-Za-z])(\d)$', quantity_str)
-                            if match:
-                                cell_data.extend([
-                                    (8, match.group(2)),  # 数量
-                                    (9, match.group(2)),  # 数量（重复）
-                                    (10, f"{match.group(1)}-{match.group(2)}"),  # 格式化的数量
-                                ])
-                                total_quantity += int(match.group(2))
-
-                        # 设置运单号
-                        cell_data.append((13, f"{ticket}{box_number}"))  # 运单号
-
-                        # 设置单元格值和格式
-                        for col, value in cell_data:
-                            cell = sheet.cell(row=row_num, column=col, value=value)
-                            cell.alignment = center_alignment
-
-                        # 插入产品图片
-                        if hasattr(product_info, 'msku') and hasattr(self, 'image_folder'):
-                            try:
-                                image_cell = f"L{row_num}"
-                                self.insert_product_image(sheet, image_cell, product_info.msku, self.image_folder)
-                            except Exception as e:
-                                print(f"插入图片时发生错误: {str(e)}")
-
-                        row_num += 1
-                        if hasattr(box, 'weight') and box.weight:
-                            total_weight += float(box.weight)
-                    # 合并单元格
-                    if row_num > merge_start_row:
-                        merge_ranges = [
-                            (merge_start_row, 1, row_num - 1, 1),  # 标识符列
-                            (merge_start_row, 5, row_num - 1, 5),  # 箱号列
-                            (merge_start_row, 6, row_num - 1, 6),  # 重量列
-                            (merge_start_row, 7, row_num - 1, 7),  # 尺寸列
-                            (merge_start_row, 13, row_num - 1, 13),  # 运单号列
-                        ]
-                        for start_row, start_col, end_row, end_col in merge_ranges:
-                            sheet.merge_cells(
-                                start_row=start_row,
-                                start_column=start_col,
-                                end_row=end_row,
-                                end_column=end_col
-                            )
-
-                # 合并最后一列
-                sheet.merge_cells(start_row=3, start_column=14, end_row=row_num, end_column=14)
-
-                # 删除多余的行
-                if row_num < sheet.max_row:
-                    sheet.delete_rows(row_num + 1, sheet.max_row - row_num)
-
-                # 设置边框
-                cell_border = Border(
-                    left=Side(border_style='thin'),
-                    right=Side(border_style='thin'),
-                    top=Side(border_style='thin'),
-                    bottom=Side(border_style='thin')
-                )
-
-                # 设置所有单元格的边框和行高
-                for row in range(3, row_num + 1):
-                    sheet.row_dimensions[row].height = row_height
-                    for col in range(1, 15):
-                        cell = sheet.cell(row=row, column=col)
-                        cell.border = cell_border
-
-                # 设置最后一行的汇总信息
-                sheet.row_dimensions[row_num].height = last_height
-
-                # 设置汇总行的字体和样式
-                summary_data = [
-                    (1, '汇总', Font(bold=True, name='宋体', size=12)),
-                    (5, len(box_data), Font(bold=True, name='微软雅黑', size=11)),
-                    (6, total_weight, Font(bold=True, name='微软雅黑', size=9)),
-                    (8, total_quantity, Font(bold=True, name='微软雅黑', size=12)),
-                    (9, total_quantity, Font(bold=True, name='微软雅黑', size=11))
-                ]
-
-                for col, value, font in summary_data:
-                    cell = sheet.cell(row=row_num, column=col, value=value)
-                    cell.font = font
-                    cell.alignment = center_alignment
-
-                print("递信模板填充完成")
+            # 取消第3行及以下的所有合并单元格
+            merges = MergedRangeIndex(sheet)
+            merges.unmerge((3, sheet.max_row, 1, sheet.max_column))
 
-            except Exception as e:
-                print(f"填充模板时发生错误: {str(e)}")
-                traceback.print_exc()
-                raise
-    
+            # 保存最后一行的高度
+            last_height = sheet.row_dimensions[21].height
 
-    @template_handler("德邦美森限时达")
-    def _fill_dbmsxsd_template(self, wb, box_data, code=None, address_info=None):
-        """
-        :param wb: 工作簿对象
-        :param box_data: 箱子数据
-        :param code: 编码（可选）
-        :param address_info: 地址信息（可选）
-        """
-        with self.db_connector as db:
-            try:
-                sheet = wb['FBA专线出货资料模板']  # 获取模板工作表
-                print("开始写入模版信息")
-
-                # 定义样式信息
-                style_info = {
-                    'font': Font(name='Arial', size=10),
-                    'border': Border(left=Side(border_style='thin'),
-                                     right=Side(border_style='thin'),
-                                     top=Side(border_style='thin'),
-                                     bottom=Side(border_style='thin')),
-                    'alignment': Alignment(horizontal='center', vertical='center')
-                }
-
-                #先拆分合并的单元格，用于写入
-                self.unmerge_cells_in_range(sheet, 2, 2, 3, 5)
-                self.unmerge_cells_in_range(sheet, 3, 3, 3, 5)
-                self.unmerge_cells_in_range(sheet, 4, 4, 3, 5)
-                self.unmerge_cells_in_range(sheet, 4, 4, 7, 8)
-                self.unmerge_cells_in_range(sheet, 5, 5, 3, 5)
-
-                # if code:
-                #     cell = sheet.cell(row=4, column=7)  # B列是第2列
-                #     cell.value = "FBA 号：" + str(code)
-                #     cell.font = Font(name='Arial', size=12,bold=True)
-
-                # 如果有地址信息，填充到相应的单元格
-                if address_info:
-                    address_info_detail = address_info['address_info']
-                    # if 'seller_info' in address_info:
-                    #     box_Reference_id = address_info['seller_info']['amazonReferenceId']
-                    try:
-                        # 填充收件人信息
-                        if 'name' in address_info_detail:
-                            cell = sheet.cell(row=3, column=3)  
-                            cell.value = address_info_detail['name']
-
-                            cell = sheet.cell(row=4, column=3)  
-                            cell.value = address_info_detail['name']
-                        
-                        # 填充地址信息
-                        address_parts = []
-                        if 'addressLine1' in address_info_detail:
-                            address_parts.append(address_info_detail['addressLine1'])
-                        if 'city' in address_info_detail:
-                            address_parts.append(address_info_detail['city'])
-                        if 'stateOrProvinceCode' in address_info_detail:
-                            address_parts.append(address_info_detail['stateOrProvinceCode'])
-                        if 'postalCode' in address_info_detail:
-                            address_parts.append(address_info_detail['postalCode'])
-                        if 'countryCode' in address_info_detail:
-                            address_parts.append(address_info_detail['countryCode'])
-
-                        if address_parts:
-                            cell = sheet.cell(row=2, column=3)  
-                            cell.value = ', '.join(address_parts)
-                            
-                            cell = sheet.cell(row=5, column=3)  
-                            cell.value = ', '.join(address_parts)
-
-  
-                    except Exception as e:
-                        print(f"填充地址信息时发生错误: {str(e)}")
-
-                # 填充数据
-                row_num = 9  
-                index = 1    # 添加序号计数器，从1开始
-                row_height = sheet.row_dimensions[9].height
-
-                # 将box_data按箱号排序
-                sorted_boxes = sorted(box_data.items(), key=lambda x: int(x[0]))
+            # 删除原来的内容
+            sheet.delete_rows(3, 20)
+
+            # 设置行高
+            for r in range(3, 21):
+                sheet.row_dimensions[r].height = sheet.row_dimensions[25].height
+
+            # 初始化统计数据
+            total_weight = 0
+            total_quantity = 0
+            row_num = 3
+            ticket = str(code)+"00000"
+
+            # 遍历每个箱子
+            for box_number, box in sorted(box_data.items(), key=lambda x: int(x[0])):
+                debug_sampled(logger, "处理箱子 %s", box_number)
                 
-                # 遍历排序后的箱子
-                for box_number, box in sorted_boxes:
-                    print(f"处理箱子 {box_number}")
-                    first_row_of_box = row_num  # 记录这个箱子的第一行
-                    box_number_str = code + '00000' + str(box_number)
-
-                    # 遍历箱子中的每个产品
-                    for item in box.items:
-                        # 从数据库获取产品信息
-                        product_info = self._get_product_info(item.msku, db)
-                        volume = box.length * box.width * box.height*0.000001
-                        price = 0
-                        total_price = 0
-    
-                        if product_info is not None:
-                            item.product_name = product_info.get('cn_name', item.product_name)
-                            print(f"产品信息：{product_info}")
-                        else:
-                        # 处理未找到产品信息的情况
-                            print(f"未找到产品信息，MSKU: {item.msku}")
-                            item.product_name = "需要补数据"  # 可以设置一个默认值
-                    
-                        # 设置单元格值和样式
-                        cell_data = [
-                            # 基本信息
-                            # 产品名称信息
-                            (3, f"{product_info.get('en_name', '')} ({product_info.get('cn_name', '')})" if product_info else ''),    
-                            (11, product_info.get('model', '') if product_info else ''),                   # 型号
-                            # 产品材料和用途
-                            (9, f"{product_info.get('material_en', '')} +'/'+{product_info.get('material_cn', '')}" if product_info else ''),            # 中文材料
-                            (10, str(product_info.get('usage_en', '') + '/' +
-                                   product_info.get('usage_cn', '')) if product_info else ''),            # 用途
-                            (2, product_info.get('hs_code', '') if product_info else ''),                # HS编码
-                            (5, item.box_quantities.get(box_number, 0)),         # 数量
-                            (10,  product_info.get('electrified', '')if product_info else ''),            
-                            (4, ''),                                            # 图片占位
-                        ]
-                        # 批量设置单元格值和样式
-                        for column, value in cell_data:
-                            self._set_cell_value(sheet, row_num, column, value, style_info)
-
-                        sheet.row_dimensions[row_num].height = row_height
-                        
-                        # 插入产品图片
-                        if item.msku and hasattr(self, 'image_folder'):
-                            try:
-                                image_cell = f"D{row_num}"  # 图片列（第14列）
-                                self.insert_product_image(sheet, image_cell, item.msku, self.image_folder)
-                            except Exception as e:
-                                print(f"插入图片时发生错误: {str(e)}")
-
-                        row_num += 1
-                    box_info_data = [
-                        (12, box_number_str),  
-                        (13, box.weight if box.weight is not None else ""),     # 重量
-                        (14, box.weight if box.weight is not None else ""),     # 重量
-                        (15, volume if box.weight is not None else "")          # 体积
-                    ]
+                if not hasattr(box, 'items') or not box.items:
+                    continue
+
+                # 计算箱子中的产品数量
+                box_products = box.items
+                is_mixed = len(box_products) >= 2
+                identifier = f"{len(box_data)}-{box_number}{'(混装)' if is_mixed else ''}"
 
-                # 设置箱子信息
-                for column, value in box_info_data:
-                    cell = sheet.cell(row=first_row_of_box, column=column, value=value)
-                    cell.font = style_info['font']
-                    cell.border = style_info['border']
-                    cell.alignment = style_info['alignment']
-
-                 # 使用箱子中的产品数量来确定合并范围
-                    if len(box.items) > 1:  # 只有当箱子中有多个产品时才合并
-                        sheet.merge_cells(
-                            start_row=first_row_of_box,
-                            start_column=column,
-                            end_row=first_row_of_box + len(box.items) - 1,
-                            end_column=column
-                        )
+                merge_start_row = row_num
                 
-                self.merge_cells_in_range(sheet, 2, 2, 3, 5)
-                self.merge_cells_in_range(sheet, 3, 3, 3, 5)
-                self.merge_cells_in_range(sheet, 4, 4, 3, 5)
-                self.merge_cells_in_range(sheet, 4, 4, 7, 8)
-                self.merge_cells_in_range(sheet, 5, 5, 3, 5)
+                # 遍历箱子中的每个产品
+                for product_info in box_products:
+                    db_product_info = None
+                    if hasattr(product_info, 'msku'):
+                        db_product_info = products.get(product_info.msku)
+                    # 商品对象使用固定槽位，数据库信息单独保存，不再写到商品对象上
+                    db_product_info = db_product_info or {}
 
-            except Exception as e:
-                print(f"填充模板时发生错误: {str(e)}")
-                raise
+                    # 设置单元格值
+                    cell_data = [
+                        (1, identifier),  # 标识符
+                        (2, f"{db_product_info.get('cn_name', '')}\n{db_product_info.get('en_name', '')}"),  # 品名
+                        (3, f"{db_product_info.get('material_cn', '')}\n{db_product_info.get('material_en', '')}"),  # 材质
+                        (4, f"{db_product_info.get('usage_en', '')}, {db_product_info.get('usage_cn', '')}"),  # 用途
+                        (5, box_number),  # 箱号
+                        (6, getattr(box, 'weight', '')),  # 重量
+                        (7, f"{getattr(box, 'length', '')}*{getattr(box, 'width', '')}*{getattr(box, 'height', '')}"),  # 尺寸
+                        # (8,item.box_quantities.get(box_number, 0)),
+                        # (11,item.fnsku),
+                    ]
+
+                    # 处理数量信息
+                    quantity = getattr(product_info, 'box_quantities', {}).get(box_number, 0)
+                    if quantity:
+                        quantity_str = str(quantity)
+                        match = re.match(r'^([A-Za-z])(\d)$', quantity_str)
+                        if match:
+                            cell_data.extend([
+                                (8, match.group(2)),  # 数量
+                                (9, match.group(2)),  # 数量（重复）
+                                (10, f"{match.group(1)}-{match.group(2)}"),  # 格式化的数量
+                            ])
+                            total_quantity += int(match.group(2))
+
+                    # 设置运单号
+                    cell_data.append((13, f"{ticket}{box_number}"))  # 运单号
+
+                    # 设置单元格值和格式
+                    for col, value in cell_data:
+                        sheet.cell(row=row_num, column=col).value = value
+                    styles.apply_row(sheet, row_num, [col for col, _ in cell_data], 'center')
+
+                    # 插入产品图片
+                    if hasattr(product_info, 'msku') and hasattr(self, 'image_folder'):
+                        try:
+                            image_cell = f"L{row_num}"
+                            self.insert_product_image(sheet, image_cell, product_info.msku, self.image_folder)
+                        except Exception as e:
+                            logger.warning("插入图片时发生错误: %s", str(e))
+
+                    row_num += 1
+                    if hasattr(box, 'weight') and box.weight:
+                        total_weight += float(box.weight)
+                # 合并单元格
+                if row_num > merge_start_row:
+                    merge_ranges = [
+                        (merge_start_row, 1, row_num - 1, 1),  # 标识符列
+                        (merge_start_row, 5, row_num - 1, 5),  # 箱号列
+                        (merge_start_row, 6, row_num - 1, 6),  # 重量列
+                        (merge_start_row, 7, row_num - 1, 7),  # 尺寸列
+                        (merge_start_row, 13, row_num - 1, 13),  # 运单号列
+                    ]
+                    for start_row, start_col, end_row, end_col in merge_ranges:
+                        merges.merge(start_row, end_row, start_col, end_col)
+
+            # 合并最后一列
+            merges.merge(3, row_num, 14, 14)
+            merges.apply()
+
+            # 删除多余的行
+            if row_num < sheet.max_row:
+                sheet.delete_rows(row_num + 1, sheet.max_row - row_num)
+
+            # 设置所有单元格的边框和行高
+            for row in range(3, row_num + 1):
+                sheet.row_dimensions[row].height = row_height
+                styles.apply_row(sheet, row, range(1, 15), 'grid')
+
+            # 设置最后一行的汇总信息
+            sheet.row_dimensions[row_num].height = last_height
+
+            # 设置汇总行的字体和样式
+            summary_data = [
+                (1, '汇总', Font(bold=True, name='宋体', size=12)),
+                (5, len(box_data), Font(bold=True, name='微软雅黑', size=11)),
+                (6, total_weight, Font(bold=True, name='微软雅黑', size=9)),
+                (8, total_quantity, Font(bold=True, name='微软雅黑', size=12)),
+                (9, total_quantity, Font(bold=True, name='微软雅黑', size=11))
+            ]
+
+            for col, value, font in summary_data:
+                style = styles.define(f'summary_{col}', font=font, alignment=CENTER)
+                styles.set_value(sheet, row_num, col, value, style)
+
+            logger.info("递信模板填充完成")
+
+        except Exception as e:
+            logger.exception("填充模板时发生错误: %s", str(e))
+            raise
+    
 
     def _fill_default_template(self, wb, box_data, code=None, address_info=None):
         """默认的模板处理方法"""
         raise ProcessingError("未找到匹配的模板处理方法，请确保模板文件名包含正确的关键字")
 
-    def generate_invoice(self, template_path, box_data,code=None, address_info=None):
+    def generate_invoice(self, template_path, box_data,code=None, address_info=None, name_suffix=None):
         """
         生成发票
         :param template_path: 模板文件路径
         :param box_data: 箱子数据
         :param code: 编码（可选）
         :param address_info: 地址信息（可选）
+        :param name_suffix: 文件名后缀（可选，同一次上传生成多票发票时用于区分文件名）
         :return: 生成的发票文件路径
         """
         try:
-            print(f"开始处理模板文件: {template_path}")
+            logger.info("开始处理模板文件: %s", template_path)
             if not os.path.exists(template_path):
                 raise ProcessingError(f"模板文件不存在: {template_path}")
 
@@ -1664,20 +433,9 @@ class InvoiceGenerator:
             timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
             
             # 检查产品的电磁属性
-            has_electric = False
-            has_magnetic = False
-            for box in box_data.values():
-                for item in box.items:
-                    product_info = self._get_product_info(item.msku, self.db_connector)
-                    if product_info:
-                        if product_info.get('electrified', '') == '是':
-                            has_electric = True
-                        if product_info.get('magnetic', '') == '是':
-                            has_magnetic = True
-                        if has_electric and has_magnetic:
-                            break
-                if has_electric and has_magnetic:
-                    break
+            products = self._get_products(item.msku for box in box_data.values() for item in box.items)
+            has_electric = any(p and p.get('electrified', '') == '是' for p in products.values())
+            has_magnetic = any(p and p.get('magnetic', '') == '是' for p in products.values())
             
             # 构建文件名后缀
             suffix = ""
@@ -1712,70 +470,221 @@ class InvoiceGenerator:
 
                 except (TypeError, ValueError) as e:
                     # 处理异常的情况
-                    print(f"Error occurred: {e}. Using default filename.")
+                    logger.warning("Error occurred: %s. Using default filename.", e)
                     output_filename = f"{timestamp}{suffix}.xlsx"
                     output_path = os.path.join(self.output_folder, output_filename)
             else:
                 output_filename = f"{timestamp}{suffix}.xlsx"
                 output_path = os.path.join(self.output_folder, output_filename)
 
-            # 使用openpyxl加载模板
-            print(f"正在加载模板文件...")
-            wb = load_workbook(template_path)
-            print(f"成功加载模板文件，工作表: {wb.sheetnames}")
+            if name_suffix:
+                name_suffix = "".join(c for c in str(name_suffix) if c not in r'<>:"/\|?*')
+                output_path = f"{os.path.splitext(output_path)[0]}{name_suffix}.xlsx"
 
             # 获取对应的模板处理方法
             template_handler = self._get_template_handler(template_path)
             if template_handler is None:
                 raise ProcessingError(f"未找到对应的模板处理方法: {template_path}")
+            spec = getattr(template_handler, 'spec', None)
 
-            # 处理模板
-            template_handler(wb, box_data, code, address_info)
+            # 配置为 xml 输出的声明式模板直接改写模板文件，不支持时改用 openpyxl 填充
+            if spec is not None and spec.use_patch(box_data):
+                try:
+                    spec.patch(self, template_path, output_path, box_data, code, address_info)
+                    logger.info("发票已生成: %s", output_path)
+                    return output_path
+                except XlsxPatchError as e:
+                    logger.warning("模板 %s 无法直接改写，改用 openpyxl 填充: %s", spec.name, str(e))
+
+            # 从模板缓存获取工作簿副本（模板文件修改后自动重新解析）
+            logger.debug("正在加载模板文件...")
+            wb = self.template_cache.load(template_path)
+            logger.debug("成功加载模板文件，工作表: %s", wb.sheetnames)
+
+            # 声明式模板在数据行很多时流式输出，不在内存中保留全部单元格
+            if spec is not None and spec.use_streaming(box_data):
+                spec.stream(self, wb, output_path, box_data, code, address_info)
+            else:
+                # 处理模板
+                template_handler(wb, box_data, code, address_info)
 
-            # 保存文件
-            wb.save(output_path)
-            print(f"发票已生成: {output_path}")
+                # 保存文件
+                save_workbook(wb, output_path)
+            logger.info("发票已生成: %s", output_path)
 
             return output_path
 
         except Exception as e:
             error_msg = f"生成发票时发生错误: {str(e)}"
-            print(error_msg)
-            traceback.print_exc()
+            logger.exception(error_msg)
             raise ProcessingError(error_msg)
 
+    def _match_keyword(self, template_name):
+        """
+        模板名称 -> 处理器关键字：名称与关键字完全相同时直接使用，否则取名称中包含的最长关键字
+        （“林道UPS”不会被“林道”处理器处理）
+        :return: 关键字；没有匹配的处理器时返回 None
+        """
+        if template_name in self._template_handlers:
+            return template_name
+        lowered = template_name.lower()
+        matches = [keyword for keyword in self._template_handlers if keyword.lower() in lowered]
+        return max(matches, key=len) if matches else None
+
+    def _resolve_keyword(self, template_path):
+        """
+        模板文件 -> 处理器关键字：只按关键字匹配到声明式模板时，还要求模板版式与配置一致
+        （“顺丰海运”的列和合并区域与“顺丰”不同，不能用“顺丰”的配置填充）
+        :return: 关键字；没有匹配的处理器时返回 None
+        """
+        template_name = os.path.splitext(os.path.basename(template_path))[0]
+        keyword = self._match_keyword(template_name)
+        if keyword is None or keyword == template_name:
+            return keyword
+        spec = getattr(self._template_handlers[keyword], 'spec', None)
+        if spec is not None and not spec.matches_layout(template_path):
+            logger.warning("模板 %s 的版式与处理器 %s 不一致，不按关键字匹配", os.path.basename(template_path), keyword)
+            return None
+        return keyword
+
+    def _build_dispatch(self, template_folder):
+        """
+        按模板目录中的模板文件预先计算分派表，并检查模板与处理器是否一一对应
+        :return: {模板名称: 关键字或None}
+        """
+        dispatch = {}
+        if not os.path.isdir(template_folder):
+            logger.warning("模板目录不存在: %s", template_folder)
+            return dispatch
+        for filename in sorted(os.listdir(template_folder)):
+            name, ext = os.path.splitext(filename)
+            if ext.lower() not in TEMPLATE_EXTENSIONS or filename.startswith(('~$', '.')):
+                continue
+            keyword = dispatch[name] = self._resolve_keyword(os.path.join(template_folder, filename))
+            if keyword is None:
+                logger.warning("模板 %s 没有匹配的处理器", filename)
+            elif keyword != name:
+                logger.info("模板 %s 使用处理器 %s（按关键字匹配）", filename, keyword)
+
+        used = set(dispatch.values())
+        for keyword in self._template_handlers:
+            if keyword not in used:
+                logger.debug("处理器 %s 没有对应的模板文件", keyword)
+        logger.debug("模板分派表: %s", dispatch)
+        return dispatch
+
     def _get_template_handler(self, template_path):
         """根据模板文件名选择对应的处理方法"""
+        template_name = os.path.splitext(os.path.basename(template_path))[0]
         try:
-            template_name = os.path.basename(template_path).lower()
-            # print(f"正在查找模板处理器，模板路径: {template_path}")
-            # print(f"模板文件名: {template_name}")
-            # print(f"已注册的处理器: {self._template_handlers}")
-            
-            for keyword, handler in self._template_handlers.items():
-                # print(f"检查关键字: {keyword}, 类型: {type(keyword)}")
-                # print(f"模板名称: {template_name}, 类型: {type(template_name)}")
-                keyword_lower = keyword.lower()
-                if keyword_lower in template_name:
-                    print(f"找到匹配的处理器: {handler.__name__}")
-                    return handler.__get__(self, type(self))
-            print(f"未找到匹配的处理器，可用的关键字: {list(self._template_handlers.keys())}")
+            keyword = self._dispatch[template_name]
+        except KeyError:
+            # 不在模板目录中的模板（如临时文件）首次使用时匹配一次并加入分派表
+            keyword = self._dispatch[template_name] = self._resolve_keyword(template_path)
+        if keyword is None:
+            logger.warning("未找到匹配的处理器，可用的关键字: %s", list(self._template_handlers.keys()))
             return self._fill_default_template
+        return self._template_handlers[keyword]
+
+    def template_sheet(self, template_path):
+        """
+        模板对应的处理器需要的工作表
+        :param template_path: 模板文件路径
+        :return: 工作表名称；没有匹配的处理器时返回 None
+        """
+        handler = self._get_template_handler(template_path)
+        if handler == self._fill_default_template:
+            return None
+        spec = getattr(handler, 'spec', None)
+        return spec.sheet if spec is not None else getattr(handler, '_template_sheet', None)
+
+    def prefetch_products(self, box_data_list):
+        """
+        一次查询多票货用到的全部产品信息（同一次上传生成多个模板时共用）
+        :param box_data_list: 多票货的箱子数据
+        :return: {msku: 产品信息，未找到时为 None}
+        """
+        return self._get_products(item.msku for box_data in box_data_list
+                                  for box in box_data.values() for item in box.items)
+
+    @contextmanager
+    def shared_products(self, products):
+        """
+        在此上下文中，当前线程查询产品信息时优先使用预取的结果（不再重复查询共享表和数据库）
+        :param products: prefetch_products 的结果（只读，可供多个线程共用）
+        """
+        previous = getattr(self._local, 'products', None)
+        self._local.products = products
+        try:
+            yield
+        finally:
+            self._local.products = previous
+
+    def _thread_db_connector(self):
+        """当前线程使用的数据库连接器"""
+        if self._db_connector_factory is None:
+            return self.db_connector
+        connector = getattr(self._local, 'db_connector', None)
+        if connector is None:
+            connector = self._local.db_connector = self._db_connector_factory()
+        return connector
+
+    def _cached_product_info(self, msku):
+        """
+        不查询数据库的产品信息（预取结果、本机共享产品表）
+        :return: (是否找到, 产品信息)
+        """
+        products = getattr(self._local, 'products', None)
+        if products is not None and msku in products:
+            return True, products[msku]
+        try:
+            product = self.product_table.get(msku)
         except Exception as e:
-            print(f"模板处理器匹配过程中出错: {str(e)}")
-            return self._fill_default_template
+            # 共享表读取失败（例如正在替换）时查询数据库，不能让产品信息静默缺失
+            logger.warning("读取共享产品表失败，改为查询数据库 %s: %s", msku, str(e))
+            product = None
+        if product is not None:
+            return True, self._format_product_info(product)
+        return False, None
+
+    def _get_products(self, mskus):
+        """
+        批量获取产品信息：预取结果和共享表中没有的 MSKU 才连接数据库（整批只连接一次）
+        :param mskus: 可迭代的 MSKU（可以重复）
+        :return: {msku: 产品信息，未找到时为 None}
+        """
+        products, missing = {}, []
+        for msku in dict.fromkeys(mskus):
+            found, product = self._cached_product_info(msku)
+            if found:
+                products[msku] = product
+            else:
+                missing.append(msku)
+        if missing:
+            try:
+                with self._thread_db_connector() as db:
+                    for msku in missing:
+                        products[msku] = self._get_product_info(msku, db)
+            except Exception as e:
+                logger.error("连接数据库查询产品信息失败: %s", str(e))
+                for msku in missing:
+                    products.setdefault(msku, None)
+        return products
 
     def _get_product_info(self, msku, db=None):
         """
-        从MongoDB获取产品信息
+        获取产品信息，优先读取本机共享产品表，未命中时再查询MongoDB
         :param msku: 产品的MSKU
         :param db: 数据库连接（可选）
         :return: 包含产品信息的字典
         """
+        found, product = self._cached_product_info(msku)
+        if found:
+            return product
         try:
             if db is None:
                 # 如果没有传入db连接，创建新的连接
-                with self.db_connector as db:
+                with self._thread_db_connector() as db:
                     return self._get_product_info(msku, db)
             
             # 使用传入的db连接
@@ -1783,45 +692,48 @@ class InvoiceGenerator:
             product = collection.find_one({'msku': msku})
             
             if product:
-                return {
-                    'cn_name': product.get('productNameZh', ''),
-                    'en_name': product.get('productNameEn', ''),
-                    'en_usage': product.get('useEn', ''),
-                    'ch_usage':product.get('useZh', ''),
-                    'material_en': product.get('materialEn', ''),
-                    'material_cn': product.get('materialZh', ''),
-                    'hs_code': product.get('HS', ''),
-                    'usage_en': product.get('useEn', ''),
-                    'usage_cn': product.get('useZh', ''),
-                    'brand': product.get('brand', ''),
-                    'model': product.get('model', ''),
-                    'link': product.get('productLink', ''),
-                    'price':product.get('askprice', ''),
-                    'electrified':product.get('electrified', ''),
-                    'magnetic':product.get('magnetic', ''),
-                    'weight':product.get('weight', ''),
-                }
+                return self._format_product_info(product)
             return None
         except Exception as e:
-            print(f"Error fetching product info for MSKU {msku}: {str(e)}")
+            logger.error("Error fetching product info for MSKU %s: %s", msku, str(e))
             return None
 
-    def _set_cell_value(self, sheet, row, column, value, style_info):
+    @staticmethod
+    def _format_product_info(product):
+        """将 msku_info 原始字段转换为模板使用的产品信息字典"""
+        return {
+            'cn_name': product.get('productNameZh', ''),
+            'en_name': product.get('productNameEn', ''),
+            'en_usage': product.get('useEn', ''),
+            'ch_usage':product.get('useZh', ''),
+            'material_en': product.get('materialEn', ''),
+            'material_cn': product.get('materialZh', ''),
+            'hs_code': product.get('HS', ''),
+            'usage_en': product.get('useEn', ''),
+            'usage_cn': product.get('useZh', ''),
+            'brand': product.get('brand', ''),
+            'model': product.get('model', ''),
+            'link': product.get('productLink', ''),
+            'price':product.get('askprice', ''),
+            'electrified':product.get('electrified', ''),
+            'magnetic':product.get('magnetic', ''),
+            'weight':product.get('weight', ''),
+        }
+
+    def _set_cell_value(self, sheet, row, column, value, styles, style='data'):
         """
         设置单元格的值和样式
         :param sheet: 工作表对象
         :param row: 行号
         :param column: 列号
         :param value: 单元格值
-        :param style_info: 样式信息
+        :param styles: 绑定到当前工作簿的样式（style_registry.bind(wb)）
+        :param style: 样式名称
         """
-        cell = sheet.cell(row=row, column=column)
-        cell.value = value
-        cell.font = style_info['font']
-        cell.border = style_info['border']
-        cell.alignment = style_info['alignment']
+        return styles.set_value(sheet, row, column, value, style)
 
-    def insert_centered_image(self, worksheet, cell_address, image_path, fixed_width=None, fixed_height=None):
+    def insert_centered_image(self, worksheet, cell_address, image_path, fixed_width=None, fixed_height=None,
+                              source_stamp=None):
         """
         在指定的单元格中插入居中的图片
         :param worksheet: 工作表对象
@@ -1829,12 +741,10 @@ class InvoiceGenerator:
         :param image_path: 图片文件路径
         :param fixed_width: 固定宽度（可选）
         :param fixed_height: 固定高度（可选）
+        :param source_stamp: 图片 (修改时间, 大小)（可选，图片索引中已有时不再读取文件信息）
         :return: 是否成功插入图片
         """
         try:
-            # 读取图片
-            img = PILImage.open(image_path)
-            
             # 获取单元格的宽度和高度（以像素为单位）
             column_width = worksheet.column_dimensions[cell_address[0]].width
             row_height = worksheet.row_dimensions[int(cell_address[1:])].height
@@ -1845,25 +755,8 @@ class InvoiceGenerator:
             if fixed_height is None:
                 fixed_height = row_height * 1.5  # 转换为像素
                 
-            # 获取原始图片尺寸
-            original_width, original_height = img.size
-            
-            # 计算缩放比例
-            width_ratio = fixed_width / original_width
-            height_ratio = fixed_height / original_height
-            scale = min(width_ratio, height_ratio)
-            
-            # 计算新的尺寸
-            new_width = int(original_width * scale)
-            new_height = int(original_height * scale)
-            
-            # 调整图片大小
-            img = img.resize((new_width, new_height), PILImage.Resampling.LANCZOS)
-            
-            # 将图片保存到BytesIO对象
-            img_byte_arr = BytesIO()
-            img.save(img_byte_arr, format=img.format if img.format else 'PNG')
-            img_byte_arr.seek(0)
+            # 按比例缩放到单元格大小（同一原图、同一大小只缩放一次）
+            img_byte_arr = BytesIO(self.image_cache.get(image_path, fixed_width, fixed_height, source_stamp))
             
             # 创建Excel图片对象
             xl_img = XLImage(img_byte_arr)
@@ -1872,7 +765,7 @@ class InvoiceGenerator:
             
             return True
         except Exception as e:
-            print(f"插入图片时发生错误: {str(e)}")
+            logger.warning("插入图片时发生错误: %s", str(e))
             return False
 
     def insert_product_image(self, worksheet, cell_address, msku, image_folder, fixed_width=None, fixed_height=None):
@@ -1886,22 +779,16 @@ class InvoiceGenerator:
         :param fixed_height: 固定高度（可选）
         """
         try:
-            # 构建图片文件路径
-            image_path_jpg = os.path.join(image_folder, f"{msku}.jpg")
-            image_path_png = os.path.join(image_folder, f"{msku}.png")
-            print(f"尝试加载图片: {image_path_jpg}")
-            
-            # 检查JPEG图片文件是否存在
-            if os.path.exists(image_path_jpg):
-                return self.insert_centered_image(worksheet, cell_address, image_path_jpg, fixed_width, fixed_height)
-            elif os.path.exists(image_path_png):
-                print(f"尝试加载PNG图片: {image_path_png}")
-                return self.insert_centered_image(worksheet, cell_address, image_path_png, fixed_width, fixed_height)
-            else:
-                print(f"图片文件不存在: {image_path_jpg} 和 {image_path_png}")
+            # 从图片目录索引中查找（.jpg 优先，其次 .png），不逐行检查文件是否存在
+            entry = image_index_for(image_folder).lookup(msku)
+            if entry is None:
+                debug_sampled(logger, "图片文件不存在: %s", msku)
                 return False
+            debug_sampled(logger, "尝试加载图片: %s", entry.path)
+            return self.insert_centered_image(worksheet, cell_address, entry.path, fixed_width, fixed_height,
+                                              source_stamp=entry.stamp)
         except Exception as e:
-            print(f"处理产品图片时发生错误: {str(e)}")
+            logger.error("处理产品图片时发生错误: %s", str(e))
             return False
 
     def extract_data(self, ticket_str):
@@ -1918,6 +805,7 @@ class InvoiceGenerator:
     def unmerge_cells_in_range(self, sheet, start_row, end_row, start_col, end_col):
         """
         解除指定范围内的所有合并单元格。
+        需要解除多个区域时，直接使用 MergedRangeIndex(sheet).unmerge(...) 一次完成。
 
         :param sheet: 要操作的工作表对象
         :param start_row: 起始行
@@ -1925,22 +813,13 @@ class InvoiceGenerator:
         :param start_col: 起始列
         :param end_col: 结束列
         """
-        print("正在解除合并单元格...")
-        merged_ranges = list(sheet.merged_cells.ranges)
-        for merged_range in merged_ranges:
-            min_row, min_col, max_row, max_col = merged_range.bounds
-            # 检查合并单元格是否在指定范围内
-            if (min_row >= start_row and max_row <= end_row and
-                min_col >= start_col and max_col <= end_col):
-                try:
-                    sheet.unmerge_cells(str(merged_range))
-                except Exception as e:
-                    print(f"解除合并单元格时发生错误: {str(e)}")
-        print("合并单元格解除完成")
+        count = MergedRangeIndex(sheet).unmerge((start_row, end_row, start_col, end_col))
+        debug_sampled(logger, "合并单元格解除完成: %s 个", count)
 
     def merge_cells_in_range(self, sheet, start_row, end_row, start_col, end_col):
         """
-        合并指定区域内的单元格。
+        合并指定区域内的单元格，左上角单元格居中。
+        需要合并多个区域时，使用 MergedRangeIndex 登记后统一 apply()。
 
         :param sheet: 要操作的工作表对象
         :param start_row: 起始行
@@ -1948,21 +827,9 @@ class InvoiceGenerator:
         :param start_col: 起始列
         :param end_col: 结束列
         """
-        try:
-            # 获取合并区域的范围字符串
-            merge_range = f"{get_column_letter(start_col)}{start_row}:{get_column_letter(end_col)}{end_row}"
-            print(f"正在合并单元格区域: {merge_range}")
-            
-            # 合并单元格
-            sheet.merge_cells(merge_range)
-            
-            # 设置合并后的单元格样式（可选）
-            merged_cell = sheet.cell(row=start_row, column=start_col)
-            merged_cell.alignment = Alignment(horizontal='center', vertical='center')
-            
-            print(f"单元格合并完成: {merge_range}")
-        except Exception as e:
-            print(f"合并单元格时发生错误: {str(e)}")
+        merges = MergedRangeIndex(sheet)
+        merges.merge(start_row, end_row, start_col, end_col)
+        merges.apply()
 
     def _parse_range(self, range_str):
         """
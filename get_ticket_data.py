@@ -1,23 +1,102 @@
+import os
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
+from openpyxl.utils import get_column_letter
+from collections.abc import Mapping
 from typing import Dict, List, Optional
-from dataclasses import dataclass
+from excel_reader import read_rows, read_all_sheets, sheet_names
+from packing_cache import packing_list_cache
+from box_specs import box_spec_catalog
+from task_log import get_logger, debug_sampled
+
+logger = get_logger(__name__)
+
+
+class ShipmentMatrix:
+    """整票货的 商品 × 箱子 数量矩阵（列式存储，替代每个商品一个 {箱号: 数量} 字典）"""
+
+    __slots__ = ('quantities', 'box_numbers', 'box_index')
+
+    def __init__(self, quantities: np.ndarray, box_numbers: List[int]):
+        """
+        :param quantities: 数量矩阵，行为商品，列为箱子
+        :param box_numbers: 每一列对应的箱号
+        """
+        self.quantities = np.ascontiguousarray(quantities, dtype=np.int32)
+        self.box_numbers = [int(n) for n in box_numbers]
+        self.box_index = {n: col for col, n in enumerate(self.box_numbers)}
+
+    @classmethod
+    def from_items(cls, items: List['PackingListItem'], box_numbers: List[int]) -> 'ShipmentMatrix':
+        """由已填好 box_quantities 字典的商品列表构建矩阵，并把商品的 box_quantities 切换为矩阵视图"""
+        matrix = cls(np.zeros((len(items), len(box_numbers)), dtype=np.int32), box_numbers)
+        for row, item in enumerate(items):
+            for box_number, quantity in item.box_quantities.items():
+                matrix.quantities[row, matrix.box_index[box_number]] = quantity
+            item.box_quantities = BoxQuantities(matrix, row)
+        return matrix
+
+    def box_rows(self, box_number: int) -> np.ndarray:
+        """指定箱子中数量大于0的商品行号"""
+        return np.flatnonzero(self.quantities[:, self.box_index[box_number]] > 0)
+
+
+class BoxQuantities(Mapping):
+    """单个商品的每箱数量 {箱号: 数量}，为矩阵中一行的只读视图"""
+
+    __slots__ = ('_matrix', '_row')
+
+    def __init__(self, matrix: ShipmentMatrix, row: int):
+        self._matrix = matrix
+        self._row = row
+
+    def __getitem__(self, box_number):
+        col = self._matrix.box_index[box_number]
+        quantity = int(self._matrix.quantities[self._row, col])
+        if quantity <= 0:
+            raise KeyError(box_number)
+        return quantity
+
+    def __iter__(self):
+        box_numbers = self._matrix.box_numbers
+        for col in np.flatnonzero(self._matrix.quantities[self._row] > 0):
+            yield box_numbers[col]
+
+    def __len__(self):
+        return int(np.count_nonzero(self._matrix.quantities[self._row] > 0))
+
+    def __repr__(self):
+        return repr(dict(self))
 
 
-@dataclass
 class PackingListItem:
     """装箱单中的单个商品信息"""
-    sequence_no: int  # 序号
-    msku: str  # MSKU
-    fnsku: str  # FNSKU
-    product_name: str  # 品名
-    sku: str  # SKU
-    quantity: int  # 发货数量
-    box_quantities: Dict[int, int]  # 每箱数量 {箱号: 数量}
+
+    __slots__ = ('sequence_no', 'msku', 'fnsku', 'product_name', 'sku', 'quantity', 'box_quantities')
+
+    def __init__(self, sequence_no: int, msku: str, fnsku: str, product_name: str, sku: str,
+                 quantity: int, box_quantities: Mapping):
+        self.sequence_no = sequence_no  # 序号
+        self.msku = msku  # MSKU
+        self.fnsku = fnsku  # FNSKU
+        self.product_name = product_name  # 品名
+        self.sku = sku  # SKU
+        self.quantity = quantity  # 发货数量
+        self.box_quantities = box_quantities  # 每箱数量 {箱号: 数量}
+
+    def __repr__(self):
+        return (f"PackingListItem(sequence_no={self.sequence_no!r}, msku={self.msku!r}, "
+                f"quantity={self.quantity!r}, box_quantities={self.box_quantities!r})")
 
 
 class PackingListBox:
     """装箱单中的箱子信息"""
 
+    __slots__ = ('box_number', 'items', 'length', 'width', 'height', 'weight')
+
     def __init__(self, box_number: int):
         self.box_number = box_number
         self.items: List[PackingListItem] = []
@@ -30,6 +109,10 @@ class PackingListBox:
         """添加商品到箱子"""
         self.items.append(item)
 
+    def is_first_item(self, item: PackingListItem) -> bool:
+        """是否为箱子中的第一个商品（按对象身份判断，不做字段比较）"""
+        return bool(self.items) and item is self.items[0]
+
     def set_dimensions(self, length: float, width: float, height: float):
         """设置箱子尺寸"""
         self.length = length
@@ -43,8 +126,18 @@ class PackingListBox:
 class PackingListProcessor:
     """领星装箱单处理器"""
 
-    def __init__(self, file_path: str):
+    def __init__(self, file_path: str, cache=packing_list_cache, sheet_name: Optional[str] = None,
+                 rows: Optional[List[tuple]] = None):
+        """
+        :param file_path: Excel文件路径
+        :param cache: 解析结果缓存（传入None关闭缓存）
+        :param sheet_name: 工作表名称（默认第一个工作表）
+        :param rows: 已读取的工作表行（见 process_workbook），传入时不再读取文件
+        """
         self.file_path = file_path
+        self.cache = cache
+        self.sheet_name = sheet_name
+        self.rows = rows
         self.shipment_id: Optional[str] = None
         self.boxes: Dict[int, PackingListBox] = {}
         self.items: List[PackingListItem] = []
@@ -52,9 +145,14 @@ class PackingListProcessor:
     def process(self):
         """处理装箱单"""
         try:
+            cache_key = self.cache.make_key(self.file_path, type(self).__name__, **self._sheet_quirks()) if self.cache else None
+            if cache_key and self.cache.load_into(self, cache_key):
+                logger.info("Using cached parse result: %s", self.file_path)
+                return self.boxes
+
             # 读取Excel文件
-            print(f"Reading Excel file: {self.file_path}")
-            df = pd.read_excel(self.file_path)
+            logger.info("Reading Excel file: %s", self.file_path)
+            df = read_rows(self.file_path, stop=self._stop_after_box_info(), sheet_name=self.sheet_name, rows=self.rows)
 
             if df.empty:
                 raise ValueError("Excel file is empty")
@@ -67,121 +165,130 @@ class PackingListProcessor:
             except Exception as e:
                 raise ValueError(f"Invalid Shipment ID: {str(e)}")
 
-            print(f"Found Shipment ID: {self.shipment_id}")
+            logger.info("Found Shipment ID: %s", self.shipment_id)
 
-            # 找到最后一个产品的行号
-            last_product_row = None
-            for i in range(len(df)):
-                try:
-                    first_col_value = df.iloc[i, 0]  # 使用 iloc 直接获取第一列的值
-                    # 尝试将第一列转换为浮点数，然后检查是否为正数
-                    if pd.isna(first_col_value):
-                        continue
-                    value = float(first_col_value)
-                    if value > 0:
-                        last_product_row = i  # 直接使用循环索引
-                except (ValueError, TypeError):
-                    continue
+            values = df.to_numpy(dtype=object)
 
-            if last_product_row is None:
+            # 找到最后一个产品的行号：第一列可转换为正数的最后一行
+            first_col = pd.to_numeric(df.iloc[:, 0], errors='coerce').to_numpy(dtype=float)
+            product_rows = np.flatnonzero(first_col > 0)
+            if len(product_rows) == 0:
                 raise ValueError("No product data found")
+            last_product_row = int(product_rows[-1])
 
-            print(f"Last product row: {last_product_row}")
+            logger.debug("Last product row: %s", last_product_row)
 
-            # 处理商品信息（从第三行开始）
-            row_count = 0
-            for _, row in df.iloc[2:last_product_row + 1].iterrows():
-                if pd.isna(row[0]):  # 如果序号为空，跳过
-                    continue
+            # 商品信息（从第三行开始）：序号、MSKU、总数量均不为空的行才是有效商品
+            block = values[2:last_product_row + 1]
+            valid_rows = np.flatnonzero(~pd.isna(block[:, 0]) & ~pd.isna(block[:, 1]) & ~pd.isna(block[:, 5]))
 
-                row_count += 1
-                msku = row[1]  # 第二列是MSKU
-                fnsku = row[2]  # 第三列是FNSKU
-                product_name = row[3]  # 第四列是品名
-                sku = row[4]  # 第五列是SKU
-                total_quantity = row[5]  # 第六列是发货总数量
+            # 每箱数量矩阵（商品 × 箱子），空值视为0，非数字和小数单元格记录警告
+            quantities = self._to_float_matrix(block[valid_rows, 6:], valid_rows + 2)
+            sku_idx, box_idx = np.nonzero(quantities > 0)
 
-                if pd.isna(msku) or pd.isna(total_quantity):
-                    continue
-
-                print(f"Processing row {row_count}: SKU={sku}, Total Quantity={total_quantity}")
+            # 箱子按首次出现的顺序（逐行扫描）创建，矩阵只保留有货的箱子列
+            box_cols, first_seen = np.unique(box_idx, return_index=True)
+            box_cols = box_cols[np.argsort(first_seen)]
+            matrix = ShipmentMatrix(quantities[:, box_cols].astype(np.int64), [int(col) + 1 for col in box_cols])
 
-                # 创建商品信息
-                item = PackingListItem(
+            for row_count, row_idx in enumerate(valid_rows, start=1):
+                row = block[row_idx]
+                debug_sampled(logger, "Processing row %s: SKU=%s, Total Quantity=%s", row_count, row[4], row[5])
+                self.items.append(PackingListItem(
                     sequence_no=int(row[0]),
                     msku=row[1],
                     fnsku=row[2],
                     product_name=row[3],
                     sku=row[4],
-                    quantity=int(total_quantity),
-                    box_quantities={}
-                )
-
-                # 处理每箱数量
-                for col_idx, col in enumerate(df.columns[6:], start=6):
-                    quantity = row[col_idx]
-                    if not pd.isna(quantity) and quantity > 0:
-                        box_number = col_idx - 5  # 箱号从1开始
-                        item.box_quantities[box_number] = int(quantity)
-                        print(f"  - Box {box_number}: {quantity} units")
-
-                        # 确保箱子对象存在
-                        if box_number not in self.boxes:
-                            self.boxes[box_number] = PackingListBox(box_number)
-                            print(f"  Created new box: Box {box_number}")
-                        self.boxes[box_number].add_item(item)
+                    quantity=int(row[5]),
+                    box_quantities=BoxQuantities(matrix, row_count - 1)
+                ))
 
-                self.items.append(item)
+            for box_number in matrix.box_numbers:  # 箱号从1开始
+                box = self.boxes[box_number] = PackingListBox(box_number)
+                box.items = [self.items[i] for i in matrix.box_rows(box_number)]
 
             # 读取箱子尺寸信息
-            # 箱子信息在最后一个产品后两行开始
-            box_info_start = int(last_product_row) + 2  # 确保是整数运算
-
-            # 对每个箱子
-            for box_number in self.boxes:
-                box = self.boxes[box_number]
-                col_idx = 5 + box_number  # 箱子列索引（第1箱从第7列开始）
-
-                # 获取箱子信息（按顺序：重量、长、宽、高）
-                # 重量
-                weight = df.iloc[box_info_start, col_idx]
-                if not pd.isna(weight):
-                    box.weight = float(weight)
-                    print(f"Box {box_number} weight: {box.weight} kg")
-
-                # 长度
-                length = df.iloc[box_info_start + 1, col_idx]
-                if not pd.isna(length):
-                    box.length = float(length)
-                    print(f"Box {box_number} length: {box.length} cm")
-
-                # 宽度
-                width = df.iloc[box_info_start + 2, col_idx]
-                if not pd.isna(width):
-                    box.width = float(width)
-                    print(f"Box {box_number} width: {box.width} cm")
-
-                # 高度
-                height = df.iloc[box_info_start + 3, col_idx]
-                if not pd.isna(height):
-                    box.height = float(height)
-                    print(f"Box {box_number} height: {box.height} cm")
-
-            print(f"\nProcessing complete:")
-            print(f"- Total products: {len(self.items)}")
-            print(f"- Total boxes: {len(self.boxes)}")
-            for box_number, box in self.boxes.items():
-                print(f"Box {box_number}:")
-                print(f"  - Dimensions: {box.length}x{box.width}x{box.height} cm")
-                print(f"  - Weight: {box.weight} kg")
-                print(f"  - Items: {len(box.items)}")
-
+            # 箱子信息在最后一个产品后两行开始，按顺序：重量、长、宽、高
+            box_info_start = last_product_row + 2
+            box_numbers = list(self.boxes)
+            if box_numbers:
+                box_info = values[box_info_start:box_info_start + 4, [5 + n for n in box_numbers]]
+                if box_info.shape[0] < 4:
+                    raise ValueError("Box information rows are missing")
+                for box_number, (weight, length, width, height) in zip(box_numbers, box_info.T):
+                    box = self.boxes[box_number]
+                    if not pd.isna(weight):
+                        box.weight = float(weight)
+                    if not pd.isna(length):
+                        box.length = float(length)
+                    if not pd.isna(width):
+                        box.width = float(width)
+                    if not pd.isna(height):
+                        box.height = float(height)
+
+            logger.info("Processing complete: %s products, %s boxes", len(self.items), len(self.boxes),
+                        extra={'fields': {'shipment_id': self.shipment_id, 'products': len(self.items),
+                                          'boxes': len(self.boxes)}})
+            if logger.isEnabledFor(logging.DEBUG):
+                for box_number, box in self.boxes.items():
+                    logger.debug("Box %s: %sx%sx%s cm, %s kg, %s items", box_number,
+                                 box.length, box.width, box.height, box.weight, len(box.items))
+
+            if cache_key:
+                self.cache.store_from(self, cache_key)
             return self.boxes
 
         except Exception as e:
-            print(f"Error processing file: {str(e)}")
+            logger.error("Error processing file %s: %s", self.file_path, str(e))
             return None
 
+    @staticmethod
+    def _stop_after_box_info():
+        """流式读取的停止条件：读到最后一个产品行之后的四行箱子信息（重量、长、宽、高）为止"""
+        last_product_row = None
+
+        def stop(index, row):
+            nonlocal last_product_row
+            if last_product_row is not None and index > last_product_row + 5:
+                return True
+            try:
+                if row and row[0] is not None and float(row[0]) > 0:
+                    last_product_row = index
+            except (ValueError, TypeError):
+                pass
+            return False
+
+        return stop
+
+    def _to_float_matrix(self, block, row_indexes) -> np.ndarray:
+        """
+        将每箱数量转换为浮点矩阵：无法转换的单元格视为0，小数按整数截断，两者都按单元格记录警告
+        :param block: 每箱数量的对象数组（商品 × 箱子列，从第7列开始）
+        :param row_indexes: 各商品行在 DataFrame 中的行号（不含表头行）
+        """
+        try:
+            matrix = block.astype(float)
+        except (ValueError, TypeError):
+            matrix = pd.DataFrame(block).apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+            for i, j in zip(*np.nonzero(np.isnan(matrix) & ~pd.isna(block))):
+                logger.warning("Invalid quantity %r in %s, treated as 0", block[i, j],
+                               self._cell_name(row_indexes[i], 6 + j))
+        matrix = np.nan_to_num(matrix, nan=0.0)
+        for i, j in zip(*np.nonzero(matrix != np.trunc(matrix))):
+            logger.warning("Fractional quantity %s in %s, truncated to %d", matrix[i, j],
+                           self._cell_name(row_indexes[i], 6 + j), int(matrix[i, j]))
+        return matrix
+
+    def _cell_name(self, row_index, col_index) -> str:
+        """DataFrame 行号、列号 -> 工作表中的单元格名称（如 "sheet FBA1 cell G5"）"""
+        cell = f"{get_column_letter(col_index + 1)}{row_index + 2}"
+        return f"sheet {self.sheet_name} cell {cell}" if self.sheet_name is not None else f"cell {cell}"
+
+    def _sheet_quirks(self):
+        """非默认工作表时，工作表名称参与缓存键"""
+        return {'sheet': self.sheet_name} if self.sheet_name is not None else {}
+
     def get_box_count(self) -> int:
         """获取箱子总数"""
         return len(self.boxes)
@@ -206,32 +313,44 @@ class PackingListProcessor:
 class SimplePackingListProcessor:
     """简单装箱单处理器"""
 
-    # 箱子规格映射表
-    BOX_SPECS = {
-        "中号": {"length": 51, "width": 41, "height": 41, "weight": 1.102},
-        "1号": {"length": 54, "width": 30, "height": 38, "weight": 0.843},
-        "2号": {"length": 54, "width": 24, "height": 30, "weight": 0.631},
-        "3号": {"length": 44, "width": 22, "height": 28, "weight": 0.458},
-        "4号": {"length": 36, "width": 20, "height": 24, "weight": 0.283},
-        "定制49": {"length": 50, "width": 50, "height": 40, "weight": 1.2},
-        "定制55": {"length": 56, "width": 46, "height": 51, "weight": 1.6},
-        "搬家大": {"length": 61, "width": 41, "height": 51, "weight": 1.45},
-        "定制64": {"length": 65, "width": 40, "height": 45, "weight": 1.4},
-        "圣诞树": {"length": 91, "width": 49.5, "height": 37, "weight": 1.7},
-        "定制59": {"length": 59, "width": 48, "height": 39, "weight": 1.35}
-    }
-
-    def __init__(self, file_path: str):
+    def __init__(self, file_path: str, cache=packing_list_cache, box_specs=box_spec_catalog,
+                 sheet_name: Optional[str] = None, rows: Optional[List[tuple]] = None):
         """初始化处理器
 
         Args:
             file_path: Excel文件路径
+            cache: 解析结果缓存（传入None关闭缓存）
+            box_specs: 箱规目录
+            sheet_name: 工作表名称（默认第一个工作表）
+            rows: 已读取的工作表行（见 process_workbook），传入时不再读取文件
         """
         self.file_path = file_path
+        self.cache = cache
+        self.box_specs = box_specs
+        self.sheet_name = sheet_name
+        self.rows = rows
         self.shipment_id: Optional[str] = None
         self.boxes: Dict[int, PackingListBox] = {}
         self.items: List[PackingListItem] = []
 
+    @staticmethod
+    def _stop_after_data_rows(column_offset=0):
+        """流式读取的停止条件：找到箱号行后，读到第一列为空的数据行为止"""
+        box_number_index = None
+
+        def stop(index, row):
+            nonlocal box_number_index
+            if box_number_index is None:
+                if len(row) > column_offset + 1 and str(row[column_offset + 1]).strip() == '箱号':
+                    box_number_index = index
+                return False
+            if index < box_number_index + 2:
+                return False
+            first_col = row[column_offset] if len(row) > column_offset else None
+            return first_col is None or not str(first_col).strip()
+
+        return stop
+
     def process(self, template_name=None):
         """处理装箱单
         
@@ -239,15 +358,25 @@ class SimplePackingListProcessor:
             template_name: 模板名称，用于特殊处理某些模板
         """
         try:
-            print(f"Reading Excel file: {self.file_path}")
-            df = pd.read_excel(self.file_path)
+            # 如果是依诺达模板，第一列是多余列
+            column_offset = 1 if template_name and "依诺达" in template_name else 0
+            cache_key = (self.cache.make_key(self.file_path, type(self).__name__, drop_first_column=column_offset,
+                                             box_specs=self.box_specs.version, **self._sheet_quirks())
+                         if self.cache else None)
+            if cache_key and self.cache.load_into(self, cache_key):
+                logger.info("Using cached parse result: %s", self.file_path)
+                return self.boxes
+
+            logger.info("Reading Excel file: %s", self.file_path)
+            df = read_rows(self.file_path, stop=self._stop_after_data_rows(column_offset),
+                           sheet_name=self.sheet_name, rows=self.rows)
 
             if df.empty:
                 raise ValueError("Excel file is empty")
 
             # 如果是依诺达模板，删除第一列
-            if template_name and "依诺达" in template_name:
-                df = df.iloc[:, 1:]
+            if column_offset:
+                df = df.iloc[:, column_offset:]
 
             # 获取Shipment ID（第1行第2列）
             try:
@@ -257,7 +386,7 @@ class SimplePackingListProcessor:
             except Exception as e:
                 raise ValueError(f"Invalid Shipment ID: {str(e)}")
 
-            print(f"Found Shipment ID: {self.shipment_id}")
+            logger.info("Found Shipment ID: %s", self.shipment_id)
 
             # 读取箱子信息
             box_number_index = None
@@ -273,7 +402,7 @@ class SimplePackingListProcessor:
             if box_number_index is None:
                 raise ValueError("未找到箱号行")
 
-            print(f"Found box number row at index {box_number_index}")
+            logger.debug("Found box number row at index %s", box_number_index)
 
             # 从箱号行开始处理每一列
             valid_columns = []  # 存储有效的箱子列
@@ -284,12 +413,12 @@ class SimplePackingListProcessor:
                     box_number = int(box_number_str)
                     box_type = str(df.iloc[box_number_index - 1, col]).strip() if not pd.isna(df.iloc[box_number_index - 1, col]) else ""
                     
-                    # 查找匹配的箱规
-                    matched_box_type = None
-                    for spec_type in self.BOX_SPECS:
-                        if spec_type.strip() in box_type or box_type in spec_type.strip():
-                            matched_box_type = spec_type
-                            break
+                    # 查找匹配的箱规（未填写箱规时沿用目录中的第一个箱规）
+                    specs = self.box_specs.match(box_type)
+                    if specs is None and not box_type:
+                        specs = self.box_specs.default
+                        logger.warning("Box %s has no box type, using %s", box_number, specs["name"])
+                    matched_box_type = specs["name"] if specs else None
 
                     if matched_box_type:
                         try:
@@ -299,7 +428,6 @@ class SimplePackingListProcessor:
 
                             # 创建箱子对象并设置规格
                             self.boxes[box_number] = PackingListBox(box_number)
-                            specs = self.BOX_SPECS[matched_box_type]
                             self.boxes[box_number].length = specs["length"]
                             self.boxes[box_number].width = specs["width"]
                             self.boxes[box_number].height = specs["height"]
@@ -307,11 +435,13 @@ class SimplePackingListProcessor:
 
                             box_columns[col] = box_number
                             box_types[box_number] = matched_box_type
-                            print(f"Processed box {box_number} (Type: {matched_box_type}, Weight: {self.boxes[box_number].weight}kg)")
+                            debug_sampled(logger, "Processed box %s (Type: %s, Weight: %skg)", box_number, matched_box_type, self.boxes[box_number].weight)
 
                         except Exception as e:
-                            print(f"Warning: Invalid box information in column {col+1}: {str(e)}")
+                            logger.warning("Invalid box information in column %s: %s", col + 1, str(e))
                             continue
+                    else:
+                        logger.warning("Unknown box type %r for box %s, box skipped", box_type, box_number)
 
             if not box_columns:
                 raise ValueError("未找到有效的箱子信息")
@@ -330,7 +460,7 @@ class SimplePackingListProcessor:
             if data_end_row is None:
                 data_end_row = len(df) - 1
 
-            print(f"Data range: row {data_start_row + 1} to {data_end_row + 1}")
+            logger.debug("Data range: row %s to %s", data_start_row + 1, data_end_row + 1)
 
             # 处理商品信息
             row_count = 0
@@ -341,7 +471,7 @@ class SimplePackingListProcessor:
                 # 检查SKU是否为空或者只包含空白字符
                 sku = str(row.iloc[0]).strip() if not pd.isna(row.iloc[0]) else ""
                 if not sku:
-                    print(f"跳过空行 {row_count}")
+                    debug_sampled(logger, "跳过空行 %s", row_count)
                     continue
 
                 try:
@@ -353,9 +483,9 @@ class SimplePackingListProcessor:
                         if not pd.isna(row.iloc[1]):  # 第2列是总数量
                             total_quantity = int(float(str(row.iloc[1]).strip()))
                     except (ValueError, TypeError):
-                        print(f"Warning: Invalid quantity in row {row_count}, using sum of box quantities")
+                        logger.warning("Invalid quantity in row %s, using sum of box quantities", row_count)
 
-                    print(f"Processing row {row_count}: SKU={sku}")
+                    debug_sampled(logger, "Processing row %s: SKU=%s", row_count, sku)
 
                     # 创建商品信息
                     item = PackingListItem(
@@ -378,41 +508,48 @@ class SimplePackingListProcessor:
                                     item.box_quantities[box_number] = quantity
                                     self.boxes[box_number].add_item(item)
                                     box_total += quantity
-                                    print(f"  - Box {box_number}: {quantity} units")
+                                    debug_sampled(logger, "  - Box %s: %s units", box_number, quantity)
                         except (ValueError, TypeError) as e:
-                            print(f"Warning: Invalid quantity in row {row_count}, box {box_number}: {str(e)}")
+                            logger.warning("Invalid quantity in row %s, box %s: %s", row_count, box_number, str(e))
                             continue
 
                     # 更新总数量
                     item.quantity = total_quantity if total_quantity is not None else box_total
                     if total_quantity is not None and total_quantity != box_total:
-                        print(f"Warning: Total quantity ({total_quantity}) doesn't match sum of box quantities ({box_total})")
+                        logger.warning("Total quantity (%s) doesn't match sum of box quantities (%s)", total_quantity, box_total)
 
                     self.items.append(item)
 
                 except Exception as e:
-                    print(f"Warning: Error processing row {row_count}: {str(e)}")
+                    logger.warning("Error processing row %s: %s", row_count, str(e))
                     continue
 
             if not self.items:
                 raise ValueError("未找到有效的商品信息")
 
-            print(f"\nProcessing complete:")
-            print(f"- Total products: {len(self.items)}")
-            print(f"- Total boxes: {len(self.boxes)}")
-            for box_number, box in self.boxes.items():
-                box_type = box_types.get(box_number, "Unknown")
-                print(f"Box {box_number} (Type: {box_type}):")
-                print(f"  - Dimensions: {box.length}x{box.width}x{box.height} cm")
-                print(f"  - Weight: {box.weight} kg")
-                print(f"  - Items: {len(box.items)}")
+            ShipmentMatrix.from_items(self.items, list(self.boxes))
+
+            logger.info("Processing complete: %s products, %s boxes", len(self.items), len(self.boxes),
+                        extra={'fields': {'shipment_id': self.shipment_id, 'products': len(self.items),
+                                          'boxes': len(self.boxes)}})
+            if logger.isEnabledFor(logging.DEBUG):
+                for box_number, box in self.boxes.items():
+                    logger.debug("Box %s (Type: %s): %sx%sx%s cm, %s kg, %s items", box_number,
+                                 box_types.get(box_number, "Unknown"), box.length, box.width, box.height,
+                                 box.weight, len(box.items))
 
+            if cache_key:
+                self.cache.store_from(self, cache_key)
             return self.boxes
 
         except Exception as e:
-            print(f"Error processing file: {str(e)}")
+            logger.error("Error processing file %s: %s", self.file_path, str(e))
             return None
 
+    def _sheet_quirks(self):
+        """非默认工作表时，工作表名称参与缓存键"""
+        return {'sheet': self.sheet_name} if self.sheet_name is not None else {}
+
     def get_box_count(self) -> int:
         """获取箱子总数"""
         return len(self.boxes)
@@ -431,4 +568,46 @@ class SimplePackingListProcessor:
 
     def get_all_items(self) -> List[PackingListItem]:
         """获取所有商品信息"""
-        return self.items
\ No newline at end of file
+        return self.items
+
+
+def process_workbook(file_path: str, processor_class=PackingListProcessor, template_name: Optional[str] = None,
+                     max_workers: Optional[int] = None, cache=packing_list_cache) -> list:
+    """
+    解析装箱单工作簿：每个工作表是一票货，各自有 Shipment ID
+    只有一个工作表时按原方式流式读取；多个工作表时只打开一次工作簿读出所有行，再并行解析各工作表。
+    :param file_path: Excel文件路径
+    :param processor_class: PackingListProcessor 或 SimplePackingListProcessor
+    :param template_name: 模板名称（简单装箱单用于特殊处理某些模板）
+    :param max_workers: 并行解析的线程数（默认不超过CPU核数）
+    :param cache: 解析结果缓存
+    :return: 解析成功的处理器列表（按工作表顺序），每个处理器对应一票货
+    """
+    kwargs = {'template_name': template_name} if processor_class is SimplePackingListProcessor else {}
+
+    names = sheet_names(file_path)
+    if len(names) <= 1:
+        processor = processor_class(file_path, cache=cache)
+        return [processor] if processor.process(**kwargs) else []
+
+    sheets = {name: rows for name, rows in read_all_sheets(file_path).items()
+              if any(any(v is not None for v in row) for row in rows)}
+    processors = [processor_class(file_path, cache=cache, sheet_name=name, rows=rows)
+                  for name, rows in sheets.items()]
+    logger.info("Workbook has %s non-empty sheets", len(processors), extra={'fields': {'sheets': list(sheets)}})
+
+    workers = max_workers or min(len(processors), os.cpu_count() or 1) or 1
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='sheet') as executor:
+        # 每个线程复制一份上下文，各工作表的日志仍记入当前任务
+        futures = [executor.submit(contextvars.copy_context().run, processor.process, **kwargs)
+                   for processor in processors]
+        results = [future.result() for future in futures]
+
+    parsed = []
+    for processor, boxes in zip(processors, results):
+        processor.rows = None  # 解析完成后释放原始行
+        if boxes:
+            parsed.append(processor)
+        else:
+            logger.warning("Sheet %s skipped: no valid shipment data", processor.sheet_name)
+    return parsed
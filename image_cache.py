@@ -0,0 +1,213 @@
+"""
+发票插图缓存
+同一个 MSKU 出现在很多箱子和很多票货中，每次插图都要完整解码原图、按单元格大小缩放再重新编码。
+缩放后的图片按 (原图, 目标宽度, 目标高度, 原图修改时间) 缓存编码后的字节，可以直接交给 openpyxl 的 Image：
+- 进程内按最近使用时间保留一部分（总字节数有上限）
+- 磁盘上保存全部（目录总大小有上限，超出后按最近使用时间淘汰），服务重启后仍然有效
+原图更新后修改时间变化，自动生成新的缩放图。
+"""
+import os
+import hashlib
+import threading
+from io import BytesIO
+from collections import OrderedDict
+
+from PIL import Image as PILImage
+
+from task_log import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 'invoice_files', 'cache', 'embed_images')
+
+# 缩放或编码方式变化时递增，使旧缓存自动失效
+CACHE_FORMAT_VERSION = 1
+
+
+def resize_to_box(image_path, box_width, box_height):
+    """
+    按比例缩放图片以放入 box_width x box_height（像素）的区域
+    :return: PNG 编码的字节
+    """
+    with PILImage.open(image_path) as img:
+        original_width, original_height = img.size
+        scale = min(box_width / original_width, box_height / original_height)
+        new_width = int(original_width * scale)
+        new_height = int(original_height * scale)
+        img = img.resize((new_width, new_height), PILImage.Resampling.LANCZOS)
+    buffer = BytesIO()
+    # 缩放后的图片没有原始格式，统一保存为 PNG
+    img.save(buffer, format=img.format if img.format else 'PNG')
+    return buffer.getvalue()
+
+
+class EmbedImageCache:
+    """按 (原图, 目标宽度, 目标高度, 原图修改时间) 缓存缩放后的插图"""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=256 * 1024 * 1024, memory_bytes=32 * 1024 * 1024):
+        """
+        :param cache_dir: 缓存目录
+        :param max_bytes: 缓存目录总大小上限（字节）
+        :param memory_bytes: 进程内缓存总大小上限（字节）
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.memory_bytes = memory_bytes
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._memory_total = 0
+        self._lock = threading.Lock()
+        # 正在生成的缩放图，同一张图只由一个线程生成
+        self._building = {}
+        # 最近使用的目标大小（新图片入库时按这些大小预先生成插图）
+        self._recent_boxes = OrderedDict()
+
+    @staticmethod
+    def make_key(image_path, box_width, box_height, stamp=None):
+        """
+        生成缓存键
+        :param image_path: 原图路径
+        :param box_width: 目标宽度（像素）
+        :param box_height: 目标高度（像素）
+        :param stamp: 原图 (修改时间, 大小)（可选，为空时读取文件信息）
+        """
+        if stamp is None:
+            st = os.stat(image_path)
+            stamp = st.st_mtime_ns, st.st_size
+        raw = (f"v{CACHE_FORMAT_VERSION}|{os.path.abspath(image_path)}|{box_width!r}|{box_height!r}"
+               f"|{stamp[0]}|{stamp[1]}")
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.png")
+
+    def get(self, image_path, box_width, box_height, stamp=None):
+        """
+        获取缩放后的图片（不存在时生成）
+        :param image_path: 原图路径
+        :param box_width: 目标宽度（像素）
+        :param box_height: 目标高度（像素）
+        :param stamp: 原图 (修改时间, 大小)（可选，图片索引中已有时不再读取文件信息）
+        :return: 编码后的图片字节
+        """
+        key = self.make_key(image_path, box_width, box_height, stamp)
+        self._note_box(box_width, box_height)
+        data = self._from_memory(key)
+        if data is not None:
+            self.memory_hits += 1
+            return data
+
+        with self._lock:
+            event = self._building.get(key)
+            owner = event is None
+            if owner:
+                event = self._building[key] = threading.Event()
+        if not owner:
+            # 其他线程正在生成同一张图，等待结果
+            event.wait(timeout=30)
+            return self.get(image_path, box_width, box_height, stamp)
+
+        try:
+            data = self._from_disk(key)
+            if data is not None:
+                self.disk_hits += 1
+            else:
+                self.misses += 1
+                data = resize_to_box(image_path, box_width, box_height)
+                self._write(key, data)
+            self._remember(key, data)
+            return data
+        finally:
+            with self._lock:
+                self._building.pop(key, None)
+            event.set()
+
+    def _note_box(self, box_width, box_height):
+        with self._lock:
+            self._recent_boxes[(box_width, box_height)] = None
+            self._recent_boxes.move_to_end((box_width, box_height))
+            while len(self._recent_boxes) > 16:
+                self._recent_boxes.popitem(last=False)
+
+    def warm(self, image_path):
+        """按最近使用过的目标大小预先生成缩放图（新图片入库后调用）"""
+        with self._lock:
+            boxes = list(self._recent_boxes)
+        for box_width, box_height in boxes:
+            self.get(image_path, box_width, box_height)
+
+    def _from_memory(self, key):
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+            return data
+
+    def _remember(self, key, data):
+        with self._lock:
+            if key in self._memory:
+                return
+            self._memory[key] = data
+            self._memory_total += len(data)
+            while self._memory_total > self.memory_bytes and len(self._memory) > 1:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_total -= len(evicted)
+
+    def _from_disk(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path, None)  # 更新最近使用时间，用于淘汰
+            return data
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning("读取插图缓存失败，将重新缩放: %s", str(e))
+            return None
+
+    def _write(self, key, data):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            path = self._path(key)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self._evict()
+        except Exception as e:
+            logger.warning("写入插图缓存失败: %s", str(e))
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            total = 0
+            for entry in os.scandir(self.cache_dir):
+                if entry.name.endswith('.png'):
+                    st = entry.stat()
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+                    total += st.st_size
+            if total <= self.max_bytes:
+                return
+            for _, size, path in sorted(entries):
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                if total <= self.max_bytes:
+                    break
+
+    def stats(self):
+        hits = self.memory_hits + self.disk_hits
+        total = hits + self.misses
+        return {'memory_hits': self.memory_hits, 'disk_hits': self.disk_hits, 'misses': self.misses,
+                'hit_rate': round(hits / total, 4) if total else None,
+                'memory_entries': len(self._memory), 'memory_bytes': self._memory_total}
+
+
+# 默认插图缓存，供发票生成器共用
+embed_image_cache = EmbedImageCache()
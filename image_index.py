@@ -0,0 +1,161 @@
+"""
+产品图片目录索引
+生成发票时每一行、MSKU 编辑页每张缩略图都要确认 {msku}.jpg / {msku}.png 是否存在，
+一张发票就是几千次文件系统调用，而图片目录只在上传时才变化。
+索引在启动时扫描一次图片目录，之后查找图片只是一次字典查找：
+- 通过本服务上传的图片由入库流程直接更新索引
+- 其他途径放入目录的图片：每隔几秒检查一次目录的修改时间，变化时重新扫描；
+  另外定期完整扫描一次，以发现原地覆盖的文件
+"""
+import os
+import threading
+import time
+
+from PIL import Image
+
+from task_log import get_logger
+
+logger = get_logger(__name__)
+
+# 产品图片的扩展名（同一 MSKU 有多个文件时按顺序优先）
+IMAGE_EXTENSIONS = ('.jpg', '.png')
+_FORMATS = {'.jpg': 'jpeg', '.png': 'png'}
+
+# 检查目录修改时间的间隔（秒）
+CHECK_INTERVAL = 5
+# 完整重新扫描的间隔（秒）
+RESCAN_INTERVAL = 300
+
+
+class ImageEntry:
+    """一张产品图片"""
+
+    __slots__ = ('path', 'format', 'mtime_ns', 'size', '_dimensions')
+
+    def __init__(self, path, mtime_ns, size):
+        """
+        :param path: 图片文件路径
+        :param mtime_ns: 修改时间（纳秒）
+        :param size: 文件大小（字节）
+        """
+        self.path = path
+        self.format = _FORMATS.get(os.path.splitext(path)[1])
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self._dimensions = None
+
+    @property
+    def stamp(self):
+        """(修改时间, 大小)，用作缓存键"""
+        return self.mtime_ns, self.size
+
+    @property
+    def dimensions(self):
+        """图片尺寸 (宽, 高)，第一次访问时读取文件头，无法读取时为 None"""
+        if self._dimensions is None:
+            try:
+                with Image.open(self.path) as img:
+                    self._dimensions = img.size
+            except Exception:
+                return None
+        return self._dimensions
+
+
+class ProductImageIndex:
+    """MSKU -> 产品图片 的内存索引"""
+
+    def __init__(self, image_folder, check_interval=CHECK_INTERVAL, rescan_interval=RESCAN_INTERVAL):
+        """
+        :param image_folder: 产品图片目录
+        :param check_interval: 检查目录修改时间的间隔（秒）
+        :param rescan_interval: 完整重新扫描的间隔（秒）
+        """
+        self.image_folder = image_folder
+        self.check_interval = check_interval
+        self.rescan_interval = rescan_interval
+        self._entries = {}
+        self._folder_mtime = None
+        self._next_check = 0
+        self._next_rescan = 0
+        self._lock = threading.Lock()
+
+    def scan(self):
+        """扫描图片目录，重建索引"""
+        entries = {}
+        try:
+            folder_mtime = os.stat(self.image_folder).st_mtime_ns
+            with os.scandir(self.image_folder) as it:
+                for entry in it:
+                    msku, ext = os.path.splitext(entry.name)
+                    if ext not in _FORMATS or not entry.is_file():
+                        continue
+                    if msku in entries and ext != IMAGE_EXTENSIONS[0]:
+                        # 已有优先的 .jpg
+                        continue
+                    st = entry.stat()
+                    entries[msku] = ImageEntry(entry.path, st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            folder_mtime = None
+        now = time.monotonic()
+        with self._lock:
+            self._entries = entries
+            self._folder_mtime = folder_mtime
+            self._next_check = now + self.check_interval
+            self._next_rescan = now + self.rescan_interval
+        logger.debug("已扫描产品图片目录，共 %d 张图片", len(entries))
+        return self
+
+    def _refresh(self):
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        if now >= self._next_rescan:
+            self.scan()
+            return
+        try:
+            folder_mtime = os.stat(self.image_folder).st_mtime_ns
+        except FileNotFoundError:
+            folder_mtime = None
+        if folder_mtime != self._folder_mtime:
+            self.scan()
+        else:
+            self._next_check = now + self.check_interval
+
+    def lookup(self, msku):
+        """
+        查找产品图片
+        :param msku: 产品MSKU
+        :return: ImageEntry，没有图片时返回 None
+        """
+        self._refresh()
+        return self._entries.get(msku)
+
+    def update(self, msku, path):
+        """
+        图片入库后更新索引
+        :param msku: 产品MSKU
+        :param path: 新的图片文件路径
+        """
+        st = os.stat(path)
+        with self._lock:
+            self._entries[msku] = ImageEntry(path, st.st_mtime_ns, st.st_size)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def image_index_for(image_folder):
+    """
+    产品图片目录的共享索引（同一目录只建立一个索引）
+    :param image_folder: 产品图片目录
+    """
+    folder = os.path.abspath(image_folder)
+    with _indexes_lock:
+        index = _indexes.get(folder)
+        if index is None:
+            index = _indexes[folder] = ProductImageIndex(folder)
+    return index
@@ -0,0 +1,182 @@
+"""
+产品图片入库
+上传的图片（包括批量导入的 zip）只在这里解码一次：按 EXIF 方向转正、限制最长边后保存为标准化的主图
+（有透明通道的保存为 PNG，其余保存为 JPEG），随后在后台线程池中预先生成缩略图和发票插图，
+生成发票和打开 MSKU 编辑页时只读取已经缩小好的图片。
+"""
+import os
+import threading
+import zipfile
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps
+
+from task_log import get_logger
+from image_index import IMAGE_EXTENSIONS, image_index_for
+
+logger = get_logger(__name__)
+
+# 主图最长边（像素），手机拍摄的大图入库时缩小到该尺寸
+MASTER_MAX_SIZE = int(os.getenv('TICKET_IMAGE_MAX_SIZE', '1600'))
+# 主图 JPEG 质量
+MASTER_JPEG_QUALITY = 90
+# 入库线程数（Pillow 解码和缩放时释放 GIL）
+INGEST_WORKERS = int(os.getenv('TICKET_IMAGE_WORKERS', '0')) or min(4, os.cpu_count() or 1)
+# zip 中单张图片的大小上限（字节），超出的条目跳过
+MAX_ENTRY_BYTES = 50 * 1024 * 1024
+# zip 中可导入的图片扩展名
+ZIP_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp', '.gif', '.tif', '.tiff')
+# EXIF 方向标签
+EXIF_ORIENTATION = 0x0112
+
+
+class ImageIngestError(ValueError):
+    """图片无法入库（MSKU 不合法或文件不是图片）"""
+
+
+def valid_msku(msku):
+    """MSKU 会作为文件名使用，不能包含路径"""
+    return bool(msku) and msku == os.path.basename(msku) and '\\' not in msku and not msku.startswith('.')
+
+
+def _zip_entry_name(info):
+    """zip 条目的文件名（没有 UTF-8 标记的条目按 GBK 解码，兼容 Windows 中文系统打包的 zip）"""
+    if info.flag_bits & 0x800:
+        return info.filename
+    try:
+        return info.filename.encode('cp437').decode('gbk')
+    except (UnicodeEncodeError, UnicodeDecodeError):
+        return info.filename
+
+
+class ImageIngest:
+    """产品图片入库"""
+
+    def __init__(self, image_folder, thumbnail_cache=None, embed_cache=None, max_workers=INGEST_WORKERS,
+                 image_index=None):
+        """
+        :param image_folder: 产品图片目录
+        :param thumbnail_cache: 缩略图缓存（ThumbnailCache，可选，入库后预先生成缩略图）
+        :param embed_cache: 发票插图缓存（EmbedImageCache，可选，入库后按最近使用的单元格大小预先生成插图）
+        :param max_workers: 线程数
+        :param image_index: 产品图片目录索引（可选，默认使用该目录的共享索引）
+        """
+        self.image_folder = image_folder
+        self.image_index = image_index if image_index else image_index_for(image_folder)
+        self.thumbnail_cache = thumbnail_cache
+        self.embed_cache = embed_cache
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='image-ingest')
+
+    def ingest(self, msku, data):
+        """
+        标准化并保存一张产品图片，在后台生成缩略图和插图
+        :param msku: 产品MSKU
+        :param data: 上传的图片字节
+        :return: {'msku', 'path', 'format', 'width', 'height'}
+        """
+        result = self._save_master(msku, data)
+        self._pool.submit(self._prepare_variants, msku, result['path'])
+        return result
+
+    def ingest_zip(self, file):
+        """
+        批量导入 zip 中的图片（文件名为 MSKU，例如 ABC-123.jpg），多张图片并行处理
+        :param file: zip 文件路径或文件对象
+        :return: (导入成功的结果列表, 失败列表 [{'name', 'error'}])
+        """
+        try:
+            archive = zipfile.ZipFile(file)
+        except zipfile.BadZipFile:
+            raise ImageIngestError("不是有效的 zip 文件")
+
+        imported, failed, entries = [], [], {}
+        with archive:
+            for info in archive.infolist():
+                name = _zip_entry_name(info)
+                base = os.path.basename(name.replace('\\', '/'))
+                msku, ext = os.path.splitext(base)
+                if info.is_dir() or name.startswith('__MACOSX/') or not base or base.startswith('.'):
+                    continue
+                if ext.lower() not in ZIP_IMAGE_EXTENSIONS:
+                    failed.append({'name': name, 'error': '不支持的文件类型'})
+                    continue
+                if info.file_size > MAX_ENTRY_BYTES:
+                    failed.append({'name': name, 'error': '图片过大'})
+                    continue
+                if msku in entries:
+                    failed.append({'name': name, 'error': f'MSKU {msku} 重复'})
+                    continue
+                entries[msku] = (name, archive.read(info))
+
+        futures = {msku: self._pool.submit(self._save_master, msku, data)
+                   for msku, (_, data) in entries.items()}
+        for msku, future in futures.items():
+            try:
+                result = future.result()
+            except Exception as e:
+                failed.append({'name': entries[msku][0], 'error': str(e)})
+                continue
+            imported.append(result)
+            self._pool.submit(self._prepare_variants, msku, result['path'])
+        logger.info("批量导入图片：成功 %d 张，失败 %d 张", len(imported), len(failed))
+        return imported, failed
+
+    def _save_master(self, msku, data):
+        if not valid_msku(msku):
+            raise ImageIngestError(f"MSKU 不合法: {msku}")
+        try:
+            with Image.open(BytesIO(data)) as img:
+                img.load()
+                source_format = img.format
+                upright = img.getexif().get(EXIF_ORIENTATION, 1) == 1
+                rotated = img if upright else ImageOps.exif_transpose(img)
+        except Image.UnidentifiedImageError:
+            raise ImageIngestError("无法识别的图片格式")
+        except Exception as e:
+            raise ImageIngestError(f"图片无法读取: {e}")
+
+        has_alpha = rotated.mode in ('RGBA', 'LA') or (rotated.mode == 'P' and 'transparency' in rotated.info)
+        ext, save_format = ('.png', 'PNG') if has_alpha else ('.jpg', 'JPEG')
+        oversized = max(rotated.size) > MASTER_MAX_SIZE
+        plain_mode = rotated.mode in ('RGB', 'L', 'RGBA', 'LA', 'P')
+        if source_format == save_format and upright and not oversized and plain_mode:
+            # 已经是合适的格式和尺寸，原样保存，避免重复压缩
+            payload = data
+        else:
+            rotated = rotated.convert('RGBA' if has_alpha else 'RGB')
+            if oversized:
+                rotated.thumbnail((MASTER_MAX_SIZE, MASTER_MAX_SIZE), Image.Resampling.LANCZOS)
+            buffer = BytesIO()
+            if has_alpha:
+                rotated.save(buffer, format='PNG', optimize=True)
+            else:
+                rotated.save(buffer, format='JPEG', quality=MASTER_JPEG_QUALITY, optimize=True)
+            payload = buffer.getvalue()
+
+        os.makedirs(self.image_folder, exist_ok=True)
+        path = os.path.join(self.image_folder, f"{msku}{ext}")
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+        # 删除其他格式的旧图片（查找图片时 .jpg 优先，旧图片会遮住新图片）
+        for other in IMAGE_EXTENSIONS:
+            if other != ext:
+                try:
+                    os.remove(os.path.join(self.image_folder, f"{msku}{other}"))
+                except FileNotFoundError:
+                    pass
+        self.image_index.update(msku, path)
+        return {'msku': msku, 'path': path, 'format': save_format.lower(),
+                'width': rotated.width, 'height': rotated.height}
+
+    def _prepare_variants(self, msku, path):
+        """预先生成缩略图和发票插图"""
+        try:
+            if self.thumbnail_cache is not None:
+                self.thumbnail_cache.warm(msku)
+            if self.embed_cache is not None:
+                self.embed_cache.warm(path)
+        except Exception as e:
+            logger.warning("预生成图片 %s 失败: %s", msku, str(e))
@@ -0,0 +1,158 @@
+"""
+合并单元格管理
+openpyxl 的 merge_cells 每次都要线性扫描工作表中已有的全部合并区域（检查是否重复），
+unmerge 也要先在全部区域中查找，按箱合并时总耗时随箱数平方增长。
+MergedRangeIndex 为一个工作表的合并区域建立按起始行分桶的区间索引：
+- 解除合并：一次查询找出区域内的所有合并单元格，批量移除
+- 合并：先登记，填充结束后统一合并一次，重叠检查只查询索引
+"""
+from collections import defaultdict
+from typing import Iterable, List, Tuple
+
+from openpyxl.utils import get_column_letter
+from openpyxl.worksheet.cell_range import CellRange
+from openpyxl.worksheet.merge import MergedCellRange
+
+from cell_styles import CENTER
+from task_log import get_logger
+
+logger = get_logger(__name__)
+
+# (start_row, end_row, start_col, end_col)
+Area = Tuple[int, int, int, int]
+
+
+class MergedRangeIndex:
+    """一个工作表的合并单元格索引"""
+
+    def __init__(self, sheet):
+        """
+        :param sheet: 工作表对象（建立索引后应只通过本对象合并/解除合并）
+        """
+        self.sheet = sheet
+        self._by_row = defaultdict(list)
+        self._max_height = 1
+        self._pending: List[Area] = []
+        self._pending_set = set()
+        for merged_range in sheet.merged_cells.ranges:
+            self._index(merged_range)
+
+    def _index(self, merged_range):
+        self._by_row[merged_range.min_row].append(merged_range)
+        self._max_height = max(self._max_height, merged_range.max_row - merged_range.min_row + 1)
+
+    def _unindex(self, merged_range):
+        bucket = self._by_row[merged_range.min_row]
+        bucket.remove(merged_range)
+        if not bucket:
+            del self._by_row[merged_range.min_row]
+
+    def _candidates(self, first_row, last_row):
+        """起始行在 [first_row, last_row] 内的合并区域"""
+        if last_row - first_row + 1 > len(self._by_row):
+            rows = [r for r in self._by_row if first_row <= r <= last_row]
+        else:
+            rows = [r for r in range(first_row, last_row + 1) if r in self._by_row]
+        for row in rows:
+            yield from self._by_row[row]
+
+    def within(self, start_row, end_row, start_col, end_col) -> list:
+        """完全位于指定区域内的合并区域"""
+        return [r for r in self._candidates(start_row, end_row)
+                if r.max_row <= end_row and r.min_col >= start_col and r.max_col <= end_col]
+
+    def overlapping(self, start_row, end_row, start_col, end_col) -> list:
+        """与指定区域有交集的合并区域"""
+        return [r for r in self._candidates(start_row - self._max_height + 1, end_row)
+                if r.max_row >= start_row and r.min_col <= end_col and r.max_col >= start_col]
+
+    def unmerge(self, *areas: Area) -> int:
+        """
+        解除各区域内的所有合并单元格
+        :param areas: (start_row, end_row, start_col, end_col)
+        :return: 解除的合并区域数量
+        """
+        targets = {}
+        for area in areas:
+            for merged_range in self.within(*area):
+                targets[id(merged_range)] = merged_range
+        if not targets:
+            return 0
+
+        cells = self.sheet._cells
+        ranges = self.sheet.merged_cells.ranges
+        for merged_range in targets.values():
+            self._unindex(merged_range)
+            ranges.discard(merged_range)
+            coords = merged_range.cells
+            next(coords)  # 保留左上角单元格
+            for coord in coords:
+                cells.pop(coord, None)
+        return len(targets)
+
+    def regroup(self, unmerge_areas: Iterable[Area], merge_areas: Iterable[Area]) -> bool:
+        """
+        解除 unmerge_areas 内的合并单元格，并登记 merge_areas 为新的合并区域
+        解除前先检查：新区域与解除后剩下的合并区域部分重叠时（模板版式与配置不一致），
+        不做任何改动，保留模板原有的合并区域
+        :return: 是否已解除并登记
+        """
+        unmerge_areas, merge_areas = list(unmerge_areas), list(merge_areas)
+        removed = {id(r) for area in unmerge_areas for r in self.within(*area)}
+        for start_row, end_row, start_col, end_col in merge_areas:
+            for r in self.overlapping(start_row, end_row, start_col, end_col):
+                if id(r) in removed:
+                    continue
+                if not (r.min_row <= start_row and r.max_row >= end_row and
+                        r.min_col <= start_col and r.max_col >= end_col):
+                    coord = f"{get_column_letter(start_col)}{start_row}:{get_column_letter(end_col)}{end_row}"
+                    logger.error("合并区域 %s 与模板中的 %s 重叠，保留模板原有的合并区域", coord, r.coord)
+                    return False
+        self.unmerge(*unmerge_areas)
+        self.merge_many(merge_areas)
+        return True
+
+    def merge(self, start_row, end_row, start_col, end_col):
+        """登记一个待合并区域，调用 apply() 时统一合并"""
+        area = (start_row, end_row, start_col, end_col)
+        if area not in self._pending_set:
+            self._pending_set.add(area)
+            self._pending.append(area)
+
+    def merge_many(self, areas: Iterable[Area]):
+        for area in areas:
+            self.merge(*area)
+
+    def apply(self, format_cells=True) -> int:
+        """
+        合并所有登记的区域，左上角单元格居中
+        已被某个合并区域包含的区域直接跳过，与已有合并区域部分重叠的区域跳过并记录错误
+        :param format_cells: 为 False 时只登记合并区域，不改动工作表中的单元格（流式输出时单元格已写出）
+        :return: 合并的区域数量
+        """
+        sheet = self.sheet
+        ranges = sheet.merged_cells.ranges
+        merged = 0
+        for start_row, end_row, start_col, end_col in self._pending:
+            coord = f"{get_column_letter(start_col)}{start_row}:{get_column_letter(end_col)}{end_row}"
+            if start_row == end_row and start_col == end_col:
+                continue
+            existing = self.overlapping(start_row, end_row, start_col, end_col)
+            if existing:
+                if not any(r.min_row <= start_row and r.max_row >= end_row and
+                           r.min_col <= start_col and r.max_col >= end_col for r in existing):
+                    logger.error("合并单元格时发生错误: %s 与已有的合并区域重叠", coord)
+                continue
+            if format_cells:
+                merged_range = MergedCellRange(sheet, coord)
+                ranges.add(merged_range)
+                sheet._clean_merge_range(merged_range)
+                merged_range.start_cell.alignment = CENTER
+            else:
+                merged_range = CellRange(coord)
+                ranges.add(merged_range)
+            self._index(merged_range)
+            merged += 1
+        self._pending.clear()
+        self._pending_set.clear()
+        return merged
@@ -0,0 +1,142 @@
+"""
+装箱单解析结果缓存
+以 文件内容哈希 + 处理器类型 + 模板特殊处理（如依诺达删除第一列）为键，
+将解析出的 shipment_id / boxes / items 压缩序列化到磁盘，重复处理同一装箱单时直接跳过解析。
+缓存目录总大小有上限，超出后按最近使用时间淘汰。
+"""
+import os
+import zlib
+import pickle
+import hashlib
+import threading
+
+from task_log import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 'invoice_files', 'cache', 'packing_lists')
+
+# 解析结果结构变化时递增，使旧缓存自动失效
+CACHE_FORMAT_VERSION = 2
+
+
+class PackingListCache:
+    """基于内容哈希的装箱单解析结果缓存"""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=256 * 1024 * 1024):
+        """
+        :param cache_dir: 缓存目录
+        :param max_bytes: 缓存目录总大小上限（字节）
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._digests = {}
+
+    @staticmethod
+    def file_hash(file_path):
+        """计算文件内容的SHA-256"""
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _file_digest(self, file_path):
+        """文件哈希（按 路径+修改时间+大小 记忆，同一文件的多个工作表只计算一次）"""
+        st = os.stat(file_path)
+        stat_key = (os.path.abspath(file_path), st.st_mtime_ns, st.st_size)
+        digest = self._digests.get(stat_key)
+        if digest is None:
+            digest = self.file_hash(file_path)
+            if len(self._digests) >= 256:
+                self._digests.clear()
+            self._digests[stat_key] = digest
+        return digest
+
+    def make_key(self, file_path, processor_name, **quirks):
+        """
+        生成缓存键
+        :param file_path: 装箱单文件路径
+        :param processor_name: 处理器类型名称
+        :param quirks: 影响解析结果的模板特殊处理参数
+        """
+        quirk_str = ','.join(f"{k}={quirks[k]}" for k in sorted(quirks))
+        raw = f"v{CACHE_FORMAT_VERSION}|{processor_name}|{quirk_str}|{self._file_digest(file_path)}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.bin")
+
+    def get(self, key):
+        """读取缓存，未命中返回None"""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                payload = pickle.loads(zlib.decompress(f.read()))
+            os.utime(path, None)  # 更新最近使用时间，用于淘汰
+            self.hits += 1
+            return payload
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception as e:
+            logger.warning("读取装箱单缓存失败，将重新解析: %s", str(e))
+            self.misses += 1
+            return None
+
+    def put(self, key, payload):
+        """写入缓存，并在超出大小上限时淘汰最久未使用的条目"""
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            data = zlib.compress(pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL))
+            path = self._path(key)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self._evict()
+        except Exception as e:
+            logger.warning("写入装箱单缓存失败: %s", str(e))
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            total = 0
+            for entry in os.scandir(self.cache_dir):
+                if entry.name.endswith('.bin'):
+                    st = entry.stat()
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+                    total += st.st_size
+            if total <= self.max_bytes:
+                return
+            for _, size, path in sorted(entries):
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                if total <= self.max_bytes:
+                    break
+
+    def load_into(self, processor, key):
+        """
+        命中缓存时把解析结果恢复到处理器上
+        :return: 是否命中
+        """
+        payload = self.get(key)
+        if payload is None:
+            return False
+        processor.shipment_id, processor.boxes, processor.items = payload
+        return True
+
+    def store_from(self, processor, key):
+        """缓存处理器的解析结果"""
+        self.put(key, (processor.shipment_id, processor.boxes, processor.items))
+
+
+# 默认缓存实例，供装箱单处理器共用
+packing_list_cache = PackingListCache()
@@ -0,0 +1,178 @@
+"""
+装箱单格式嗅探
+上传时只流式读取前几十行，自动识别领星装箱单 / 简单装箱单，并检查两个处理器依赖的结构标记
+（Shipment ID、箱号行、商品行），在入队之前同步拒绝格式不正确的文件。
+多个工作表的工作簿与 process_workbook 一样逐个工作表检查（空工作表跳过），只要有一个工作表可用就接受，
+不可用的工作表记录在结果中。
+行号与处理器中 DataFrame 的行号一致（不含表头行）。
+"""
+from itertools import islice
+from typing import NamedTuple, Optional, Tuple
+
+from excel_reader import iter_rows, sheet_names
+from task_log import get_logger
+
+logger = get_logger(__name__)
+
+# 嗅探读取的最大行数：箱号行、Shipment ID 和第一条商品都在表格顶部
+SNIFF_ROWS = 60
+
+FORMAT_LINGXING = 'lingxing'
+FORMAT_SIMPLE = 'simple'
+
+
+class PackingListFormatError(ValueError):
+    """装箱单结构不符合要求"""
+    pass
+
+
+class SniffResult(NamedTuple):
+    """嗅探结果"""
+    format: str  # FORMAT_LINGXING 或 FORMAT_SIMPLE
+    shipment_id: str
+    column_offset: int  # 简单装箱单左侧多余列数（依诺达为1）
+    first_data_row: int  # 第一条商品所在行
+    sheet_name: Optional[str] = None  # 多工作表时第一个可用的工作表
+    sheet_errors: Tuple[Tuple[str, str], ...] = ()  # 多工作表时不可用的工作表 ((名称, 原因), ...)
+
+    @property
+    def is_simple_format(self) -> bool:
+        return self.format == FORMAT_SIMPLE
+
+
+def _cell(row, col):
+    value = row[col] if col < len(row) else None
+    if value is None:
+        return ''
+    return str(value).strip()
+
+
+def _is_positive_number(value) -> bool:
+    try:
+        return value is not None and float(value) > 0
+    except (ValueError, TypeError):
+        return False
+
+
+def _find_box_number_row(rows):
+    """查找简单装箱单的箱号行，返回 (行号, 左侧偏移列数)"""
+    for index, row in enumerate(rows):
+        for offset in (0, 1):
+            if _cell(row, offset + 1) == '箱号':
+                return index, offset
+    return None, None
+
+
+def _check_simple(rows, box_row, offset, template_name, truncated) -> SniffResult:
+    expected_offset = 1 if template_name and "依诺达" in template_name else 0
+    if offset != expected_offset:
+        if expected_offset:
+            raise PackingListFormatError("依诺达装箱单第一列应为多余列，请检查文件是否选错模板")
+        raise PackingListFormatError("装箱单第一列多出一列，只有依诺达模板支持该格式")
+
+    shipment_id = _cell(rows[0], offset + 1)
+    if not shipment_id:
+        raise PackingListFormatError("Shipment ID 为空（第2行第2列）")
+
+    if box_row < 2:
+        raise PackingListFormatError("箱号行上方缺少重量和箱规行")
+    box_numbers = [c for c in rows[box_row][offset + 2:] if c is not None and str(c).strip().isdigit()]
+    if not box_numbers:
+        raise PackingListFormatError("箱号行中没有有效的箱号")
+
+    data_row = box_row + 2
+    if data_row >= len(rows):
+        if truncated:
+            raise PackingListFormatError(f"前 {SNIFF_ROWS} 行内未找到商品数据")
+        raise PackingListFormatError("未找到有效的商品信息")
+    if not _cell(rows[data_row], offset):
+        raise PackingListFormatError("箱号行后两行应为第一条商品（SKU 为空）")
+
+    return SniffResult(FORMAT_SIMPLE, shipment_id, offset, data_row)
+
+
+def _check_lingxing(rows, truncated) -> SniffResult:
+    shipment_id = _cell(rows[0], 1)
+    if not shipment_id:
+        raise PackingListFormatError("Shipment ID 为空（第2行第2列）")
+
+    # 商品从第三行开始：序号为正数，MSKU、发货量不为空，且至少有一列每箱数量
+    for index in range(2, len(rows)):
+        row = rows[index]
+        if _is_positive_number(row[0] if row else None) and _cell(row, 1) and _cell(row, 5):
+            if len(row) <= 6:
+                raise PackingListFormatError("商品行缺少每箱数量列")
+            return SniffResult(FORMAT_LINGXING, shipment_id, 0, index)
+
+    if truncated:
+        raise PackingListFormatError(f"前 {SNIFF_ROWS} 行内未找到商品数据，也未找到箱号行")
+    raise PackingListFormatError("未找到商品数据，也未找到箱号行")
+
+
+class _EmptySheet(PackingListFormatError):
+    """工作表为空"""
+    pass
+
+
+def _sniff_sheet(file_path, sheet_name, template_name, max_rows) -> SniffResult:
+    """检查一个工作表的前 max_rows 行"""
+    try:
+        rows = list(islice(iter_rows(file_path, sheet_name), max_rows + 1))
+    except Exception as e:
+        raise PackingListFormatError(f"无法读取Excel文件: {str(e)}")
+
+    truncated = len(rows) > max_rows
+    rows = rows[1:]  # 第一行是表头，与处理器保持一致
+    if not rows or not any(any(v is not None for v in row) for row in rows):
+        raise _EmptySheet("Excel文件为空")
+
+    box_row, offset = _find_box_number_row(rows)
+    if box_row is not None:
+        return _check_simple(rows, box_row, offset, template_name, truncated)
+    return _check_lingxing(rows, truncated)
+
+
+def sniff_packing_list(file_path: str, template_name: Optional[str] = None,
+                       max_rows: int = SNIFF_ROWS) -> SniffResult:
+    """
+    识别装箱单格式并做结构预校验
+    :param file_path: 装箱单文件路径
+    :param template_name: 模板名称（依诺达装箱单多一列）
+    :param max_rows: 最多读取的行数
+    :return: SniffResult（多工作表时为第一个可用工作表的结果）
+    :raises PackingListFormatError: 文件无法读取，或没有结构正确的工作表
+    """
+    try:
+        names = sheet_names(file_path)
+    except Exception as e:
+        raise PackingListFormatError(f"无法读取Excel文件: {str(e)}")
+
+    if len(names) <= 1:
+        result = _sniff_sheet(file_path, None, template_name, max_rows)
+        logger.debug("Sniffed %s as %s (Shipment ID: %s)", file_path, result.format, result.shipment_id)
+        return result
+
+    results, errors = [], []
+    for name in names:
+        try:
+            result = _sniff_sheet(file_path, name, template_name, max_rows)
+        except _EmptySheet:
+            continue
+        except PackingListFormatError as e:
+            errors.append((name, str(e)))
+            continue
+        if results and result.format != results[0].format:
+            errors.append((name, f"装箱单格式与工作表 {results[0].sheet_name} 不同"))
+            continue
+        results.append(result._replace(sheet_name=name))
+
+    if not results:
+        if not errors:
+            raise PackingListFormatError("Excel文件为空")
+        raise PackingListFormatError("没有可用的工作表（" + "；".join(f"{name}: {error}" for name, error in errors) + "）")
+    if errors:
+        logger.warning("装箱单中有 %d 个工作表不可用，将跳过", len(errors), extra={'fields': {'sheets': dict(errors)}})
+    result = results[0]._replace(sheet_errors=tuple(errors))
+    logger.debug("Sniffed %s as %s (%d sheets, first Shipment ID: %s)", file_path, result.format, len(results),
+                 result.shipment_id)
+    return result
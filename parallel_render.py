@@ -0,0 +1,124 @@
+"""
+数据行并行渲染
+箱数很多的发票在 XML 改写模式下，生成数据行 XML 是主要耗时。数据区按箱切成若干段连续的行，
+每段在子进程中取值并生成行 XML（xlsx_patch.RowChunk），主进程按各段预先分配好的起始行拼接：
+- 分段只在箱子边界上切开，按箱合并的区域不会跨段
+- 每段的起始行号在分段时确定，合并区域、行高和图片锚点都直接使用绝对行号
+- 产品图片仍在主进程中插入（子进程只返回需要插图的行号和 MSKU）
+- 任何一段失败时由调用方改为单进程渲染
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from task_log import get_logger
+
+logger = get_logger(__name__)
+
+# 数据行达到该数量时才并行渲染（行数较少时进程间传递数据的开销超过节省的时间）
+PARALLEL_ROW_THRESHOLD = int(os.getenv('TICKET_PARALLEL_ROWS', '2000'))
+# 每段至少包含的行数
+MIN_CHUNK_ROWS = int(os.getenv('TICKET_PARALLEL_CHUNK_ROWS', '500'))
+# 子进程数量，默认与 CPU 核数相同
+MAX_WORKERS = int(os.getenv('TICKET_PARALLEL_WORKERS', '0')) or os.cpu_count() or 1
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class RowChunkTask:
+    """交给子进程渲染的一段数据行"""
+
+    __slots__ = ('spec_source', 'first_row', 'last_row', 'boxes', 'products', 'code', 'address_info',
+                 'today', 'box_count', 'cells', 'rows', 'composed', 'row_height')
+
+    def __init__(self, spec_source, first_row, last_row, boxes, products, code, address_info,
+                 today, box_count, cells, rows, composed, row_height):
+        """
+        :param spec_source: 模板配置文件 (路径, 修改时间)（子进程按路径加载并缓存填充计划）
+        :param first_row: 本段第一行的行号
+        :param last_row: 本段最后一行的行号
+        :param boxes: 本段的箱子 [(箱号, PackingListBox)]
+        :param products: 本段用到的产品信息 {msku: 产品信息}
+        :param today: 主进程的填充日期（各段保持一致）
+        :param box_count: 整票货的箱数（boxes.count）
+        :param cells: 这些行中原有的模板单元格
+        :param rows: 这些行原有的行属性
+        :param composed: 预先组合好的单元格格式 {(原有格式索引, 命名样式): 新格式索引}
+        :param row_height: 数据行行高（为空时沿用模板行高）
+        """
+        self.spec_source = spec_source
+        self.first_row = first_row
+        self.last_row = last_row
+        self.boxes = boxes
+        self.products = products
+        self.code = code
+        self.address_info = address_info
+        self.today = today
+        self.box_count = box_count
+        self.cells = cells
+        self.rows = rows
+        self.composed = composed
+        self.row_height = row_height
+
+
+def split_boxes(sorted_boxes, start_row, workers=None, min_rows=None):
+    """
+    按箱子边界把数据行切成连续的若干段
+    :param sorted_boxes: 按箱号排序的 [(箱号, PackingListBox)]
+    :param start_row: 第一个数据行的行号
+    :param workers: 子进程数量（默认 MAX_WORKERS）
+    :param min_rows: 每段至少包含的行数（默认 MIN_CHUNK_ROWS）
+    :return: [(首行, 末行, [(箱号, PackingListBox)])]，空箱不占行
+    """
+    workers = workers or MAX_WORKERS
+    min_rows = min_rows or MIN_CHUNK_ROWS
+    total = sum(len(box.items) for _, box in sorted_boxes)
+    if total == 0:
+        return []
+    target = max(min_rows, -(-total // workers))
+
+    chunks = []
+    boxes, first_row, row_num = [], start_row, start_row
+    for entry in sorted_boxes:
+        boxes.append(entry)
+        row_num += len(entry[1].items)
+        if row_num - first_row >= target:
+            chunks.append((first_row, row_num - 1, boxes))
+            boxes, first_row = [], row_num
+    if row_num > first_row:
+        chunks.append((first_row, row_num - 1, boxes))
+    return chunks
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # 使用 spawn：Web 服务进程中有数据库连接和线程，不能 fork
+            _pool = ProcessPoolExecutor(max_workers=MAX_WORKERS,
+                                        mp_context=multiprocessing.get_context('spawn'))
+            logger.info("已启动数据行渲染进程池，进程数 %d", MAX_WORKERS)
+        return _pool
+
+
+def render_chunks(render, tasks):
+    """
+    在进程池中渲染各段数据行
+    :param render: 子进程中执行的渲染函数（模块级函数）
+    :param tasks: [RowChunkTask]
+    :return: 与 tasks 顺序一致的渲染结果；任何一段失败时抛出异常
+    """
+    global _pool
+    pool = _get_pool()
+    try:
+        return list(pool.map(render, tasks))
+    except BrokenProcessPool:
+        # 子进程异常退出后进程池不可再用，下次重新创建
+        with _pool_lock:
+            if _pool is pool:
+                _pool = None
+        raise
+
@@ -0,0 +1,317 @@
+"""
+产品信息共享缓存
+将 msku_info 集合打包成一个 mmap 可映射的二进制表（MSKU -> 打包记录，带版本戳）。
+同一台机器上的所有工作进程 / Web 进程只读映射同一个文件，由唯一的刷新进程负责重建。
+
+文件结构：
+- 头部：魔数(8s) 版本戳(Q) 记录数(I) 保留(I)
+- 索引：按 MSKU 哈希排序的 (哈希(Q), 记录偏移(I))，可直接在映射上二分查找
+- 记录：MSKU 及各字段，字段为 类型(B) + 数据，只在命中时解码所需的那一条记录
+"""
+import os
+import mmap
+import time
+import struct
+import hashlib
+import threading
+from bisect import bisect_left
+
+from task_log import get_logger
+
+try:
+    import fcntl
+except ImportError:  # Windows 下没有 fcntl，退化为单进程刷新
+    fcntl = None
+
+logger = get_logger(__name__)
+
+# 记录中保存的 msku_info 原始字段（与 InvoiceGenerator._get_product_info 使用的字段一致）
+PRODUCT_FIELDS = (
+    'productNameZh', 'productNameEn', 'useEn', 'useZh', 'materialEn', 'materialZh',
+    'HS', 'brand', 'model', 'productLink', 'askprice', 'electrified', 'magnetic', 'weight',
+)
+
+DEFAULT_TABLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                  'invoice_files', 'cache', 'product_table.bin')
+
+_MAGIC = b'PRODTBL1'
+_HEADER = struct.Struct('<8sQII')
+_INDEX_ENTRY = struct.Struct('<QI')
+_U32 = struct.Struct('<I')
+_I64 = struct.Struct('<q')
+_F64 = struct.Struct('<d')
+
+# 字段类型标记
+_T_MISSING, _T_STR, _T_INT, _T_FLOAT, _T_NONE = range(5)
+
+
+def _msku_hash(msku):
+    """跨进程稳定的 MSKU 哈希（内置 hash() 每个进程随机化，不能使用）"""
+    return int.from_bytes(hashlib.blake2b(str(msku).encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def _pack_value(value):
+    if isinstance(value, bool):
+        value = str(value)
+    if isinstance(value, int):
+        return bytes((_T_INT,)) + _I64.pack(value)
+    if isinstance(value, float):
+        return bytes((_T_FLOAT,)) + _F64.pack(value)
+    if value is None:
+        return bytes((_T_NONE,))
+    data = str(value).encode('utf-8')
+    return bytes((_T_STR,)) + _U32.pack(len(data)) + data
+
+
+def _pack_record(msku, product):
+    data = str(msku).encode('utf-8')
+    parts = [_U32.pack(len(data)), data]
+    for field in PRODUCT_FIELDS:
+        if field in product:
+            parts.append(_pack_value(product[field]))
+        else:
+            parts.append(bytes((_T_MISSING,)))
+    return b''.join(parts)
+
+
+def _unpack_str(buf, offset):
+    length, = _U32.unpack_from(buf, offset)
+    offset += 4
+    return bytes(buf[offset:offset + length]).decode('utf-8'), offset + length
+
+
+def _unpack_record(buf, offset):
+    """解码一条记录，返回 (msku, 字段字典)"""
+    msku, offset = _unpack_str(buf, offset)
+    product = {}
+    for field in PRODUCT_FIELDS:
+        tag = buf[offset]
+        offset += 1
+        if tag == _T_STR:
+            product[field], offset = _unpack_str(buf, offset)
+        elif tag == _T_INT:
+            product[field], = _I64.unpack_from(buf, offset)
+            offset += 8
+        elif tag == _T_FLOAT:
+            product[field], = _F64.unpack_from(buf, offset)
+            offset += 8
+        elif tag == _T_NONE:
+            product[field] = None
+    return msku, product
+
+
+def write_product_table(products, path=DEFAULT_TABLE_PATH, version=None):
+    """
+    将产品数据写成共享表文件（先写临时文件再原子替换，读者不会看到半成品）
+    :param products: 可迭代的 msku_info 文档
+    :param path: 表文件路径
+    :param version: 版本戳（默认使用当前时间纳秒）
+    :return: 写入的版本戳
+    """
+    version = version if version is not None else time.time_ns()
+    records = {}
+    for product in products:
+        msku = product.get('msku')
+        if msku is None or msku == '':
+            continue
+        records[str(msku)] = _pack_record(msku, product)
+
+    entries = sorted((_msku_hash(msku), msku) for msku in records)
+    data_start = _HEADER.size + _INDEX_ENTRY.size * len(entries)
+    index_parts = []
+    data_parts = []
+    offset = data_start
+    for key, msku in entries:
+        index_parts.append(_INDEX_ENTRY.pack(key, offset))
+        data_parts.append(records[msku])
+        offset += len(records[msku])
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, version, len(entries), 0))
+        f.writelines(index_parts)
+        f.writelines(data_parts)
+    os.replace(tmp_path, path)
+    return version
+
+
+class ProductTable:
+    """共享产品表的只读视图，文件被刷新进程替换后自动重新映射"""
+
+    def __init__(self, path=DEFAULT_TABLE_PATH, check_interval=1.0):
+        """
+        :param path: 表文件路径
+        :param check_interval: 检查文件是否被替换的最小间隔（秒）
+        """
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        # (映射, 哈希列) 作为一个整体替换，读者一次取出，不会拿到新旧混合的视图
+        self._view = None
+        self._stat_key = None
+        self._count = 0
+        self.version = None
+        self._next_check = 0.0
+
+    def _reload_if_changed(self):
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        with self._lock:
+            if now < self._next_check:
+                return
+            self._next_check = now + self.check_interval
+            try:
+                st = os.stat(self.path)
+            except OSError:
+                self._close()
+                return
+            stat_key = (st.st_ino, st.st_mtime_ns, st.st_size)
+            if stat_key == self._stat_key:
+                return
+            try:
+                with open(self.path, 'rb') as f:
+                    new_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError) as e:
+                logger.warning("映射产品共享表失败: %s", str(e))
+                return
+            magic, version, count, _ = _HEADER.unpack_from(new_map, 0)
+            if magic != _MAGIC:
+                new_map.close()
+                logger.warning("产品共享表格式不正确: %s", self.path)
+                return
+            # 只把哈希列读成列表，记录本身留在映射中按需解码
+            keys = [_INDEX_ENTRY.unpack_from(new_map, _HEADER.size + i * _INDEX_ENTRY.size)[0]
+                    for i in range(count)]
+            self._view, self._stat_key, self._count, self.version = (new_map, keys), stat_key, count, version
+
+    def _close(self):
+        # 旧映射不主动关闭：其他线程可能正在读取，最后一个引用释放后由 mmap 自行关闭
+        self._view, self._stat_key, self._count, self.version = None, None, 0, None
+
+    @property
+    def loaded(self):
+        self._reload_if_changed()
+        return self._view is not None
+
+    def get(self, msku):
+        """
+        查找产品原始字段
+        :param msku: 产品的MSKU
+        :return: msku_info 字段字典，不存在时返回 None
+        """
+        self._reload_if_changed()
+        view = self._view
+        if view is None or msku is None:
+            return None
+        table, keys = view
+        msku = str(msku)
+        key = _msku_hash(msku)
+        i = bisect_left(keys, key)
+        while i < len(keys) and keys[i] == key:
+            _, offset = _INDEX_ENTRY.unpack_from(table, _HEADER.size + i * _INDEX_ENTRY.size)
+            record_msku, product = _unpack_record(table, offset)
+            if record_msku == msku:
+                return product
+            i += 1
+        return None
+
+    def __len__(self):
+        self._reload_if_changed()
+        return self._count
+
+
+class ProductTableRefresher:
+    """
+    产品共享表刷新器
+    同一台机器上只有拿到文件锁的进程会真正刷新，其余进程的刷新器保持空闲，
+    任何进程都可以通过 request_refresh() 请求尽快重建。
+    """
+
+    def __init__(self, db_connector, path=DEFAULT_TABLE_PATH, interval=300):
+        """
+        :param db_connector: 数据库连接器（应为刷新器专用实例，避免与请求线程共用连接）
+        :param path: 表文件路径
+        :param interval: 定期全量刷新间隔（秒）
+        """
+        self.db_connector = db_connector
+        self.path = path
+        self.interval = interval
+        self.dirty_marker = f"{path}.dirty"
+        self._lock_file = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._last_refresh = 0.0
+
+    def _acquire_host_lock(self):
+        """获取主机级刷新锁，保证只有一个进程负责刷新"""
+        if self._lock_file is not None:
+            return True
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        lock_file = open(f"{self.path}.lock", 'a+')
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+        self._lock_file = lock_file
+        return True
+
+    def request_refresh(self):
+        """标记共享表需要重建（跨进程生效）"""
+        try:
+            os.makedirs(os.path.dirname(self.dirty_marker), exist_ok=True)
+            with open(self.dirty_marker, 'a'):
+                pass
+            os.utime(self.dirty_marker, None)
+        except OSError as e:
+            logger.warning("标记产品共享表刷新失败: %s", str(e))
+
+    def _needs_refresh(self):
+        if not os.path.exists(self.path):
+            return True
+        if time.time() - self._last_refresh >= self.interval:
+            return True
+        try:
+            return os.path.getmtime(self.dirty_marker) >= self._last_refresh
+        except OSError:
+            return False
+
+    def refresh(self):
+        """从 MongoDB 全量读取并重建共享表"""
+        started = time.time()
+        with self.db_connector as db:
+            products = db['msku_info'].find({}, {'_id': 0, 'msku': 1, **{f: 1 for f in PRODUCT_FIELDS}})
+            version = write_product_table(products, self.path)
+        self._last_refresh = started
+        logger.info("产品共享表已刷新，版本: %s，耗时 %.2fs", version, time.time() - started)
+        return version
+
+    def run_forever(self, poll_interval=1.0):
+        """刷新循环：未拿到主机锁时只等待，拿到后按需刷新"""
+        while not self._stop.is_set():
+            try:
+                if self._acquire_host_lock() and self._needs_refresh():
+                    self.refresh()
+            except Exception as e:
+                logger.error("刷新产品共享表时发生错误: %s", str(e))
+                self._last_refresh = time.time()
+            self._stop.wait(poll_interval)
+
+    def start(self):
+        """在后台线程中运行刷新循环"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run_forever, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+
+if __name__ == '__main__':
+    # 作为独立刷新进程运行：python product_cache.py
+    from db_connector import MongoDBConnector
+    ProductTableRefresher(MongoDBConnector()).run_forever()
@@ -0,0 +1,179 @@
+"""
+流式输出
+普通模式下 openpyxl 要把工作簿中所有单元格对象留在内存中直到保存，箱数很多的发票每个任务都占用大量内存。
+流式模式使用只写工作簿：模板的各工作表逐行复制到输出流（保留单元格样式、行高、列宽、合并单元格、
+图片和页面设置），数据行生成后立即写出，不再保留单元格对象，内存占用与数据行数基本无关。
+
+写入顺序必须按行递增：表头叠加在模板行上，数据行和汇总行随后写出，最后补齐模板中剩余的行。
+"""
+from copy import copy
+from collections import defaultdict
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.cell.cell import MergedCell
+from openpyxl.utils.indexed_list import IndexedList
+from openpyxl.worksheet.cell_range import CellRange
+
+from task_log import get_logger
+
+logger = get_logger(__name__)
+
+# 数据行超过该数量时，支持流式输出的模板自动使用流式模式
+STREAM_ROW_THRESHOLD = 3000
+
+# 叠加单元格时表示“保留模板中的值”
+_KEEP = object()
+
+# 从模板工作表复制到输出工作表的页面设置
+_SHEET_SETTINGS = ('sheet_format', 'sheet_properties', 'page_margins', 'page_setup', 'print_options',
+                   'views', 'conditional_formatting', 'data_validations', 'sheet_state')
+
+
+# 输出工作簿沿用模板工作簿的样式表（模板单元格的样式索引可以直接使用，默认字体也与模板一致）
+_STYLE_TABLES = ('_fonts', '_fills', '_borders', '_alignments', '_protections', '_number_formats',
+                 '_cell_styles', '_named_styles', '_differential_styles')
+
+
+class StreamingSheet:
+    """把一个模板工作表逐行复制到只写工作表，并在指定行叠加写入数据"""
+
+    def __init__(self, out_ws, template_ws, styles=None):
+        """
+        :param out_ws: 只写工作簿中的输出工作表
+        :param template_ws: 模板工作表（普通模式加载）
+        :param styles: 绑定到输出工作簿的命名样式（cell_styles.WorkbookStyles）
+        """
+        self.out_ws = out_ws
+        self.template_ws = template_ws
+        self.styles = styles
+        self.next_row = 1
+        self._template_rows = defaultdict(list)
+        for (row, _), cell in sorted(template_ws._cells.items()):
+            self._template_rows[row].append(cell)
+        self._last_template_row = max(self._template_rows, default=0)
+        self._overlays = defaultdict(dict)
+        self._copy_settings()
+
+    def _copy_settings(self):
+        src, out = self.template_ws, self.out_ws
+        for name in _SHEET_SETTINGS:
+            try:
+                setattr(out, name, copy(getattr(src, name)))
+            except Exception as e:
+                logger.debug("复制工作表设置 %s 失败: %s", name, str(e))
+        for key, dim in src.column_dimensions.items():
+            target = out.column_dimensions[key]
+            target.width = dim.width
+            target.hidden = dim.hidden
+            target.min, target.max = dim.min, dim.max
+        if src.print_area:
+            out.print_area = src.print_area
+        if src.freeze_panes:
+            out.freeze_panes = src.freeze_panes
+
+    def overlay(self, row, col, value=_KEEP, style=None):
+        """
+        登记一个叠加写入的单元格，写到该行时生效
+        :param value: 单元格的值（不传时保留模板中的值，只设置样式）
+        :param style: 命名样式
+        """
+        if row < self.next_row:
+            raise ValueError(f"第 {row} 行已经写出，无法再写入")
+        entry = self._overlays[row].setdefault(col, [_KEEP, []])
+        if value is not _KEEP:
+            entry[0] = value
+        if style:
+            entry[1].append(style)
+
+    def set_row_height(self, row, height=None):
+        """
+        提前设置尚未写出的行的行高（插入图片时按行高计算图片大小）
+        :param height: 行高，为空时沿用模板行高
+        """
+        dims = self.out_ws.row_dimensions
+        if height is not None:
+            dims[row].height = height
+        elif row in self.template_ws.row_dimensions:
+            dims[row].height = self.template_ws.row_dimensions[row].height
+
+    def write_row(self, row, values=(), style=None, height=None):
+        """
+        写出一行：模板中该行的单元格 + 登记的叠加单元格 + 本次的数据
+        :param row: 行号（必须递增）
+        :param values: [(col, value), ...]
+        :param style: values 使用的命名样式
+        :param height: 行高（为空时沿用模板行高）
+        """
+        self._write_until(row)
+        self._write(row, values, style, height)
+
+    def _write_until(self, row):
+        while self.next_row < row:
+            self._write(self.next_row, (), None, None)
+
+    def _write(self, row, values, style, height):
+        cells = {}
+        for src in self._template_rows.pop(row, ()):
+            cell = WriteOnlyCell(self.out_ws, value=None if isinstance(src, MergedCell) else src.value)
+            if src.has_style:
+                cell._style = copy(src._style)
+            cells[src.column] = cell
+
+        for col, (value, names) in self._overlays.pop(row, {}).items():
+            cell = cells.get(col) or cells.setdefault(col, WriteOnlyCell(self.out_ws))
+            if value is not _KEEP:
+                cell.value = value
+            for name in names:
+                self.styles.apply(cell, name)
+
+        for col, value in values:
+            cell = cells.get(col) or cells.setdefault(col, WriteOnlyCell(self.out_ws))
+            cell.value = value
+            if style:
+                self.styles.apply(cell, style)
+
+        dims = self.out_ws.row_dimensions
+        if height is not None:
+            dims[row].height = height
+        elif row in self.template_ws.row_dimensions and row not in dims:
+            src = self.template_ws.row_dimensions[row]
+            dims[row].height = src.height
+            dims[row].hidden = src.hidden
+
+        width = max(cells, default=0)
+        self.out_ws.append([cells.get(col) for col in range(1, width + 1)])
+        # 该行已写出，释放行信息
+        dims.pop(row, None)
+        self.next_row = row + 1
+
+    def finish(self, merged_ranges=None):
+        """
+        写出剩余的模板行和叠加单元格，并复制合并单元格和模板图片
+        :param merged_ranges: 输出工作表的合并区域（默认沿用模板的合并单元格）
+        """
+        last_row = max([self._last_template_row] + list(self._overlays))
+        self._write_until(last_row + 1)
+        ranges = merged_ranges if merged_ranges is not None else self.template_ws.merged_cells.ranges
+        self.out_ws.merged_cells.ranges = {CellRange(str(r)) for r in ranges}
+        for image in self.template_ws._images:
+            self.out_ws.add_image(image)
+
+
+def create_streaming_workbook(template_wb, styles_registry=None):
+    """
+    创建与模板结构相同的只写工作簿
+    :param template_wb: 模板工作簿（模板缓存中的副本）
+    :param styles_registry: 命名样式注册表（cell_styles.StyleRegistry）
+    :return: (只写工作簿, {工作表名称: StreamingSheet})
+    """
+    out_wb = Workbook(write_only=True)
+    for name in _STYLE_TABLES:
+        table = getattr(template_wb, name)
+        setattr(out_wb, name, IndexedList(table) if isinstance(table, IndexedList) else copy(table))
+    styles = styles_registry.bind(out_wb) if styles_registry is not None else None
+    sheets = {}
+    for template_ws in template_wb.worksheets:
+        out_ws = out_wb.create_sheet(template_ws.title)
+        sheets[template_ws.title] = StreamingSheet(out_ws, template_ws, styles)
+    return out_wb, sheets
@@ -0,0 +1,121 @@
+"""
+任务日志
+基于标准 logging 的分级结构化日志：每个任务的日志记录保存在内存环形缓冲区中，
+可通过 /status/<task_id>/log 查看。热路径上的逐行/逐单元格日志使用 DEBUG 级别并按采样输出，
+默认关闭，只有在 TICKET_LOG_LEVEL=DEBUG 时才会产生开销。
+
+环境变量：
+- TICKET_LOG_LEVEL: 应用日志级别，默认 INFO
+- TICKET_LOG_SAMPLE: 热路径日志采样间隔（每N条输出1条），默认 100
+- TICKET_LOG_BUFFER: 每个任务保留的日志条数，默认 500
+"""
+import os
+import time
+import logging
+import threading
+import contextvars
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+LOG_LEVEL = os.getenv('TICKET_LOG_LEVEL', 'INFO').upper()
+SAMPLE_EVERY = max(1, int(os.getenv('TICKET_LOG_SAMPLE', '100')))
+BUFFER_SIZE = int(os.getenv('TICKET_LOG_BUFFER', '500'))
+MAX_TASKS = 200  # 最多保留多少个任务的日志
+
+_current_task = contextvars.ContextVar('current_task', default=None)
+_sample_counters = {}
+
+
+class TaskLogBuffer(logging.Handler):
+    """把日志记录按任务写入环形缓冲区"""
+
+    def __init__(self, buffer_size=BUFFER_SIZE, max_tasks=MAX_TASKS):
+        super().__init__(level=logging.DEBUG)
+        self.buffer_size = buffer_size
+        self.max_tasks = max_tasks
+        self._buffers = OrderedDict()
+        self._buffer_lock = threading.Lock()
+
+    def emit(self, record):
+        task_id = getattr(record, 'task_id', None) or _current_task.get()
+        if task_id is None:
+            return
+        entry = {
+            'time': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(record.created)),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry['fields'] = fields
+        with self._buffer_lock:
+            buffer = self._buffers.get(task_id)
+            if buffer is None:
+                buffer = self._buffers[task_id] = deque(maxlen=self.buffer_size)
+                while len(self._buffers) > self.max_tasks:
+                    self._buffers.popitem(last=False)
+            buffer.append(entry)
+
+    def get(self, task_id, level=None):
+        """获取任务日志，可按最低级别过滤"""
+        min_level = logging.getLevelName(level.upper()) if level else logging.DEBUG
+        if not isinstance(min_level, int):
+            min_level = logging.DEBUG
+        with self._buffer_lock:
+            entries = list(self._buffers.get(task_id, ()))
+        return [e for e in entries if logging.getLevelName(e['level']) >= min_level]
+
+    def has_task(self, task_id):
+        with self._buffer_lock:
+            return task_id in self._buffers
+
+
+task_log_buffer = TaskLogBuffer()
+
+_app_logger = logging.getLogger('ticket')
+_app_logger.setLevel(LOG_LEVEL)
+_app_logger.addHandler(task_log_buffer)
+if not logging.getLogger().handlers:
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+
+def get_logger(name):
+    """获取应用日志器（都挂在 ticket 下，共用任务缓冲区）"""
+    return logging.getLogger(f"ticket.{name}")
+
+
+@contextmanager
+def task_context(task_id):
+    """在此上下文中产生的日志都记入该任务的缓冲区"""
+    token = _current_task.set(task_id)
+    try:
+        yield
+    finally:
+        _current_task.reset(token)
+
+
+def current_task_id():
+    return _current_task.get()
+
+
+def debug_sampled(logger, msg, *args, every=None, **fields):
+    """
+    热路径调试日志：DEBUG 未开启时直接返回；开启后同一调用点每 every 条输出一条
+    :param logger: 日志器
+    :param msg: 日志格式串（同时作为采样计数的键）
+    :param every: 采样间隔，默认 TICKET_LOG_SAMPLE
+    :param fields: 结构化字段
+    """
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    key = (logger.name, msg)
+    count = _sample_counters.get(key, 0)
+    _sample_counters[key] = count + 1
+    if count % (every or SAMPLE_EVERY) == 0:
+        logger.debug(msg, *args, extra={'fields': fields} if fields else None)
+
+
+def get_task_log(task_id, level=None):
+    """获取任务的日志记录列表"""
+    return task_log_buffer.get(task_id, level)
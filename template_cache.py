@@ -0,0 +1,129 @@
+"""
+模板工作簿缓存
+每个模板文件只用 load_workbook 解析一次，解析结果序列化成快照保存在内存中；
+每次生成发票时从快照反序列化出一份独立的工作簿（比重新解析 xlsx 快一个数量级），
+处理器对副本的修改不会影响缓存。模板文件的修改时间或大小变化后自动重新解析。
+"""
+import io
+import os
+import copyreg
+import pickle
+import threading
+from collections import OrderedDict
+
+from openpyxl import load_workbook
+from openpyxl.worksheet.dimensions import DimensionHolder
+
+from task_log import get_logger
+
+logger = get_logger(__name__)
+
+
+def _restore_dimensions(worksheet, reference, default_factory, max_outline, items):
+    holder = DimensionHolder(worksheet, reference=reference, default_factory=default_factory)
+    holder.max_outline = max_outline
+    dict.update(holder, items)
+    return holder
+
+
+def _reduce_dimensions(holder):
+    # defaultdict 默认的序列化会丢掉 default_factory，反序列化后访问新行的行高会抛出 KeyError
+    return _restore_dimensions, (holder.worksheet, holder.reference, holder.default_factory,
+                                 holder.max_outline, dict(holder))
+
+
+def _dumps(wb):
+    buffer = io.BytesIO()
+    pickler = pickle.Pickler(buffer, protocol=pickle.HIGHEST_PROTOCOL)
+    pickler.dispatch_table = copyreg.dispatch_table.copy()
+    pickler.dispatch_table[DimensionHolder] = _reduce_dimensions
+    pickler.dump(wb)
+    return buffer.getvalue()
+
+
+class _Snapshot:
+    """一个模板文件的解析快照"""
+
+    __slots__ = ('stat_key', 'payload', 'lock')
+
+    def __init__(self):
+        self.stat_key = None
+        self.payload = None
+        self.lock = threading.Lock()
+
+
+class TemplateWorkbookCache:
+    """按文件路径缓存模板工作簿快照"""
+
+    def __init__(self, max_entries=32):
+        """
+        :param max_entries: 最多缓存的模板数量，超出后淘汰最久未使用的模板
+        """
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._snapshots = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _stat_key(template_path):
+        st = os.stat(template_path)
+        return st.st_mtime_ns, st.st_size
+
+    def _snapshot_for(self, path):
+        with self._lock:
+            snapshot = self._snapshots.get(path)
+            if snapshot is None:
+                snapshot = self._snapshots[path] = _Snapshot()
+            self._snapshots.move_to_end(path)
+            while len(self._snapshots) > self.max_entries:
+                evicted, _ = self._snapshots.popitem(last=False)
+                logger.debug("模板缓存已满，淘汰: %s", evicted)
+            return snapshot
+
+    def load(self, template_path):
+        """
+        获取模板工作簿的独立副本
+        :param template_path: 模板文件路径
+        :return: openpyxl Workbook（调用方可以任意修改）
+        """
+        path = os.path.abspath(template_path)
+        stat_key = self._stat_key(path)
+        snapshot = self._snapshot_for(path)
+
+        # 同一模板只允许一个线程解析，其他线程等待解析结果
+        with snapshot.lock:
+            if snapshot.stat_key != stat_key or snapshot.payload is None:
+                self.misses += 1
+                wb = load_workbook(path)
+                try:
+                    snapshot.payload = _dumps(wb)
+                    snapshot.stat_key = stat_key
+                    logger.info("已缓存模板 %s (%.1f KB)", os.path.basename(path), len(snapshot.payload) / 1024)
+                except Exception as e:
+                    # 无法序列化的模板不缓存，每次直接解析
+                    snapshot.payload = None
+                    logger.warning("模板 %s 无法缓存，将每次重新解析: %s", os.path.basename(path), str(e))
+                return wb
+            payload = snapshot.payload
+
+        self.hits += 1
+        return pickle.loads(payload)
+
+    def invalidate(self, template_path=None):
+        """
+        清除缓存
+        :param template_path: 模板文件路径，为空时清除全部
+        """
+        with self._lock:
+            if template_path is None:
+                self._snapshots.clear()
+            else:
+                self._snapshots.pop(os.path.abspath(template_path), None)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'templates': len(self._snapshots)}
+
+
+# 默认模板缓存，供发票生成器共用
+template_cache = TemplateWorkbookCache()
@@ -0,0 +1,728 @@
+"""
+声明式模板引擎
+每个货代模板用 template_specs/ 目录下的一个 YAML 文件描述（工作表、起始行、版式标志单元格、列映射、表头单元格、
+带电带磁标记、按箱合并、汇总行等），启动时编译成填充计划：
+- 列表达式编译成取值函数，不再在每个单元格上解析配置
+- 样式使用 cell_styles 中的命名样式（可在 styles 中追加），每个工作簿只登记一次，数据行整行设置
+- 产品信息按 MSKU 预取一次，带电带磁检查与填充共用
+
+表达式写法：
+- 字段：box.number / box.weight / box.length / box.width / box.height / box.volume
+        item.msku / item.sku / item.fnsku / item.box_quantity
+        product.<产品信息字段>（产品不存在时为空字符串）
+        line.price / line.total_price（单价、本行总价）
+        address.<地址字段> / address.full（地址拼接）
+        boxes.count / totals.<汇总名> / code / today
+- 格式串：含 {字段} 的字符串，如 "{code}00000{box.number}"、"{today:%Y.%m.%d}"
+- 过滤器：在表达式后加 "| 过滤器"，如 "line.total_price | blank_zero"
+- 其他字符串和数字按原样写入
+"""
+import os
+import re
+import string
+from datetime import datetime
+from typing import Callable, Dict, List
+
+import yaml
+from openpyxl import load_workbook
+from openpyxl.utils import column_index_from_string, get_column_letter, range_boundaries
+from openpyxl.worksheet.cell_range import CellRange
+
+from cell_styles import StyleRegistry
+from merged_ranges import MergedRangeIndex
+from parallel_render import MAX_WORKERS, PARALLEL_ROW_THRESHOLD, RowChunkTask, render_chunks, split_boxes
+from stream_writer import STREAM_ROW_THRESHOLD, create_streaming_workbook
+from task_log import get_logger, debug_sampled
+from workbook_writer import save_workbook
+from xlsx_patch import RowChunk, XlsxPatch, XlsxPatchError, xlsx_template_cache
+
+logger = get_logger(__name__)
+
+DEFAULT_SPEC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'template_specs')
+
+_FIELD_RE = re.compile(r'^(box|item|product|line|address|boxes|totals|code|today)(?:\.(\w+))?$')
+
+_ADDRESS_PARTS = ('addressLine1', 'city', 'stateOrProvinceCode', 'postalCode', 'countryCode')
+
+
+class TemplateSpecError(ValueError):
+    """模板配置错误"""
+    pass
+
+
+class FillContext:
+    """填充过程中表达式可以访问的数据"""
+
+    __slots__ = ('code', 'address', 'box_data', 'box_count', 'today', 'totals',
+                 'box_number', 'box', 'item', 'product')
+
+    def __init__(self, box_data, code, address_info):
+        self.code = code
+        self.address = (address_info or {}).get('address_info') or {}
+        self.box_data = box_data
+        self.box_count = len(box_data)
+        self.today = datetime.now()
+        self.totals = {}
+        self.box_number = None
+        self.box = None
+        self.item = None
+        self.product = None
+
+
+def _line_price(ctx):
+    return ctx.product.get('price', 0) if ctx.product is not None else 0
+
+
+def _line_total_price(ctx):
+    price = _line_price(ctx)
+    return float(price) * ctx.item.box_quantities.get(ctx.box_number, 0) if price else 0
+
+
+def _box_volume(ctx):
+    box = ctx.box
+    if box.length is None or box.width is None or box.height is None:
+        return None
+    return box.length * box.width * box.height * 0.000001
+
+
+def _address_full(ctx):
+    parts = [ctx.address[key] for key in _ADDRESS_PARTS if key in ctx.address]
+    return ', '.join(parts) if parts else None
+
+
+_SPECIAL_FIELDS = {
+    ('box', 'number'): lambda ctx: ctx.box_number,
+    ('box', 'volume'): _box_volume,
+    ('box', 'item_count'): lambda ctx: len(ctx.box.items),
+    ('item', 'box_quantity'): lambda ctx: ctx.item.box_quantities.get(ctx.box_number, 0),
+    ('line', 'price'): _line_price,
+    ('line', 'total_price'): _line_total_price,
+    ('address', 'full'): _address_full,
+    ('boxes', 'count'): lambda ctx: ctx.box_count,
+    ('code', None): lambda ctx: ctx.code,
+    ('today', None): lambda ctx: ctx.today,
+}
+
+_FILTERS = {
+    'blank_zero': lambda v: v if isinstance(v, (int, float)) and v > 0 else '',
+    'str': lambda v: '' if v is None else str(v),
+}
+
+
+def _compile_field(path: str) -> Callable:
+    match = _FIELD_RE.match(path)
+    if not match:
+        raise TemplateSpecError(f"未知字段: {path}")
+    namespace, name = match.groups()
+    special = _SPECIAL_FIELDS.get((namespace, name))
+    if special is not None:
+        return special
+    if name is None:
+        raise TemplateSpecError(f"字段缺少名称: {path}")
+    if namespace == 'box':
+        return lambda ctx: getattr(ctx.box, name, None)
+    if namespace == 'item':
+        return lambda ctx: getattr(ctx.item, name, None)
+    if namespace == 'product':
+        return lambda ctx: ctx.product.get(name, '') if ctx.product is not None else ''
+    if namespace == 'address':
+        return lambda ctx: ctx.address.get(name)
+    if namespace == 'totals':
+        return lambda ctx: ctx.totals.get(name, 0)
+    raise TemplateSpecError(f"未知字段: {path}")
+
+
+def _compile_format(template: str) -> Callable:
+    """编译格式串；引用了产品字段而产品不存在时整体为空字符串，None 字段按空字符串输出"""
+    parts = []
+    uses_product = False
+    for literal, field, format_spec, _ in string.Formatter().parse(template):
+        getter = None
+        if field is not None:
+            getter = _compile_field(field)
+            uses_product = uses_product or field.startswith('product.')
+        parts.append((literal, getter, format_spec or ''))
+
+    def render(ctx):
+        if uses_product and ctx.product is None:
+            return ''
+        out = []
+        for literal, getter, format_spec in parts:
+            out.append(literal)
+            if getter is not None:
+                value = getter(ctx)
+                if value is not None:
+                    out.append(format(value, format_spec))
+        return ''.join(out)
+
+    return render
+
+
+def compile_expression(expr) -> Callable:
+    """
+    把列/单元格配置编译成取值函数 f(ctx)
+    :param expr: 字段路径、格式串、常量或带过滤器的表达式
+    """
+    if not isinstance(expr, str):
+        return lambda ctx: expr
+    filters = []
+    if '|' in expr and '{' not in expr:
+        expr, *names = [part.strip() for part in expr.split('|')]
+        for name in names:
+            if name not in _FILTERS:
+                raise TemplateSpecError(f"未知过滤器: {name}")
+            filters.append(_FILTERS[name])
+    if '{' in expr:
+        getter = _compile_format(expr)
+    elif _FIELD_RE.match(expr):
+        getter = _compile_field(expr)
+    else:
+        return lambda ctx: expr
+    if not filters:
+        return getter
+
+    def filtered(ctx):
+        value = getter(ctx)
+        for f in filters:
+            value = f(value)
+        return value
+
+    return filtered
+
+
+def _column(ref) -> int:
+    return ref if isinstance(ref, int) else column_index_from_string(str(ref))
+
+
+def _parse_cell(ref: str):
+    match = re.match(r'^([A-Z]+)(\d+)$', ref)
+    if not match:
+        raise TemplateSpecError(f"单元格地址不正确: {ref}")
+    return int(match.group(2)), column_index_from_string(match.group(1))
+
+
+def _parse_ranges(ranges) -> List[tuple]:
+    """['B2:I4', ...] -> [(start_row, end_row, start_col, end_col), ...]"""
+    result = []
+    for ref in ranges or []:
+        min_col, min_row, max_col, max_row = range_boundaries(ref)
+        result.append((min_row, max_row, min_col, max_col))
+    return result
+
+
+class TemplateSpec:
+    """编译后的模板填充计划"""
+
+    def __init__(self, definition: dict, name: str):
+        """
+        :param definition: YAML 中的模板配置
+        :param name: 模板名称（默认使用配置文件名）
+        """
+        self.name = definition.get('name', name)
+        # 配置文件 (路径, 修改时间)，并行渲染时子进程按路径加载同一份配置
+        self.source = None
+        self.keywords = definition.get('keywords') or [self.name]
+        self.sheet = definition['sheet']
+        self.start_row = int(definition['start_row'])
+        self.row_height_from = definition.get('row_height_from')
+        self.row_style = definition.get('row_style', 'data')
+        # 输出方式：auto（数据行超过阈值时流式输出）/ stream / openpyxl / xml（直接改写模板 XML，不支持时按 auto 处理）
+        self.output = definition.get('output', 'auto')
+        self.stream_rows = int(definition.get('stream_rows', STREAM_ROW_THRESHOLD))
+        if self.output not in ('auto', 'stream', 'openpyxl', 'xml'):
+            raise TemplateSpecError(f"未知输出方式: {self.output}")
+
+        self.styles = StyleRegistry(definition.get('styles'))
+
+        self.unmerge = _parse_ranges(definition.get('unmerge'))
+        self.merge = _parse_ranges(definition.get('merge'))
+        # 模板版式的标志单元格 {(row, col): 文字}，名称只按关键字匹配的模板需要与之一致
+        self.expect = {_parse_cell(ref): str(text).strip() for ref, text in (definition.get('expect') or {}).items()}
+
+        self.header = []
+        for entry in definition.get('header') or []:
+            row, col = _parse_cell(entry['cell'])
+            when = compile_expression(entry['when']) if 'when' in entry else None
+            self.header.append((row, col, compile_expression(entry['value']), when, entry.get('style')))
+
+        hazmat = definition.get('hazmat') or {}
+        self.hazmat = {flag: _parse_cell(hazmat[flag]) for flag in ('electric', 'magnetic') if flag in hazmat}
+        self.hazmat_style = hazmat.get('style')
+
+        self.columns = [(_column(col), compile_expression(expr)) for col, expr in (definition.get('columns') or {}).items()]
+        # 数据行引用汇总值时各行依赖前面的行，不能分段并行渲染
+        self.columns_use_totals = any('totals.' in str(expr) for expr in (definition.get('columns') or {}).values())
+        self.columns.sort(key=lambda c: c[0])
+        self.column_numbers = [col for col, _ in self.columns]
+        self.first_item_only = {_column(c) for c in definition.get('first_item_only') or []}
+        self.box_merge = [_column(c) for c in definition.get('box_merge') or []]
+        self.image_column = get_column_letter(_column(definition['image_column'])) if definition.get('image_column') else None
+
+        self.totals = []
+        for total_name, entry in (definition.get('totals') or {}).items():
+            if not isinstance(entry, dict):
+                entry = {'value': entry}
+            self.totals.append((total_name, compile_expression(entry['value']), entry.get('per', 'item')))
+
+        summary = definition.get('summary')
+        self.summary = None
+        if summary:
+            border = summary.get('border')
+            self.summary = {
+                'cells': [(_column(col), compile_expression(expr)) for col, expr in summary['cells'].items()],
+                'style': summary.get('style', self.row_style),
+                'border': tuple(_column(c) for c in border.split(':')) if border else None,
+            }
+
+        self.footer = []
+        for entry in definition.get('footer') or []:
+            self.footer.append((int(entry['row']), _column(entry['column']),
+                                compile_expression(entry['value']), entry.get('style')))
+
+        for style_name in [self.row_style, self.hazmat_style] + [h[4] for h in self.header] + [f[3] for f in self.footer]:
+            if style_name and style_name not in self.styles:
+                raise TemplateSpecError(f"未定义的样式: {style_name}")
+
+    @classmethod
+    def load(cls, path: str) -> 'TemplateSpec':
+        mtime = os.stat(path).st_mtime_ns
+        with open(path, 'r', encoding='utf-8') as f:
+            definition = yaml.safe_load(f)
+        spec = cls(definition, os.path.splitext(os.path.basename(path))[0])
+        spec.source = (os.path.abspath(path), mtime)
+        return spec
+
+    def _prepare(self, generator, box_data, code, address_info):
+        """准备填充上下文，产品信息按 MSKU 只查询一次"""
+        ctx = FillContext(box_data, code, address_info)
+        sorted_boxes = sorted(box_data.items(), key=lambda x: int(x[0]))
+        # 预取结果和共享表中没有的 MSKU 才连接数据库
+        products = generator._get_products(item.msku for _, box in sorted_boxes for item in box.items)
+        for msku, product in products.items():
+            if product is None:
+                logger.warning("未找到产品 %s 的信息", msku)
+        return ctx, products, sorted_boxes
+
+    def _header_cells(self, ctx, products) -> List[tuple]:
+        """表头和带电带磁标记 [(row, col, value, style)]"""
+        cells = []
+        for row, col, getter, when, style in self.header:
+            if when is not None and when(ctx) in (None, ''):
+                continue
+            value = getter(ctx)
+            if value is None or value == '':
+                continue
+            cells.append((row, col, value, style))
+
+        if self.hazmat:
+            flags = {
+                'electric': any(p and p.get('electrified', '') == '是' for p in products.values()),
+                'magnetic': any(p and p.get('magnetic', '') == '是' for p in products.values()),
+            }
+            for flag, (row, col) in self.hazmat.items():
+                if flags[flag]:
+                    cells.append((row, col, "是", self.hazmat_style))
+        return cells
+
+    def _data_rows(self, ctx, products, sorted_boxes, box_merges: list, start_row=None):
+        """
+        逐行生成数据，同时累计汇总值
+        :param box_merges: 同一箱有多个产品时，追加需要合并的区域 (start_row, end_row, col, col)
+        :param start_row: 第一行的行号（默认为模板的起始行，分段渲染时为本段的起始行）
+        :return: 生成 (row_num, [(col, value), ...], msku)
+        """
+        ctx.totals = {total_name: 0 for total_name, _, _ in self.totals}
+        row_num = start_row or self.start_row
+
+        for box_number, box in sorted_boxes:
+            if not box.items:
+                continue
+            debug_sampled(logger, "处理箱子 %s", box_number)
+            ctx.box_number, ctx.box = box_number, box
+            first_row = row_num
+
+            for total_name, getter, per in self.totals:
+                if per == 'box':
+                    ctx.totals[total_name] += getter(ctx) or 0
+
+            for item in box.items:
+                ctx.item = item
+                ctx.product = products.get(item.msku)
+                is_first = box.is_first_item(item)
+
+                values = []
+                for col, getter in self.columns:
+                    value = '' if col in self.first_item_only and not is_first else getter(ctx)
+                    values.append((col, '' if value is None else value))
+
+                for total_name, getter, per in self.totals:
+                    if per == 'item':
+                        ctx.totals[total_name] += getter(ctx) or 0
+
+                yield row_num, values, item.msku
+                row_num += 1
+
+            if len(box.items) > 1:
+                for col in self.box_merge:
+                    box_merges.append((first_row, row_num - 1, col, col))
+
+        ctx.box_number = ctx.box = ctx.item = ctx.product = None
+
+    def _tail_cells(self, ctx, row_num):
+        """
+        汇总行和页脚
+        :param row_num: 数据之后的第一行（汇总行）
+        :return: ([(row, col, value, style)], 汇总行需要加边框的列范围或None)
+        """
+        cells = []
+        border = None
+        if self.summary:
+            for col, getter in self.summary['cells']:
+                cells.append((row_num, col, getter(ctx), self.summary['style']))
+            if self.summary['border']:
+                start_col, end_col = self.summary['border']
+                border = range(start_col, end_col + 1)
+        for offset, col, getter, style in self.footer:
+            cells.append((row_num + offset, col, getter(ctx), style))
+        return cells, border
+
+    def matches_layout(self, template_path) -> bool:
+        """
+        模板的标志单元格是否与配置一致（列映射和合并区域只适用于同一版式的模板）
+        :param template_path: 模板文件路径
+        """
+        if not self.expect:
+            return True
+        try:
+            wb = load_workbook(template_path, read_only=True)
+        except Exception as e:
+            logger.warning("无法读取模板 %s 检查版式: %s", os.path.basename(template_path), str(e))
+            return False
+        try:
+            if self.sheet not in wb.sheetnames:
+                return False
+            sheet = wb[self.sheet]
+            for (row, col), text in self.expect.items():
+                value = sheet.cell(row=row, column=col).value
+                if value is None or str(value).strip() != text:
+                    logger.debug("模板 %s 的 %s%d 为 %r，配置 %s 要求 %r", os.path.basename(template_path),
+                                 get_column_letter(col), row, value, self.name, text)
+                    return False
+            return True
+        finally:
+            wb.close()
+
+    def row_count(self, box_data) -> int:
+        """数据行数"""
+        return sum(len(box.items) for box in box_data.values())
+
+    def use_parallel(self, row_count) -> bool:
+        """XML 改写模式下是否分段并行渲染数据行"""
+        return (self.source is not None and not self.columns_use_totals and MAX_WORKERS > 1
+                and row_count >= PARALLEL_ROW_THRESHOLD)
+
+    def use_patch(self, box_data) -> bool:
+        """是否直接改写模板 XML（数据行很多时只在可以并行渲染时改写，否则流式输出）"""
+        if self.output != 'xml':
+            return False
+        row_count = self.row_count(box_data)
+        return row_count < self.stream_rows or self.use_parallel(row_count)
+
+    def use_streaming(self, box_data) -> bool:
+        """是否使用流式输出"""
+        if self.output in ('auto', 'xml'):
+            return self.row_count(box_data) >= self.stream_rows
+        return self.output == 'stream'
+
+    def bind(self, generator) -> 'BoundTemplateSpec':
+        return BoundTemplateSpec(self, generator)
+
+    def fill(self, generator, wb, box_data, code=None, address_info=None):
+        """
+        按计划填充工作簿
+        :param generator: InvoiceGenerator（提供产品信息和图片插入）
+        :param wb: 工作簿对象
+        :param box_data: 箱子数据
+        :param code: 编码（可选）
+        :param address_info: 地址信息（可选）
+        """
+        sheet = wb[self.sheet]
+        logger.info("开始写入%s模版信息", self.name)
+        styles = self.styles.bind(wb)
+        ctx, products, sorted_boxes = self._prepare(generator, box_data, code, address_info)
+
+        merges = MergedRangeIndex(sheet)
+        merges.regroup(self.unmerge, self.merge)
+
+        for row, col, value, style in self._header_cells(ctx, products):
+            cell = sheet.cell(row=row, column=col)
+            cell.value = value
+            if style:
+                styles.apply(cell, style)
+
+        row_height = sheet.row_dimensions[self.row_height_from].height if self.row_height_from else None
+        box_merges = []
+        row_num = self.start_row
+        for row_num, values, msku in self._data_rows(ctx, products, sorted_boxes, box_merges):
+            for col, value in values:
+                sheet.cell(row=row_num, column=col).value = value
+            styles.apply_row(sheet, row_num, self.column_numbers, self.row_style)
+
+            if row_height is not None:
+                sheet.row_dimensions[row_num].height = row_height
+
+            if self.image_column and msku:
+                try:
+                    generator.insert_product_image(sheet, f"{self.image_column}{row_num}", msku,
+                                                   generator.image_folder)
+                except Exception as e:
+                    logger.warning("插入图片时发生错误: %s", str(e))
+            row_num += 1
+
+        tail, border = self._tail_cells(ctx, row_num)
+        for row, col, value, style in tail:
+            cell = sheet.cell(row=row, column=col)
+            cell.value = value
+            if style:
+                styles.apply(cell, style)
+        if border:
+            styles.apply_row(sheet, row_num, border, 'grid')
+
+        # 表头和按箱合并的区域在填充结束后统一合并
+        merges.merge_many(box_merges)
+        merges.apply()
+
+    def stream(self, generator, wb, output_path, box_data, code=None, address_info=None):
+        """
+        流式输出：模板逐行复制到只写工作簿，数据行生成后立即写出并保存到 output_path
+        :param generator: InvoiceGenerator（提供产品信息和图片插入）
+        :param wb: 模板工作簿
+        :param output_path: 输出文件路径
+        :param box_data: 箱子数据
+        :param code: 编码（可选）
+        :param address_info: 地址信息（可选）
+        """
+        logger.info("开始以流式模式写入%s模版信息", self.name)
+        ctx, products, sorted_boxes = self._prepare(generator, box_data, code, address_info)
+
+        # 表头区域的合并单元格在模板副本上处理，输出时一起复制
+        template_ws = wb[self.sheet]
+        merges = MergedRangeIndex(template_ws)
+        merges.regroup(self.unmerge, self.merge)
+        merges.apply()
+
+        out_wb, sheets = create_streaming_workbook(wb, self.styles)
+        sheet = sheets[self.sheet]
+        for row, col, value, style in self._header_cells(ctx, products):
+            sheet.overlay(row, col, value, style)
+
+        row_height = template_ws.row_dimensions[self.row_height_from].height if self.row_height_from else None
+        box_merges = []
+        row_num = self.start_row
+        for row_num, values, msku in self._data_rows(ctx, products, sorted_boxes, box_merges):
+            if self.image_column and msku:
+                sheet.set_row_height(row_num, row_height)
+                try:
+                    generator.insert_product_image(sheet.out_ws, f"{self.image_column}{row_num}", msku,
+                                                   generator.image_folder)
+                except Exception as e:
+                    logger.warning("插入图片时发生错误: %s", str(e))
+            sheet.write_row(row_num, values, self.row_style, row_height)
+            row_num += 1
+
+        tail, border = self._tail_cells(ctx, row_num)
+        for row, col, value, style in tail:
+            sheet.overlay(row, col, value, style)
+        for col in border or ():
+            sheet.overlay(row_num, col, style='grid')
+
+        merges.merge_many(box_merges)
+        merges.apply(format_cells=False)
+        for streaming_sheet in sheets.values():
+            streaming_sheet.finish()
+        save_workbook(out_wb, output_path)
+
+    def patch(self, generator, template_path, output_path, box_data, code=None, address_info=None):
+        """
+        直接改写模板文件的 XML 生成发票（不经过 openpyxl 加载和保存）
+        :param generator: InvoiceGenerator（提供产品信息和图片插入）
+        :param template_path: 模板文件路径
+        :param output_path: 输出文件路径
+        :param box_data: 箱子数据
+        :param code: 编码（可选）
+        :param address_info: 地址信息（可选）
+        :raises XlsxPatchError: 模板结构不支持直接改写（调用方改用 openpyxl 填充）
+        """
+        book = XlsxPatch(xlsx_template_cache.load(template_path), self.styles)
+        sheet = book.sheet(self.sheet)
+        if self.image_column and sheet.has_drawing:
+            raise XlsxPatchError(f"工作表 {self.sheet} 已有绘图，暂不支持追加图片")
+        logger.info("开始以XML改写模式写入%s模版信息", self.name)
+        ctx, products, sorted_boxes = self._prepare(generator, box_data, code, address_info)
+
+        merges = MergedRangeIndex(sheet)
+        merges.regroup(self.unmerge, self.merge)
+
+        for row, col, value, style in self._header_cells(ctx, products):
+            sheet.set_value(row, col, value, style)
+
+        row_height = sheet.row_dimensions[self.row_height_from].height if self.row_height_from else None
+        box_merges = []
+        row_num = self.start_row
+        rendered = None
+        if self.use_parallel(self.row_count(box_data)):
+            rendered = self._render_parallel(sheet, merges, ctx, products, sorted_boxes, row_height)
+        if rendered is not None:
+            # 各段已在子进程中写好数据行并处理了按箱合并的单元格，图片在这里插入
+            row_num, images, box_merges = rendered
+            for image_row, msku in images:
+                try:
+                    generator.insert_product_image(sheet, f"{self.image_column}{image_row}", msku,
+                                                   generator.image_folder)
+                except Exception as e:
+                    logger.warning("插入图片时发生错误: %s", str(e))
+            existing = {r.coord for r in sheet.merged_cells.ranges}
+            existing.update(f"{get_column_letter(c)}{r1}:{get_column_letter(c)}{r2}" for r1, r2, c, _ in box_merges)
+        else:
+            for row_num, values, msku in self._data_rows(ctx, products, sorted_boxes, box_merges):
+                sheet.write_row(row_num, values, self.column_numbers, self.row_style)
+                if row_height is not None:
+                    sheet.set_row_height(row_num, row_height)
+                if self.image_column and msku:
+                    try:
+                        generator.insert_product_image(sheet, f"{self.image_column}{row_num}", msku,
+                                                       generator.image_folder)
+                    except Exception as e:
+                        logger.warning("插入图片时发生错误: %s", str(e))
+                row_num += 1
+            existing = {r.coord for r in sheet.merged_cells.ranges}
+
+        tail, border = self._tail_cells(ctx, row_num)
+        for row, col, value, style in tail:
+            sheet.set_value(row, col, value, style)
+        for col in border or ():
+            sheet.apply_style(row_num, col, 'grid')
+
+        merges.merge_many(box_merges)
+        merges.apply(format_cells=False)
+        sheet.format_merged([r for r in sheet.merged_cells.ranges if r.coord not in existing])
+        book.save(output_path)
+
+    def _render_parallel(self, sheet, merges, ctx, products, sorted_boxes, row_height):
+        """
+        数据区按箱分段，在子进程中渲染各段的行 XML 后拼接到工作表
+        :param merges: 工作表的合并区域索引（已解除 unmerge 中的区域并登记 merge 中的区域）
+        :return: (数据之后的第一行, [(行号, msku)] 需要插入图片的行, 按箱合并的区域)；不能并行渲染时返回 None
+        """
+        chunks = split_boxes(sorted_boxes, self.start_row)
+        if len(chunks) < 2:
+            return None
+        first_row, last_row = chunks[0][0], chunks[-1][1]
+        # 数据区中残留的合并单元格或配置的合并区域需要在整张表上处理，这种模板按单进程渲染
+        if merges.overlapping(first_row, last_row, 1, 16384) or \
+                any(start <= last_row and end >= first_row for start, end, _, _ in self.merge):
+            logger.debug("模板 %s 数据区中有合并单元格，不分段渲染", self.name)
+            return None
+
+        cells, rows = sheet.rows_in(first_row, last_row)
+        bases = {0} | {cell.s for cell in cells.values()}
+        composed = {(base, self.row_style): sheet.stylesheet.compose(base, self.row_style) for base in bases}
+        if self.box_merge:
+            for base in bases | set(composed.values()):
+                composed[(base, 'center')] = sheet.stylesheet.compose(base, 'center')
+
+        tasks = []
+        for chunk_first, chunk_last, boxes in chunks:
+            mskus = {item.msku for _, box in boxes for item in box.items}
+            tasks.append(RowChunkTask(
+                self.source, chunk_first, chunk_last, boxes,
+                {msku: product for msku, product in products.items() if msku in mskus},
+                ctx.code, {'address_info': ctx.address}, ctx.today, ctx.box_count,
+                {key: cell for key, cell in cells.items() if chunk_first <= key[0] <= chunk_last},
+                {row: attrs for row, attrs in rows.items() if chunk_first <= row <= chunk_last},
+                composed, row_height))
+        try:
+            results = render_chunks(render_row_chunk, tasks)
+        except Exception as e:
+            logger.warning("并行渲染%s数据行失败，改为单进程渲染: %s", self.name, str(e))
+            return None
+        logger.info("%s数据行已分 %d 段并行渲染", self.name, len(tasks))
+
+        ctx.totals = {total_name: 0 for total_name, _, _ in self.totals}
+        images, box_merges = [], []
+        for (chunk_first, chunk_last, _), (xml, max_col, heights, totals, merged, chunk_images) in zip(chunks, results):
+            sheet.add_rendered_rows(chunk_first, chunk_last, xml, max_col, heights)
+            for total_name, value in totals.items():
+                ctx.totals[total_name] += value
+            box_merges.extend(merged)
+            images.extend(chunk_images)
+        return last_row + 1, images, box_merges
+
+    def render_chunk(self, task: RowChunkTask):
+        """
+        渲染一段数据行（在子进程中执行）
+        :return: (行 XML, 最大列号, {行号: 行高}, 本段的汇总值, 按箱合并的区域, [(行号, msku)] 需要插入图片的行)
+        """
+        ctx = FillContext({}, task.code, task.address_info)
+        ctx.today, ctx.box_count = task.today, task.box_count
+        chunk = RowChunk(task.cells, task.rows, task.composed)
+        box_merges, images = [], []
+        for row_num, values, msku in self._data_rows(ctx, task.products, task.boxes, box_merges, task.first_row):
+            chunk.write_row(row_num, values, self.column_numbers, self.row_style)
+            if task.row_height is not None:
+                chunk.set_row_height(row_num, task.row_height)
+            if self.image_column and msku:
+                images.append((row_num, msku))
+        chunk.format_merged([CellRange(min_col=col, min_row=start, max_col=col, max_row=end)
+                             for start, end, col, _ in box_merges])
+        xml, max_col, heights = chunk.render()
+        return xml, max_col, heights, ctx.totals, box_merges, images
+
+
+class BoundTemplateSpec:
+    """绑定到发票生成器的模板配置，可以像 _fill_*_template 方法一样调用"""
+
+    def __init__(self, spec: TemplateSpec, generator):
+        self.spec = spec
+        self.generator = generator
+        self.__name__ = spec.name
+
+    def __call__(self, wb, box_data, code=None, address_info=None):
+        return self.spec.fill(self.generator, wb, box_data, code, address_info)
+
+
+def load_template_specs(spec_dir: str = DEFAULT_SPEC_DIR) -> Dict[str, TemplateSpec]:
+    """
+    加载并编译目录中的所有模板配置
+    :param spec_dir: 配置目录
+    :return: {模板名称: TemplateSpec}，配置有误的模板会记录错误并跳过
+    """
+    specs = {}
+    if not os.path.isdir(spec_dir):
+        return specs
+    for filename in sorted(os.listdir(spec_dir)):
+        if not filename.endswith(('.yaml', '.yml')):
+            continue
+        path = os.path.join(spec_dir, filename)
+        try:
+            spec = TemplateSpec.load(path)
+            specs[spec.name] = spec
+        except Exception as e:
+            logger.error("加载模板配置 %s 失败: %s", filename, str(e))
+    logger.debug("已加载模板配置: %s", list(specs))
+    return specs
+
+
+# 子进程中按配置文件路径缓存的填充计划
+_chunk_specs: Dict[str, TemplateSpec] = {}
+
+
+def render_row_chunk(task: RowChunkTask):
+    """子进程入口：加载（并缓存）主进程使用的模板配置，渲染一段数据行"""
+    path, mtime = task.spec_source
+    spec = _chunk_specs.get(path)
+    if spec is None or spec.source[1] != mtime:
+        spec = _chunk_specs[path] = TemplateSpec.load(path)
+        if spec.source[1] != mtime:
+            raise TemplateSpecError(f"模板配置 {os.path.basename(path)} 已被修改")
+    return spec.render_chunk(task)
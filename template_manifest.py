@@ -0,0 +1,375 @@
+"""
+模板清单
+启动时扫描模板目录，按文件内容（而不是扩展名）识别每个模板的格式：
+- .xlsx 直接使用
+- 旧版 .xls（BIFF）转换成 .xlsx 保存在缓存目录，源文件修改后重新转换
+- 检查模板中是否有处理器需要的工作表，之后可在后台把模板预先载入模板缓存
+结果写成清单（manifest.json），上传时据此拒绝不可用的模板，处理任务时按清单取模板路径，
+所有模板都通过 openpyxl / 模板缓存的快速路径加载。
+
+.xls 转换优先使用 LibreOffice（保留公式和图片），没有安装时使用 xlrd 复制值、合并单元格、
+行高列宽和单元格格式（公式只保留计算结果，图片不保留）。
+"""
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from typing import Callable, Dict, List, Optional
+
+from openpyxl import Workbook, load_workbook
+from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
+from openpyxl.utils import get_column_letter
+
+from task_log import get_logger
+
+try:
+    import xlrd
+except ImportError:  # 可选依赖，未安装时只能用 LibreOffice 转换 .xls 模板
+    xlrd = None
+
+logger = get_logger(__name__)
+
+TEMPLATE_EXTENSIONS = ('.xlsx', '.xlsm', '.xls')
+MANIFEST_FILE = 'manifest.json'
+
+_XLSX_MAGIC = b'PK\x03\x04'
+_XLS_MAGIC = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+
+# xlrd 的边框线型编号 -> openpyxl 边框样式
+_BORDER_STYLES = (None, 'thin', 'medium', 'dashed', 'dotted', 'thick', 'double', 'hair', 'mediumDashed',
+                  'dashDot', 'mediumDashDot', 'dashDotDot', 'mediumDashDotDot', 'slantDashDot')
+_HORIZONTAL = {1: 'left', 2: 'center', 3: 'right', 4: 'fill', 5: 'justify', 6: 'centerContinuous', 7: 'distributed'}
+_VERTICAL = {0: 'top', 1: 'center', 2: 'bottom', 3: 'justify', 4: 'distributed'}
+
+
+class TemplateUnavailableError(ValueError):
+    """模板不存在或不可用"""
+    pass
+
+
+def detect_format(path) -> Optional[str]:
+    """
+    按文件头识别模板格式
+    :return: 'xlsx' / 'xls'，无法识别时返回 None
+    """
+    with open(path, 'rb') as f:
+        head = f.read(8)
+    if head.startswith(_XLSX_MAGIC):
+        return 'xlsx'
+    if head == _XLS_MAGIC:
+        return 'xls'
+    return None
+
+
+class TemplateEntry:
+    """清单中的一个模板"""
+
+    __slots__ = ('name', 'source', 'path', 'format', 'stat_key', 'sheets', 'sheet', 'error')
+
+    def __init__(self, name, source):
+        """
+        :param name: 模板名称（文件名去掉扩展名，与上传时的 template_type 一致）
+        :param source: 模板目录中的源文件
+        """
+        self.name = name
+        self.source = source
+        self.path = None
+        self.format = None
+        self.stat_key = None
+        self.sheets = []
+        self.sheet = None
+        self.error = None
+
+    @property
+    def ok(self):
+        return self.error is None and self.path is not None
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'source': os.path.basename(self.source),
+            'path': self.path,
+            'format': self.format,
+            'sheets': self.sheets,
+            'sheet': self.sheet,
+            'ok': self.ok,
+            'error': self.error,
+        }
+
+
+def _stat_key(path):
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+def _convert_with_libreoffice(source, target) -> bool:
+    soffice = shutil.which('soffice') or shutil.which('libreoffice')
+    if soffice is None:
+        return False
+    out_dir = tempfile.mkdtemp(prefix='template_convert_')
+    try:
+        subprocess.run([soffice, '--headless', '--convert-to', 'xlsx', '--outdir', out_dir, source],
+                       check=True, capture_output=True, timeout=120)
+        converted = os.path.join(out_dir, os.path.splitext(os.path.basename(source))[0] + '.xlsx')
+        if not os.path.exists(converted):
+            return False
+        shutil.move(converted, target)
+        return True
+    except Exception as e:
+        logger.warning("LibreOffice 转换 %s 失败，改用 xlrd: %s", os.path.basename(source), str(e))
+        return False
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+
+class _XlsStyles:
+    """xlrd 单元格格式 -> openpyxl 样式（每个格式只转换一次）"""
+
+    def __init__(self, book):
+        self.book = book
+        self._styles = {}
+
+    def _color(self, index):
+        rgb = self.book.colour_map.get(index)
+        return '00{:02X}{:02X}{:02X}'.format(*rgb) if rgb else None
+
+    def get(self, xf_index):
+        style = self._styles.get(xf_index)
+        if style is None:
+            style = self._styles[xf_index] = self._convert(self.book.xf_list[xf_index])
+        return style
+
+    def _convert(self, xf):
+        book = self.book
+        font = book.font_list[xf.font_index]
+        color = self._color(font.colour_index)
+        style = {
+            'font': Font(name=font.name, size=font.height / 20, bold=bool(font.bold), italic=bool(font.italic),
+                         underline='single' if font.underline_type else None, strike=bool(font.struck_out),
+                         color=color),
+            'alignment': Alignment(horizontal=_HORIZONTAL.get(xf.alignment.hor_align),
+                                   vertical=_VERTICAL.get(xf.alignment.vert_align),
+                                   wrap_text=bool(xf.alignment.text_wrapped) or None),
+        }
+
+        border = xf.border
+        sides = {}
+        for side in ('left', 'right', 'top', 'bottom'):
+            line = getattr(border, f'{side}_line_style')
+            if line:
+                sides[side] = Side(border_style=_BORDER_STYLES[line] if line < len(_BORDER_STYLES) else 'thin',
+                                   color=self._color(getattr(border, f'{side}_colour_index')))
+        if sides:
+            style['border'] = Border(**sides)
+
+        background = xf.background
+        if background.fill_pattern == 1:
+            fill_color = self._color(background.pattern_colour_index)
+            if fill_color:
+                style['fill'] = PatternFill(fill_type='solid', fgColor=fill_color)
+
+        number_format = book.format_map.get(xf.format_key)
+        if number_format is not None and number_format.format_str not in ('General', ''):
+            style['number_format'] = number_format.format_str
+        return style
+
+
+def _xls_value(book, cell):
+    if cell.ctype in (xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK, xlrd.XL_CELL_ERROR):
+        return None
+    if cell.ctype == xlrd.XL_CELL_DATE:
+        return xlrd.xldate.xldate_as_datetime(cell.value, book.datemode)
+    if cell.ctype == xlrd.XL_CELL_BOOLEAN:
+        return bool(cell.value)
+    if cell.ctype == xlrd.XL_CELL_NUMBER and float(cell.value).is_integer():
+        return int(cell.value)
+    return cell.value
+
+
+def _convert_with_xlrd(source, target):
+    if xlrd is None:
+        raise TemplateUnavailableError("转换 .xls 模板需要安装 xlrd 或 LibreOffice")
+    book = xlrd.open_workbook(source, formatting_info=True)
+    styles = _XlsStyles(book)
+    wb = Workbook()
+    wb.remove(wb.active)
+    for sheet in book.sheets():
+        ws = wb.create_sheet(sheet.name)
+        for row in range(sheet.nrows):
+            for col in range(sheet.ncols):
+                cell = sheet.cell(row, col)
+                value = _xls_value(book, cell)
+                style = styles.get(cell.xf_index)
+                # 空单元格只在有边框或底色时写入
+                if value is None and 'border' not in style and 'fill' not in style:
+                    continue
+                target_cell = ws.cell(row=row + 1, column=col + 1, value=value)
+                for attr, style_value in style.items():
+                    setattr(target_cell, attr, style_value)
+
+        for row_lo, row_hi, col_lo, col_hi in sheet.merged_cells:
+            ws.merge_cells(start_row=row_lo + 1, end_row=row_hi, start_column=col_lo + 1, end_column=col_hi)
+        for col, info in sheet.colinfo_map.items():
+            ws.column_dimensions[get_column_letter(col + 1)].width = info.width / 256
+        for row, info in sheet.rowinfo_map.items():
+            if info.height:
+                ws.row_dimensions[row + 1].height = info.height / 20
+    wb.save(target)
+
+
+def convert_xls(source, target):
+    """
+    旧版 .xls 模板转换成 .xlsx
+    :param source: .xls 文件路径
+    :param target: 转换结果路径
+    """
+    partial = f"{target}.tmp"
+    if not _convert_with_libreoffice(source, partial):
+        _convert_with_xlrd(source, partial)
+    os.replace(partial, target)
+
+
+class TemplateManifest:
+    """模板目录的清单：格式识别、.xls 转换、工作表校验"""
+
+    def __init__(self, template_dir, cache_dir, sheet_resolver: Callable[[str], Optional[str]] = None,
+                 template_cache=None):
+        """
+        :param template_dir: 模板目录
+        :param cache_dir: 转换结果和清单文件的目录
+        :param sheet_resolver: 模板路径 -> 处理器需要的工作表名称（InvoiceGenerator.template_sheet），
+                               返回 None 表示没有匹配的处理器
+        :param template_cache: 模板工作簿缓存（warm() 预先载入）
+        """
+        self.template_dir = template_dir
+        self.cache_dir = cache_dir
+        self.sheet_resolver = sheet_resolver
+        self.template_cache = template_cache
+        self._entries: Dict[str, TemplateEntry] = {}
+        self._lock = threading.Lock()
+
+    def build(self) -> 'TemplateManifest':
+        """扫描模板目录，处理全部模板并写出清单文件"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entries = {}
+        for filename in sorted(os.listdir(self.template_dir)):
+            name, ext = os.path.splitext(filename)
+            if ext.lower() not in TEMPLATE_EXTENSIONS or filename.startswith(('~$', '.')):
+                continue
+            if name in entries:
+                logger.warning("模板 %s 有多个文件，使用 %s", name, os.path.basename(entries[name].source))
+                continue
+            entries[name] = self._prepare(TemplateEntry(name, os.path.join(self.template_dir, filename)))
+        with self._lock:
+            self._entries = entries
+        self._write()
+        usable = [entry.name for entry in entries.values() if entry.ok]
+        logger.info("模板清单已生成: %d 个可用，%d 个不可用", len(usable), len(entries) - len(usable))
+        return self
+
+    def _prepare(self, entry: TemplateEntry) -> TemplateEntry:
+        try:
+            entry.stat_key = _stat_key(entry.source)
+            entry.format = detect_format(entry.source)
+            if entry.format == 'xlsx':
+                entry.path = entry.source
+            elif entry.format == 'xls':
+                entry.path = self._converted(entry)
+            else:
+                raise TemplateUnavailableError("无法识别的文件格式")
+            self._validate(entry)
+        except Exception as e:
+            entry.error = str(e)
+            logger.error("模板 %s 不可用: %s", entry.name, entry.error)
+        return entry
+
+    def _converted(self, entry: TemplateEntry) -> str:
+        """.xls 模板的转换结果（源文件比转换结果新时重新转换）"""
+        target = os.path.join(self.cache_dir, f"{entry.name}.xlsx")
+        if not os.path.exists(target) or os.stat(target).st_mtime_ns < entry.stat_key[0]:
+            logger.info("转换旧版模板 %s", os.path.basename(entry.source))
+            convert_xls(entry.source, target)
+        return target
+
+    def _validate(self, entry: TemplateEntry):
+        wb = load_workbook(entry.path, read_only=True)
+        try:
+            entry.sheets = list(wb.sheetnames)
+        finally:
+            wb.close()
+        if self.sheet_resolver is None:
+            return
+        entry.sheet = self.sheet_resolver(entry.path)
+        if entry.sheet is None:
+            raise TemplateUnavailableError("没有匹配的模板处理器")
+        if entry.sheet not in entry.sheets:
+            raise TemplateUnavailableError(f"缺少工作表 {entry.sheet}，实际工作表: {entry.sheets}")
+
+    def warm(self):
+        """把所有可用的模板载入模板缓存（启动后在后台线程中调用，第一个任务不再等待解析模板）"""
+        if self.template_cache is None:
+            return
+        with self._lock:
+            entries = [entry for entry in self._entries.values() if entry.ok]
+        for entry in entries:
+            try:
+                self.template_cache.load(entry.path)
+            except Exception as e:
+                logger.warning("预载模板 %s 失败: %s", entry.name, str(e))
+
+    def _write(self):
+        path = os.path.join(self.cache_dir, MANIFEST_FILE)
+        try:
+            with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+                json.dump(self.to_list(), f, ensure_ascii=False, indent=2)
+            os.replace(f"{path}.tmp", path)
+        except Exception as e:
+            logger.warning("写入模板清单失败: %s", str(e))
+
+    def get(self, name) -> Optional[TemplateEntry]:
+        """
+        按名称取模板（源文件修改后重新处理，新增的模板文件也会被加入清单）
+        :param name: 模板名称
+        """
+        with self._lock:
+            entry = self._entries.get(name)
+        source = entry.source if entry is not None else self._find_source(name)
+        if source is None:
+            return None
+        try:
+            stat_key = _stat_key(source)
+        except OSError:
+            return None
+        if entry is None or entry.stat_key != stat_key:
+            entry = self._prepare(TemplateEntry(name, source))
+            with self._lock:
+                self._entries[name] = entry
+            self._write()
+        return entry
+
+    def _find_source(self, name):
+        if not name or os.path.basename(name) != name:
+            return None
+        for ext in TEMPLATE_EXTENSIONS:
+            path = os.path.join(self.template_dir, f"{name}{ext}")
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def resolve(self, name) -> str:
+        """
+        模板名称 -> 可以直接加载的 .xlsx 路径
+        :raises TemplateUnavailableError: 模板不存在或不可用
+        """
+        entry = self.get(name)
+        if entry is None:
+            raise TemplateUnavailableError(f"模板不存在: {name}")
+        if not entry.ok:
+            raise TemplateUnavailableError(f"模板 {name} 不可用: {entry.error}")
+        return entry.path
+
+    def to_list(self) -> List[dict]:
+        with self._lock:
+            return [entry.to_dict() for entry in self._entries.values()]
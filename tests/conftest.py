@@ -0,0 +1,189 @@
+"""
+测试共用的数据：固定的装箱数据、产品共享表和地址，不连接数据库
+"""
+import contextlib
+import os
+import sys
+from collections import Counter
+from datetime import datetime
+
+import pytest
+from openpyxl import Workbook, load_workbook
+from openpyxl.utils import get_column_letter
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import template_engine  # noqa: E402
+from generator import InvoiceGenerator  # noqa: E402
+from get_ticket_data import PackingListBox, PackingListItem  # noqa: E402
+from image_cache import EmbedImageCache  # noqa: E402
+from product_cache import ProductTable, write_product_table  # noqa: E402
+
+TEMPLATE_DIR = os.path.join(ROOT, '表格模版')
+
+CODE = 'FBA18TEST'
+TODAY = datetime(2024, 5, 6, 9, 30)
+ADDRESS_INFO = {
+    'address_info': {'name': 'LGB8', 'addressLine1': '1568 N Linden Ave', 'city': 'Rialto',
+                     'stateOrProvinceCode': 'CA', 'postalCode': '92376', 'countryCode': 'US',
+                     'amazonReferenceId': 'REF123', 'shipmentName': '2024.05.06-DB-KP-3/15'},
+    'seller_info': {'country_name': '美国'},
+}
+# 产品表中没有、数据库中也查不到的 MSKU
+MISSING_MSKU = 'TEST-MISSING'
+
+
+def build_products(count):
+    products = []
+    for i in range(count):
+        products.append({
+            'msku': f'TEST-{i}', 'productNameZh': f'测试产品{i}', 'productNameEn': f'Product {i}',
+            'useEn': 'daily use', 'useZh': '日用', 'materialEn': 'plastic', 'materialZh': '塑料',
+            'HS': f'{392690 + i}', 'brand': '无', 'model': f'M-{i}', 'productLink': f'https://example.com/{i}',
+            # 没有报价的产品
+            'askprice': round(1 + i * 0.25, 2) if i % 4 else '',
+            'electrified': '是' if i == 2 else '否', 'magnetic': '否', 'weight': 0.2,
+        })
+    return products
+
+
+def build_boxes(box_count=24, product_count=8):
+    """
+    固定的装箱数据：每箱 1~3 个产品（覆盖按箱合并），第 5 箱包含产品表中没有的 MSKU
+    """
+    box_data = {}
+    sequence_no = 0
+    for box_number in range(1, box_count + 1):
+        box = PackingListBox(box_number)
+        box.set_dimensions(60 - box_number % 3, 40, 30 + box_number % 5)
+        box.set_weight(round(8 + box_number * 0.75, 2))
+        mskus = [f'TEST-{(box_number + k) % product_count}' for k in range(box_number % 3 + 1)]
+        if box_number == 5:
+            mskus.append(MISSING_MSKU)
+        for msku in mskus:
+            sequence_no += 1
+            box.add_item(PackingListItem(sequence_no, msku, f'X00{sequence_no}', f'产品{sequence_no}',
+                                         f'SKU-{sequence_no}', 0, {box_number: 3 + sequence_no % 17}))
+        box_data[box_number] = box
+    return box_data
+
+
+def lingxing_rows(shipment_id, quantities, box_info=None):
+    """
+    领星装箱单的行（包含表头行）
+    :param quantities: 每个商品的每箱数量 [[第1箱, 第2箱, ...], ...]
+    :param box_info: 每箱的 (重量, 长, 宽, 高)，默认按箱号生成
+    """
+    box_count = max(len(row) for row in quantities)
+    rows = [('Shipment', 'info'), ('Shipment ID', shipment_id),
+            ('序号', 'MSKU', 'FNSKU', '品名', 'SKU', '发货量') + tuple(f'第{n}箱' for n in range(1, box_count + 1))]
+    for index, row in enumerate(quantities):
+        total = sum(q for q in row if isinstance(q, (int, float)))
+        rows.append((index + 1, f'TEST-{index}', f'FN{index}', f'产品{index}', f'SKU{index}', total) + tuple(row))
+    rows.append(('合计',))
+    box_info = box_info or [(10 + n, 50 + n, 40, 30) for n in range(1, box_count + 1)]
+    for label, values in zip(('重量', '长', '宽', '高'), zip(*box_info)):
+        rows.append((label, None, None, None, None, None) + values)
+    return rows
+
+
+def simple_rows(shipment_id, quantities, offset=0):
+    """
+    简单装箱单的行（包含表头行）
+    :param quantities: 每个商品的每箱数量 [[第1箱, 第2箱, ...], ...]
+    :param offset: 左侧多余列数（依诺达为1）
+    """
+    pad = (None,) * offset
+    box_count = max(len(row) for row in quantities)
+    rows = [pad + ('标题',), pad + ('Shipment ID', shipment_id), pad + ('备注',),
+            pad + (None, '重量') + tuple(10 + n for n in range(1, box_count + 1)),
+            pad + (None, '箱规') + ('2号',) * box_count,
+            pad + (None, '箱号') + tuple(range(1, box_count + 1)),
+            pad + ('SKU', '总数')]
+    for index, row in enumerate(quantities):
+        rows.append(pad + (f'TEST-{index}', None) + tuple(row))
+    return rows
+
+
+def write_workbook(path, sheets):
+    """
+    写出测试用的工作簿
+    :param sheets: {工作表名称: 行列表}，按顺序写出
+    """
+    wb = Workbook()
+    wb.remove(wb.active)
+    for name, rows in sheets.items():
+        sheet = wb.create_sheet(name)
+        for row in rows:
+            sheet.append(row)
+    wb.save(path)
+    return str(path)
+
+
+class ProductCollection:
+    """数据库中的 msku_info 集合（查不到任何产品）"""
+
+    def find_one(self, query):
+        return None
+
+
+@pytest.fixture
+def fixed_today(monkeypatch):
+    """填充日期固定为 TODAY"""
+    class FixedDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return TODAY
+
+    monkeypatch.setattr(template_engine, 'datetime', FixedDatetime)
+    return TODAY
+
+
+@pytest.fixture
+def image_folder(tmp_path):
+    """产品图片目录（只有部分产品有图片）"""
+    folder = tmp_path / 'images'
+    folder.mkdir()
+    Image.new('RGB', (200, 150), (200, 80, 80)).save(folder / 'TEST-0.jpg')
+    Image.new('RGB', (120, 220), (80, 200, 80)).save(folder / 'TEST-3.png')
+    return str(folder)
+
+
+@pytest.fixture
+def generator(tmp_path, image_folder):
+    table_path = str(tmp_path / 'product_table.bin')
+    write_product_table(build_products(8), table_path)
+    output_folder = tmp_path / 'output'
+    output_folder.mkdir()
+    gen = InvoiceGenerator(str(tmp_path), str(output_folder),
+                           db_connector=contextlib.nullcontext({'msku_info': ProductCollection()}),
+                           product_table=ProductTable(table_path),
+                           image_cache=EmbedImageCache(cache_dir=str(tmp_path / 'embed_images')),
+                           template_folder=TEMPLATE_DIR)
+    gen.image_folder = image_folder
+    return gen
+
+
+def template_path(name):
+    return os.path.join(TEMPLATE_DIR, f'{name}.xlsx')
+
+
+def sheet_snapshot(path, sheet_name):
+    """
+    输出文件中一个工作表的内容
+    :return: {'values': {单元格: 值}, 'merged': [合并区域], 'images': {锚点单元格: 图片数量}}
+    """
+    wb = load_workbook(path)
+    sheet = wb[sheet_name]
+    values = {}
+    for row in sheet.iter_rows():
+        for cell in row:
+            if cell.value is not None:
+                value = cell.value
+                values[cell.coordinate] = value.isoformat() if isinstance(value, datetime) else value
+    images = Counter(f"{get_column_letter(img.anchor._from.col + 1)}{img.anchor._from.row + 1}"
+                     for img in sheet._images)
+    return {'values': values, 'merged': sorted(str(r) for r in sheet.merged_cells.ranges),
+            'images': dict(sorted(images.items()))}
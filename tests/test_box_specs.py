@@ -0,0 +1,148 @@
+"""
+箱规目录：查找顺序（精确匹配 > 包含箱规名称 > 箱规名称的一部分）与数据库加载
+"""
+import contextlib
+
+import pytest
+
+from box_specs import DEFAULT_BOX_SPECS, BoxSpecCatalog
+
+
+class BoxSpecCollection:
+    """数据库中的 box_specs 集合"""
+
+    def __init__(self, docs=()):
+        self.docs = [dict(doc) for doc in docs]
+        self.find_calls = 0
+
+    def find(self, query, projection):
+        self.find_calls += 1
+        assert query == {'disabled': {'$ne': True}}
+        docs = [doc for doc in self.docs if not doc.get('disabled')]
+        return Cursor(docs)
+
+    def estimated_document_count(self):
+        return len(self.docs)
+
+    def insert_many(self, docs):
+        self.docs.extend(docs)
+
+    def create_index(self, key, unique=False):
+        pass
+
+
+class Cursor(list):
+    def sort(self, key, direction):
+        return Cursor(sorted(self, key=lambda doc: doc.get(key, 0)))
+
+
+def spec(name, order, aliases=(), size=10):
+    return {'name': name, 'aliases': list(aliases), 'order': order,
+            'length': size, 'width': size, 'height': size, 'weight': 1}
+
+
+def catalog(docs=None):
+    collection = BoxSpecCollection(docs or ())
+    return BoxSpecCatalog(contextlib.nullcontext({'box_specs': collection})), collection
+
+
+@pytest.fixture
+def default_catalog():
+    return catalog()[0]
+
+
+@pytest.mark.parametrize('box_type, name', [
+    ('2号', '2号'),
+    # 全角、大小写和空白不影响匹配
+    ('２号', '2号'),
+    (' 定制 64 ', '定制64'),
+    # 表格写法包含箱规名称
+    ('定制64箱', '定制64'),
+    ('2号纸箱', '2号'),
+    # 表格写法是箱规名称的一部分，按目录顺序取第一个
+    ('定制', '定制49'),
+    ('号', '中号'),
+    ('搬家', '搬家大'),
+])
+def test_default_catalog_match(default_catalog, box_type, name):
+    assert default_catalog.match(box_type)['name'] == name
+
+
+@pytest.mark.parametrize('box_type', [None, '', '  ', '特大'])
+def test_no_match(default_catalog, box_type):
+    assert default_catalog.match(box_type) is None
+
+
+def test_aliases_match_exactly():
+    specs, _ = catalog([spec('定制64', 0, aliases=['64箱', 'C64']), spec('64', 1)])
+    assert specs.match('c64')['name'] == '定制64'
+    # 别名精确匹配优先于包含更短的名称
+    assert specs.match('64箱')['name'] == '定制64'
+
+
+def test_longest_contained_name_wins():
+    specs, _ = catalog([spec('定制', 0), spec('定制64', 1), spec('64', 2)])
+    assert specs.match('定制64箱')['name'] == '定制64'
+    assert specs.match('定制箱')['name'] == '定制'
+
+
+def test_contained_names_of_same_length_follow_catalog_order():
+    specs, _ = catalog([spec('B2', 0), spec('A1', 1)])
+    assert specs.match('A1B2')['name'] == 'B2'
+    specs, _ = catalog([spec('A1', 0), spec('B2', 1)])
+    assert specs.match('A1B2')['name'] == 'A1'
+
+
+def test_contained_name_before_partial_name():
+    # “制64”是“大定制64”的一部分，但包含了名称“6”
+    specs, _ = catalog([spec('大定制64', 0), spec('6', 1)])
+    assert specs.match('制64')['name'] == '6'
+    assert specs.match('定制')['name'] == '大定制64'
+
+
+def test_empty_collection_is_seeded():
+    specs, collection = catalog()
+    assert [s['name'] for s in specs.all()] == list(DEFAULT_BOX_SPECS)
+    assert [doc['order'] for doc in collection.docs] == list(range(len(DEFAULT_BOX_SPECS)))
+    assert specs.default['name'] == '中号'
+
+
+def test_catalog_order_disabled_and_invalid_specs():
+    specs, _ = catalog([spec('后', 2), spec('停用', 0) | {'disabled': True}, spec('前', 1, size='12.5'),
+                        {'name': '缺少尺寸', 'order': 3}])
+    assert [s['name'] for s in specs.all()] == ['前', '后']
+    assert specs.default == {'name': '前', 'aliases': [], 'length': 12.5, 'width': 12.5, 'height': 12.5,
+                             'weight': 1}
+
+
+def test_reloads_after_invalidate():
+    specs, collection = catalog([spec('A', 0)])
+    version = specs.version
+    collection.docs.append(spec('B', 1))
+    # 缓存有效期内不重新加载
+    assert specs.match('B') is None
+    assert collection.find_calls == 1
+
+    specs.invalidate()
+    assert specs.match('B')['name'] == 'B'
+    assert specs.version != version
+    assert collection.find_calls == 2
+
+
+def test_falls_back_when_database_fails():
+    class BrokenConnector:
+        def __enter__(self):
+            raise ConnectionError('database unavailable')
+
+        def __exit__(self, *exc):
+            return False
+
+    specs = BoxSpecCatalog(BrokenConnector())
+    assert specs.match('定制64')['name'] == '定制64'
+
+    # 加载成功过之后，数据库不可用时继续使用上次加载的箱规
+    specs, _ = catalog([spec('A', 0)])
+    specs.match('A')
+    specs._db_connector = BrokenConnector()
+    specs.invalidate()
+    assert [s['name'] for s in specs.all()] == ['A']
@@ -0,0 +1,66 @@
+"""
+模板名称 -> 处理器 的分派表：完全相同的名称优先，否则取名称中包含的最长关键字，
+只按关键字匹配到声明式模板时还要求版式一致
+"""
+import shutil
+
+import pytest
+
+from conftest import template_path
+
+
+@pytest.mark.parametrize('name, keyword', [
+    ('林道', '林道'),
+    ('林道UPS', '林道UPS'),
+    ('林道日本', '林道'),
+    ('林道美森限时快船', '林道'),
+    ('德邦美森限时达', '德邦美森限时达'),
+    ('德邦美森', None),
+    ('顺丰', '顺丰'),
+    ('顺丰海运', None),
+    ('欧UPS红单', None),
+])
+def test_template_folder_dispatch(generator, name, keyword):
+    assert generator._dispatch[name] == keyword
+
+
+def test_build_dispatch(generator, tmp_path):
+    folder = tmp_path / 'templates'
+    folder.mkdir()
+    for source, filename in [('林道UPS', '新林道UPS-2.xlsx'), ('UPS(美洲)', 'ups(美洲)-新.xlsx'),
+                             ('林道', '林道-备用.xlsx'), ('顺丰海运', '顺丰海运2.xlsx'), ('宏川', '某某物流.xlsx'),
+                             ('林道', '~$林道.xlsx'), ('林道', '.林道.xlsx')]:
+        shutil.copyfile(template_path(source), folder / filename)
+    (folder / '林道.txt').write_text('不是模板')
+
+    assert generator._build_dispatch(str(folder)) == {
+        # 最长的关键字优先，关键字不区分大小写
+        '新林道UPS-2': '林道UPS',
+        'ups(美洲)-新': 'UPS(美洲)',
+        '林道-备用': '林道',
+        # 名称包含“顺丰”但版式不同
+        '顺丰海运2': None,
+        '某某物流': None,
+    }
+    assert generator._build_dispatch(str(tmp_path / 'missing')) == {}
+
+
+def test_handler_lookup(generator):
+    assert generator._get_template_handler(template_path('林道UPS')) == generator._fill_lindaoUPS_template
+    assert generator._get_template_handler(template_path('林道日本')).spec.name == '林道'
+    assert generator._get_template_handler(template_path('顺丰海运')) == generator._fill_default_template
+    assert generator.template_sheet(template_path('林道UPS')) == '发票'
+    assert generator.template_sheet(template_path('林道日本')) == generator._template_handlers['林道'].spec.sheet
+
+
+def test_template_outside_folder_is_matched_once(generator, tmp_path, monkeypatch):
+    path = tmp_path / '递信-临时.xlsx'
+    shutil.copyfile(template_path('林道'), path)
+    calls = []
+    resolve = generator._resolve_keyword
+    monkeypatch.setattr(generator, '_resolve_keyword', lambda p: calls.append(p) or resolve(p))
+
+    for _ in range(2):
+        assert generator._get_template_handler(str(path)) == generator._fill_dixing_template
+    assert generator._dispatch['递信-临时'] == '递信'
+    assert len(calls) == 1
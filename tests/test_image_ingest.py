@@ -0,0 +1,89 @@
+"""
+产品图片批量导入：zip 中无效、重复和不支持的条目逐个报告，其余图片照常入库
+"""
+import zipfile
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+import image_ingest
+from image_index import ProductImageIndex
+from image_ingest import ImageIngest, ImageIngestError
+
+
+def image_bytes(mode='RGB', size=(40, 30), fmt='JPEG'):
+    buffer = BytesIO()
+    Image.new(mode, size).save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+def build_zip(entries):
+    """
+    :param entries: [(条目名称, 内容)]，名称以 / 结尾的是目录
+    """
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for name, data in entries:
+            archive.writestr(name, data)
+    buffer.seek(0)
+    return buffer
+
+
+@pytest.fixture
+def ingest(tmp_path):
+    folder = tmp_path / 'images'
+    folder.mkdir()
+    service = ImageIngest(str(folder), max_workers=2, image_index=ProductImageIndex(str(folder)))
+    yield service
+    service._pool.shutdown()
+
+
+def test_rejects_file_that_is_not_zip(ingest):
+    with pytest.raises(ImageIngestError, match='不是有效的 zip 文件'):
+        ingest.ingest_zip(BytesIO(b'not a zip file'))
+
+
+def test_reports_bad_and_duplicate_entries(ingest, tmp_path):
+    # 导入 .jpg 后删除同一 MSKU 的旧 .png
+    Image.new('RGB', (10, 10)).save(tmp_path / 'images' / 'TEST-0.png')
+    archive = build_zip([
+        ('TEST-0.jpg', image_bytes()),
+        ('photos/', b''),
+        ('photos/TEST-1.png', image_bytes('RGBA', fmt='PNG')),
+        ('photos/TEST-0.png', image_bytes('RGBA', fmt='PNG')),
+        ('TEST-2.jpg', b'not an image'),
+        ('TEST-3.gif', image_bytes('P', fmt='GIF')),
+        ('readme.txt', b'MSKU list'),
+        ('__MACOSX/._TEST-0.jpg', b'resource fork'),
+        ('.DS_Store', b'finder'),
+    ])
+    imported, failed = ingest.ingest_zip(archive)
+
+    assert sorted((r['msku'], r['format']) for r in imported) == [('TEST-0', 'jpeg'), ('TEST-1', 'png'),
+                                                                   ('TEST-3', 'jpeg')]
+    assert sorted(failed, key=lambda f: f['name']) == [
+        {'name': 'TEST-2.jpg', 'error': '无法识别的图片格式'},
+        {'name': 'photos/TEST-0.png', 'error': 'MSKU TEST-0 重复'},
+        {'name': 'readme.txt', 'error': '不支持的文件类型'},
+    ]
+    assert sorted(p.name for p in (tmp_path / 'images').iterdir()) == ['TEST-0.jpg', 'TEST-1.png', 'TEST-3.jpg']
+    assert ingest.image_index.lookup('TEST-1').path == str(tmp_path / 'images' / 'TEST-1.png')
+
+
+def test_skips_oversized_entries(ingest, monkeypatch):
+    small = image_bytes(size=(4, 4))
+    monkeypatch.setattr(image_ingest, 'MAX_ENTRY_BYTES', len(small))
+    imported, failed = ingest.ingest_zip(build_zip([('TEST-0.jpg', small), ('TEST-1.jpg', image_bytes())]))
+    assert [r['msku'] for r in imported] == ['TEST-0']
+    assert failed == [{'name': 'TEST-1.jpg', 'error': '图片过大'}]
+
+
+def test_entry_paths_are_dropped(ingest, tmp_path):
+    # Windows 打包的 zip 使用反斜杠分隔目录，只按文件名入库，不会写到图片目录之外
+    imported, failed = ingest.ingest_zip(build_zip([('..\\..\\TEST-0.jpg', image_bytes()),
+                                                    ('../TEST-1.jpg', image_bytes())]))
+    assert sorted(r['msku'] for r in imported) == ['TEST-0', 'TEST-1']
+    assert not failed
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['images']
+    assert sorted(p.name for p in (tmp_path / 'images').iterdir()) == ['TEST-0.jpg', 'TEST-1.jpg']
@@ -0,0 +1,111 @@
+"""
+装箱单解析结果缓存：缓存键只由文件内容、处理器类型和模板特殊处理决定
+"""
+import os
+import shutil
+
+import pytest
+
+import packing_cache
+from conftest import lingxing_rows, write_workbook
+from get_ticket_data import PackingListProcessor, process_workbook
+from packing_cache import PackingListCache
+
+QUANTITIES = [[3, 0], [0, 5], [2, 1]]
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return PackingListCache(cache_dir=str(tmp_path / 'cache'))
+
+
+@pytest.fixture
+def workbook(tmp_path):
+    return write_workbook(tmp_path / 'packing.xlsx', {'Sheet1': lingxing_rows('FBA18TEST', QUANTITIES)})
+
+
+def test_key_depends_on_content_not_path(cache, workbook, tmp_path):
+    copy = str(tmp_path / 'copy.xlsx')
+    shutil.copyfile(workbook, copy)
+    assert cache.make_key(copy, 'PackingListProcessor') == cache.make_key(workbook, 'PackingListProcessor')
+
+    changed = write_workbook(tmp_path / 'changed.xlsx', {'Sheet1': lingxing_rows('FBA18OTHER', QUANTITIES)})
+    assert cache.make_key(changed, 'PackingListProcessor') != cache.make_key(workbook, 'PackingListProcessor')
+
+
+def test_key_changes_when_file_is_rewritten(cache, workbook):
+    key = cache.make_key(workbook, 'PackingListProcessor')
+    write_workbook(workbook, {'Sheet1': lingxing_rows('FBA18TEST', [[4, 0], [0, 5], [2, 1]])})
+    assert cache.make_key(workbook, 'PackingListProcessor') != key
+
+
+def test_key_depends_on_processor_and_quirks(cache, workbook, monkeypatch):
+    key = cache.make_key(workbook, 'SimplePackingListProcessor', drop_first_column=0, box_specs=1)
+    assert cache.make_key(workbook, 'PackingListProcessor', drop_first_column=0, box_specs=1) != key
+    assert cache.make_key(workbook, 'SimplePackingListProcessor', drop_first_column=1, box_specs=1) != key
+    assert cache.make_key(workbook, 'SimplePackingListProcessor', drop_first_column=0, box_specs=2) != key
+    assert cache.make_key(workbook, 'SimplePackingListProcessor', drop_first_column=0, box_specs=1,
+                          sheet='Sheet2') != key
+    # 特殊处理参数的传入顺序不影响缓存键
+    assert cache.make_key(workbook, 'SimplePackingListProcessor', box_specs=1, drop_first_column=0) == key
+
+    monkeypatch.setattr(packing_cache, 'CACHE_FORMAT_VERSION', packing_cache.CACHE_FORMAT_VERSION + 1)
+    assert cache.make_key(workbook, 'SimplePackingListProcessor', drop_first_column=0, box_specs=1) != key
+
+
+def test_file_hash_is_computed_once_per_file(cache, workbook, monkeypatch):
+    calls = []
+    file_hash = PackingListCache.file_hash
+    monkeypatch.setattr(PackingListCache, 'file_hash', staticmethod(lambda path: calls.append(path) or file_hash(path)))
+    for sheet in ('Sheet1', 'Sheet2', 'Sheet3'):
+        cache.make_key(workbook, 'PackingListProcessor', sheet=sheet)
+    assert len(calls) == 1
+
+
+def test_get_and_put(cache):
+    assert cache.get('missing') is None
+    cache.put('key', ('FBA18TEST', {1: 'box'}, ['item']))
+    assert cache.get('key') == ('FBA18TEST', {1: 'box'}, ['item'])
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # 损坏的缓存条目按未命中处理
+    with open(os.path.join(cache.cache_dir, 'broken.bin'), 'wb') as f:
+        f.write(b'not zlib')
+    assert cache.get('broken') is None
+    assert cache.misses == 2
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = PackingListCache(cache_dir=str(tmp_path / 'cache'), max_bytes=1)
+    cache.put('old', 'a' * 100)
+    assert not os.listdir(cache.cache_dir)
+
+    cache.max_bytes = 10 ** 6
+    for index, key in enumerate(('first', 'second', 'third')):
+        cache.put(key, os.urandom(1000))
+        path = os.path.join(cache.cache_dir, f'{key}.bin')
+        os.utime(path, (index, index))
+    cache.max_bytes = sum(os.path.getsize(os.path.join(cache.cache_dir, name))
+                          for name in os.listdir(cache.cache_dir)) - 1
+    cache._evict()
+    assert sorted(os.listdir(cache.cache_dir)) == ['second.bin', 'third.bin']
+
+
+def test_processor_reuses_cached_result(cache, workbook):
+    first = PackingListProcessor(workbook, cache=cache)
+    assert first.process()
+    second = PackingListProcessor(workbook, cache=cache)
+    assert second.process()
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert second.shipment_id == first.shipment_id == 'FBA18TEST'
+    assert sorted(second.boxes) == sorted(first.boxes) == [1, 2]
+    assert [item.msku for item in second.items] == [item.msku for item in first.items]
+
+
+def test_sheets_with_same_rows_are_cached_separately(cache, tmp_path):
+    path = write_workbook(tmp_path / 'multi.xlsx', {'A': lingxing_rows('FBA18AAA', QUANTITIES),
+                                                   'B': lingxing_rows('FBA18BBB', QUANTITIES)})
+    assert [p.shipment_id for p in process_workbook(path, cache=cache)] == ['FBA18AAA', 'FBA18BBB']
+    assert len(os.listdir(cache.cache_dir)) == 2
+    assert [p.shipment_id for p in process_workbook(path, cache=cache)] == ['FBA18AAA', 'FBA18BBB']
+    assert cache.hits == 2
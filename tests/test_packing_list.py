@@ -0,0 +1,115 @@
+"""
+装箱单解析
+"""
+import random
+
+import pandas as pd
+import pytest
+
+from conftest import lingxing_rows, write_workbook
+from get_ticket_data import PackingListProcessor, process_workbook
+from task_log import get_task_log, task_context
+
+
+def _value(value):
+    return None if pd.isna(value) else value
+
+
+def baseline_parse(path):
+    """
+    原来逐行解析领星装箱单的实现（pd.read_excel + iterrows），作为向量化解析的对照
+    :return: (Shipment ID, [(序号, MSKU, FNSKU, 品名, SKU, 发货量, {箱号: 数量})], {箱号: (重量, 长, 宽, 高, [MSKU])})
+    """
+    df = pd.read_excel(path)
+    shipment_id = str(df.iloc[0, 1])
+    last_product_row = None
+    for i in range(len(df)):
+        try:
+            if not pd.isna(df.iloc[i, 0]) and float(df.iloc[i, 0]) > 0:
+                last_product_row = i
+        except (ValueError, TypeError):
+            continue
+
+    items, boxes = [], {}
+    for _, row in df.iloc[2:last_product_row + 1].iterrows():
+        if pd.isna(row.iloc[0]) or pd.isna(row.iloc[1]) or pd.isna(row.iloc[5]):
+            continue
+        box_quantities = {}
+        for col_idx in range(6, len(df.columns)):
+            quantity = row.iloc[col_idx]
+            if not pd.isna(quantity) and quantity > 0:
+                box_quantities[col_idx - 5] = int(quantity)
+                boxes.setdefault(col_idx - 5, []).append(row.iloc[1])
+        items.append((int(row.iloc[0]), row.iloc[1], _value(row.iloc[2]), _value(row.iloc[3]), _value(row.iloc[4]),
+                      int(row.iloc[5]), box_quantities))
+
+    box_info_start = last_product_row + 2
+    box_info = {}
+    for box_number, mskus in boxes.items():
+        dims = tuple(_value(df.iloc[box_info_start + k, 5 + box_number]) for k in range(4))
+        box_info[box_number] = tuple(None if v is None else float(v) for v in dims) + (mskus,)
+    return shipment_id, items, box_info
+
+
+def vectorized_parse(path):
+    processor = PackingListProcessor(path, cache=None)
+    boxes = processor.process()
+    items = [(item.sequence_no, item.msku, _value(item.fnsku), _value(item.product_name), _value(item.sku),
+              item.quantity, dict(item.box_quantities)) for item in processor.items]
+    box_info = {number: (box.weight, box.length, box.width, box.height, [item.msku for item in box.items])
+                for number, box in boxes.items()}
+    return processor.shipment_id, items, box_info
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_packing_list_matches_baseline_parser(tmp_path, seed):
+    rng = random.Random(seed)
+    box_count = rng.randint(1, 30)
+    quantities = [[rng.choice([None, None, 0, rng.randint(1, 40), float(rng.randint(1, 9))])
+                   for _ in range(box_count)] for _ in range(rng.randint(1, 40))]
+    box_info = [(rng.choice([None, round(rng.uniform(5, 25), 2)]), rng.randint(20, 60), rng.randint(20, 60),
+                 rng.choice([None, rng.randint(20, 60)])) for _ in range(box_count)]
+    rows = lingxing_rows(f'FBA{seed}', quantities, box_info)
+    # 序号为空的行不是商品
+    rows.insert(4, (None, 'NOTE', None, None, None, 10, 5))
+    path = write_workbook(tmp_path / 'packing.xlsx', {'Sheet1': rows})
+
+    expected = baseline_parse(path)
+    actual = vectorized_parse(path)
+    assert actual[0] == expected[0]
+    assert actual[1] == expected[1]
+    assert actual[2] == expected[2]
+    assert list(actual[2]) == list(expected[2])
+
+
+def test_invalid_and_fractional_quantities_are_reported(tmp_path):
+    path = write_workbook(tmp_path / 'packing.xlsx', {
+        'Sheet1': lingxing_rows('FBA1', [[5, '1O'], [2.5, 3]]),
+    })
+    with task_context('test-quantities'):
+        processor = PackingListProcessor(path, cache=None)
+        boxes = processor.process()
+    assert dict(processor.items[0].box_quantities) == {1: 5}
+    assert dict(processor.items[1].box_quantities) == {1: 2, 2: 3}
+    assert sorted(boxes) == [1, 2]
+
+    warnings = [entry['message'] for entry in get_task_log('test-quantities', 'WARNING')]
+    assert "Invalid quantity '1O' in cell H4, treated as 0" in warnings
+    assert 'Fractional quantity 2.5 in cell G5, truncated to 2' in warnings
+
+
+def test_process_workbook_keeps_task_log_context(tmp_path):
+    path = write_workbook(tmp_path / 'multi.xlsx', {
+        '汇总': [('汇总',), ('总箱数', 12), ('总件数', 340)],
+        'FBA1': lingxing_rows('FBA1', [[5, 0], [0, 7]]),
+        'FBA2': lingxing_rows('FBA2', [[3]]),
+    })
+    with task_context('test-sheets'):
+        processors = process_workbook(path, cache=None, max_workers=3)
+    assert [p.shipment_id for p in processors] == ['FBA1', 'FBA2']
+
+    # 各工作表在线程池中解析，日志仍记入当前任务
+    messages = [entry['message'] for entry in get_task_log('test-sheets')]
+    assert 'Found Shipment ID: FBA1' in messages
+    assert 'Found Shipment ID: FBA2' in messages
+    assert any('No product data found' in message for message in messages)
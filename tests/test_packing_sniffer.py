@@ -0,0 +1,107 @@
+"""
+装箱单格式嗅探
+"""
+import pytest
+
+from conftest import lingxing_rows, simple_rows, write_workbook
+from packing_sniffer import FORMAT_LINGXING, FORMAT_SIMPLE, PackingListFormatError, SniffResult, sniff_packing_list
+
+SUMMARY_ROWS = [('汇总',), ('总箱数', 12), ('总件数', 340)]
+
+
+def _replace_row(rows, index, row):
+    rows = list(rows)
+    rows[index] = row
+    return rows
+
+
+def sniff_rows(tmp_path, rows, template_name=None):
+    return sniff_packing_list(write_workbook(tmp_path / 'packing.xlsx', {'Sheet1': rows}), template_name)
+
+
+def test_lingxing(tmp_path):
+    result = sniff_rows(tmp_path, lingxing_rows('FBA1', [[5, 0], [0, 7]]))
+    assert result == SniffResult(FORMAT_LINGXING, 'FBA1', 0, 2)
+    assert not result.is_simple_format
+
+
+def test_simple(tmp_path):
+    result = sniff_rows(tmp_path, simple_rows('FBA1', [[5, 6], [1, 0]]))
+    assert result == SniffResult(FORMAT_SIMPLE, 'FBA1', 0, 6)
+    assert result.is_simple_format
+
+
+def test_yinuoda_extra_first_column(tmp_path):
+    result = sniff_rows(tmp_path, simple_rows('FBA1', [[5, 6]], offset=1), '依诺达-美国')
+    assert result == SniffResult(FORMAT_SIMPLE, 'FBA1', 1, 6)
+
+
+@pytest.mark.parametrize('rows, template_name, message', [
+    ([], None, 'Excel文件为空'),
+    (lingxing_rows('', [[5]]), None, r'Shipment ID 为空（第2行第2列）'),
+    (simple_rows('', [[5]]), None, r'Shipment ID 为空（第2行第2列）'),
+    (simple_rows('FBA1', [[5]], offset=1), None, '装箱单第一列多出一列，只有依诺达模板支持该格式'),
+    (simple_rows('FBA1', [[5]]), '依诺达-美国', '依诺达装箱单第一列应为多余列，请检查文件是否选错模板'),
+    ([('标题',), ('Shipment ID', 'FBA1'), (None, '箱号', 1), ('SKU', '总数'), ('TEST-0', None, 5)], None,
+     '箱号行上方缺少重量和箱规行'),
+    (_replace_row(simple_rows('FBA1', [[5]]), 5, (None, '箱号', '第一箱')), None, '箱号行中没有有效的箱号'),
+    (simple_rows('FBA1', [[5]])[:-1], None, '未找到有效的商品信息'),
+    (_replace_row(simple_rows('FBA1', [[5]]), 7, (None, None, 5)), None, r'箱号行后两行应为第一条商品（SKU 为空）'),
+    ([('Shipment', 'info'), ('Shipment ID', 'FBA1'), ('序号', 'MSKU', 'FNSKU', '品名', 'SKU', '发货量'),
+      (1, 'TEST-0', 'FN0', '产品0', 'SKU0', 5)], None, '商品行缺少每箱数量列'),
+    (SUMMARY_ROWS, None, '^未找到商品数据，也未找到箱号行'),
+    ([('Shipment', 'info'), ('Shipment ID', 'FBA1')] + [('备注',)] * 70, None,
+     '前 60 行内未找到商品数据，也未找到箱号行'),
+])
+def test_rejects_malformed(tmp_path, rows, template_name, message):
+    with pytest.raises(PackingListFormatError, match=message):
+        sniff_rows(tmp_path, rows, template_name)
+
+
+def test_rejects_unreadable_file(tmp_path):
+    path = tmp_path / 'packing.xlsx'
+    path.write_bytes(b'not an excel file')
+    with pytest.raises(PackingListFormatError, match='无法读取Excel文件'):
+        sniff_packing_list(str(path))
+
+
+def test_multi_sheet_skips_empty_and_summary_first_sheet(tmp_path):
+    path = write_workbook(tmp_path / 'multi.xlsx', {
+        '空白': [],
+        '汇总': SUMMARY_ROWS,
+        'FBA1': lingxing_rows('FBA1', [[5, 0], [0, 7]]),
+        'FBA2': lingxing_rows('FBA2', [[3]]),
+    })
+    result = sniff_packing_list(path)
+    assert result.format == FORMAT_LINGXING
+    assert result.sheet_name == 'FBA1'
+    assert result.shipment_id == 'FBA1'
+    # 空工作表与 process_workbook 一样直接跳过，不可用的工作表逐个报告
+    assert [name for name, _ in result.sheet_errors] == ['汇总']
+
+
+def test_multi_sheet_reports_each_failure(tmp_path):
+    path = write_workbook(tmp_path / 'multi.xlsx', {
+        '汇总': SUMMARY_ROWS,
+        '无ID': lingxing_rows('', [[5]]),
+    })
+    with pytest.raises(PackingListFormatError) as excinfo:
+        sniff_packing_list(path)
+    message = str(excinfo.value)
+    assert '汇总' in message and '无ID' in message and 'Shipment ID 为空' in message
+
+
+def test_multi_sheet_rejects_mixed_formats(tmp_path):
+    path = write_workbook(tmp_path / 'multi.xlsx', {
+        'FBA1': simple_rows('FBA1', [[5, 6]]),
+        'FBA2': lingxing_rows('FBA2', [[3]]),
+    })
+    result = sniff_packing_list(path)
+    assert result.format == FORMAT_SIMPLE
+    assert result.sheet_errors == (('FBA2', '装箱单格式与工作表 FBA1 不同'),)
+
+
+def test_multi_sheet_all_empty(tmp_path):
+    path = write_workbook(tmp_path / 'multi.xlsx', {'Sheet1': [], 'Sheet2': []})
+    with pytest.raises(PackingListFormatError, match='Excel文件为空'):
+        sniff_packing_list(path)
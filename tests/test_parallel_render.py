@@ -0,0 +1,98 @@
+"""
+XML 改写 + 分段并行渲染 与 openpyxl 填充的输出一致性
+阈值按 TICKET_PARALLEL_ROWS 等环境变量在导入时确定，这里直接调低模块中的阈值，使测试数据走并行路径
+"""
+import os
+import sys
+import threading
+
+import pytest
+
+import parallel_render
+import template_engine
+from conftest import ADDRESS_INFO, CODE, ROOT, build_boxes, sheet_snapshot, template_path
+
+
+@pytest.fixture
+def force_parallel(monkeypatch):
+    """数据行超过 1 行即分段并行渲染，每段至少 8 行，2 个子进程"""
+    monkeypatch.setattr(template_engine, 'PARALLEL_ROW_THRESHOLD', 1)
+    monkeypatch.setattr(template_engine, 'MAX_WORKERS', 2)
+    monkeypatch.setattr(parallel_render, 'MAX_WORKERS', 2)
+    monkeypatch.setattr(parallel_render, 'MIN_CHUNK_ROWS', 8)
+    monkeypatch.setattr(parallel_render, '_pool', None)
+
+    calls = []
+    render_chunks = template_engine.render_chunks
+
+    def counting_render_chunks(render, tasks):
+        calls.append(len(tasks))
+        return render_chunks(render, tasks)
+
+    monkeypatch.setattr(template_engine, 'render_chunks', counting_render_chunks)
+    yield calls
+    if parallel_render._pool is not None:
+        parallel_render._pool.shutdown()
+
+
+@pytest.mark.parametrize('name', ['叮铛卡航限时达', 'UPS(美洲)'])
+def test_parallel_xml_matches_openpyxl(name, generator, fixed_today, force_parallel):
+    path = template_path(name)
+    spec = generator._get_template_handler(path).spec
+    box_data = build_boxes()
+    outputs = {}
+    try:
+        for engine in ('openpyxl', 'xml'):
+            spec.output = engine
+            outputs[engine] = generator.generate_invoice(path, box_data, CODE, ADDRESS_INFO, name_suffix=f'_{engine}')
+    finally:
+        spec.output = 'xml'
+
+    # 数据行分成了多段并在子进程中渲染
+    assert len(force_parallel) == 1 and force_parallel[0] > 1
+
+    expected = sheet_snapshot(outputs['openpyxl'], spec.sheet)
+    actual = sheet_snapshot(outputs['xml'], spec.sheet)
+    assert actual['merged'] == expected['merged']
+    assert actual['images'] == expected['images']
+    assert actual['values'] == expected['values']
+
+
+def _spawned_worker_state():
+    """在渲染子进程中执行：子进程导入了哪个启动模块、是否启动了服务"""
+    entry = sys.modules.get('__mp_main__')
+    return {
+        'entry': getattr(entry, '__file__', None),
+        'web_ticket': 'web_ticket' in sys.modules,
+        'services': getattr(entry, 'invoice_generator', None) is not None,
+        'threads': [t.name for t in threading.enumerate()],
+    }
+
+
+@pytest.fixture
+def fresh_pool(monkeypatch):
+    """新建的渲染进程池（子进程按当前的启动模块初始化）"""
+    monkeypatch.setattr(parallel_render, '_pool', None)
+    yield parallel_render._get_pool
+    if parallel_render._pool is not None:
+        parallel_render._pool.shutdown()
+
+
+def test_spawned_worker_does_not_import_web_ticket(fresh_pool):
+    state = fresh_pool().submit(_spawned_worker_state).result(timeout=120)
+    assert not state['web_ticket']
+    assert state['threads'] == ['MainThread']
+
+
+def test_spawned_worker_does_not_start_services(fresh_pool, monkeypatch):
+    # 服务以 python web_ticket.py 启动时，spawn 子进程会以 __mp_main__ 重新执行 web_ticket.py
+    web_ticket = pytest.importorskip('web_ticket')
+    assert web_ticket.invoice_generator is None
+    main = sys.modules['__main__']
+    monkeypatch.setattr(main, '__spec__', None)
+    monkeypatch.setattr(main, '__file__', os.path.join(ROOT, 'web_ticket.py'), raising=False)
+
+    state = fresh_pool().submit(_spawned_worker_state).result(timeout=120)
+    assert state['entry'] == os.path.join(ROOT, 'web_ticket.py')
+    assert not state['services']
+    assert state['threads'] == ['MainThread']
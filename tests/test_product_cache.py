@@ -0,0 +1,156 @@
+"""
+产品共享表：打包/解码往返、文件被替换后的重新映射、刷新器的主机锁
+"""
+import contextlib
+import os
+
+import pytest
+
+import product_cache
+from conftest import build_products
+from product_cache import PRODUCT_FIELDS, ProductTable, ProductTableRefresher, write_product_table
+
+
+class MskuInfoCollection:
+    """数据库中的 msku_info 集合，记录 find 调用次数"""
+
+    def __init__(self, products):
+        self.products = products
+        self.find_calls = 0
+
+    def find(self, query, projection):
+        self.find_calls += 1
+        return iter(self.products)
+
+
+def refresher(path, products=()):
+    collection = MskuInfoCollection(list(products))
+    return ProductTableRefresher(contextlib.nullcontext({'msku_info': collection}), str(path)), collection
+
+
+def run_once(worker):
+    """只执行一轮刷新循环"""
+    worker._stop.wait = lambda timeout: worker._stop.set()
+    worker.run_forever()
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'product_table.bin')
+    products = build_products(8)
+    products.append({'msku': '中文-MSKU', 'productNameZh': '带中文的 MSKU', 'askprice': 12,
+                     'weight': None, 'electrified': True})
+    # 没有 MSKU 的文档不写入
+    products.append({'msku': '', 'productNameZh': '空 MSKU'})
+    products.append({'productNameZh': '缺少 MSKU'})
+    version = write_product_table(products, path, version=42)
+
+    table = ProductTable(path, check_interval=0)
+    assert table.loaded
+    assert table.version == version == 42
+    assert len(table) == 9
+    for product in products[:8]:
+        assert table.get(product['msku']) == {f: product[f] for f in PRODUCT_FIELDS}
+
+    # 缺失的字段不出现在结果中，bool 按字符串保存
+    assert table.get('中文-MSKU') == {'productNameZh': '带中文的 MSKU', 'askprice': 12,
+                                      'weight': None, 'electrified': 'True'}
+    assert table.get('TEST-99') is None
+    assert table.get(None) is None
+    assert not os.path.exists(f'{path}.{os.getpid()}.tmp')
+
+
+def test_hash_collisions_compare_msku(tmp_path, monkeypatch):
+    monkeypatch.setattr(product_cache, '_msku_hash', lambda msku: 7)
+    path = str(tmp_path / 'product_table.bin')
+    write_product_table(build_products(4), path)
+
+    table = ProductTable(path, check_interval=0)
+    assert [table.get(f'TEST-{i}')['model'] for i in range(4)] == ['M-0', 'M-1', 'M-2', 'M-3']
+    assert table.get('TEST-4') is None
+
+
+def test_reader_remaps_after_replace(tmp_path):
+    path = str(tmp_path / 'product_table.bin')
+    table = ProductTable(path, check_interval=0)
+    # 文件不存在时视为没有共享表
+    assert not table.loaded
+    assert table.get('TEST-0') is None
+
+    write_product_table(build_products(2), path, version=1)
+    assert table.get('TEST-0')['productNameZh'] == '测试产品0'
+    old_view = table._view
+
+    updated = build_products(3)
+    updated[0]['productNameZh'] = '更新后的产品0'
+    write_product_table(updated, path, version=2)
+    assert table.get('TEST-0')['productNameZh'] == '更新后的产品0'
+    assert table.version == 2
+    assert len(table) == 3
+
+    # 替换前取出的旧映射仍可读取（正在读取的线程不受影响）
+    old_map, old_keys = old_view
+    assert not old_map.closed
+    assert len(old_keys) == 2
+    assert product_cache._HEADER.unpack_from(old_map, 0)[1] == 1
+
+    os.remove(path)
+    assert table.get('TEST-0') is None
+    assert table.version is None
+
+
+def test_reader_keeps_view_within_check_interval(tmp_path):
+    path = str(tmp_path / 'product_table.bin')
+    write_product_table(build_products(1), path, version=1)
+    table = ProductTable(path, check_interval=3600)
+    assert table.loaded and table.version == 1
+    write_product_table(build_products(2), path, version=2)
+    assert len(table) == 1 and table.version == 1
+
+
+def test_reader_ignores_foreign_file(tmp_path):
+    path = tmp_path / 'product_table.bin'
+    path.write_bytes(b'NOTTABLE' + bytes(64))
+    table = ProductTable(str(path), check_interval=0)
+    assert not table.loaded
+    assert table.get('TEST-0') is None
+
+
+@pytest.mark.skipif(product_cache.fcntl is None, reason='没有 fcntl 时不加主机锁')
+def test_only_lock_holder_refreshes(tmp_path):
+    path = tmp_path / 'cache' / 'product_table.bin'
+    first, first_collection = refresher(path, build_products(3))
+    second, second_collection = refresher(path, build_products(3))
+
+    assert first._acquire_host_lock()
+    assert first._acquire_host_lock()
+    assert not second._acquire_host_lock()
+
+    # 未拿到锁的刷新器只等待，不读数据库
+    run_once(second)
+    assert second_collection.find_calls == 0
+    assert not path.exists()
+
+    run_once(first)
+    assert first_collection.find_calls == 1
+    assert len(ProductTable(str(path), check_interval=0)) == 3
+
+    # 持锁进程退出后，其他进程可以接手
+    first._lock_file.close()
+    assert second._acquire_host_lock()
+    second._lock_file.close()
+
+
+def test_refresh_on_request(tmp_path):
+    path = tmp_path / 'product_table.bin'
+    worker, collection = refresher(path, build_products(2))
+    assert worker._needs_refresh()
+    worker.refresh()
+    assert not worker._needs_refresh()
+
+    # 任意进程的刷新器都可以请求重建
+    other, _ = refresher(path)
+    other.request_refresh()
+    assert worker._needs_refresh()
+    worker.refresh()
+    assert collection.find_calls == 2
+    assert not worker._needs_refresh()
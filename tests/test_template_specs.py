@@ -0,0 +1,39 @@
+"""
+声明式模板的输出对比：用固定的装箱数据和产品表填充每个模板配置，与 golden/ 中保存的值、合并区域和图片位置比较
+模板或配置有意修改后，用 UPDATE_GOLDEN=1 python -m pytest tests 重新生成
+"""
+import json
+import os
+
+import pytest
+
+from conftest import ADDRESS_INFO, CODE, build_boxes, sheet_snapshot, template_path
+from template_engine import load_template_specs
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden')
+SPECS = load_template_specs()
+
+
+@pytest.mark.parametrize('name', sorted(SPECS))
+def test_spec_matches_golden(name, generator, fixed_today):
+    output_path = generator.generate_invoice(template_path(name), build_boxes(), CODE, ADDRESS_INFO)
+    snapshot = sheet_snapshot(output_path, SPECS[name].sheet)
+
+    golden_path = os.path.join(GOLDEN_DIR, f'{name}.json')
+    if os.getenv('UPDATE_GOLDEN'):
+        os.makedirs(GOLDEN_DIR, exist_ok=True)
+        with open(golden_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, ensure_ascii=False, indent=1, sort_keys=True)
+    with open(golden_path, encoding='utf-8') as f:
+        golden = json.load(f)
+
+    assert snapshot['merged'] == golden['merged']
+    assert snapshot['images'] == golden['images']
+    assert snapshot['values'] == golden['values']
+
+
+def test_keyword_match_requires_same_layout(generator):
+    # 顺丰海运没有追踪编码列，不能按关键字使用顺丰的配置
+    assert generator._dispatch['顺丰'] == '顺丰'
+    assert generator._dispatch['顺丰海运'] is None
+    assert generator.template_sheet(template_path('顺丰海运')) is None
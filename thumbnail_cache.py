@@ -0,0 +1,200 @@
+"""
+产品图片缩略图缓存
+MSKU 编辑页的表格每页请求几十张产品图片。缩略图按 (MSKU, 宽度, 原图修改时间) 生成一次保存在磁盘上，
+之后直接返回文件，不再解码原图；原图更新后修改时间变化，自动生成新的缩略图。
+响应带 ETag / Last-Modified，请求中带版本号（?v=原图修改时间）时允许浏览器长期缓存。
+宽度只能取 WIDTH_LADDER 中的几档（表格里的小图不必下载 300 像素的大图），
+编码格式按浏览器支持选择：WebP，或者 JPEG（有透明通道时为 PNG）。
+缓存目录总大小有上限，超出后按最近使用时间淘汰。
+"""
+import os
+import hashlib
+import threading
+from datetime import datetime, timezone
+
+from PIL import Image, features
+
+from image_index import image_index_for
+
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 'invoice_files', 'cache', 'thumbnails')
+
+# 缩略图宽度（像素），原图更窄时不放大
+THUMBNAIL_WIDTH = 300
+# 可用的缩略图宽度，请求的宽度向上取到最近的一档
+WIDTH_LADDER = (48, 96, 160, 300, 600)
+
+# 缩略图编码格式 -> (候选扩展名及 MIME 类型)；'jpeg' 对有透明通道的图片使用 PNG
+OUTPUT_FORMATS = {
+    'webp': (('.webp', 'image/webp'),),
+    'jpeg': (('.jpg', 'image/jpeg'), ('.png', 'image/png')),
+}
+# Pillow 编译时可能没有 WebP 支持
+WEBP_SUPPORTED = features.check('webp')
+
+# 表格中显示的缩略图，新图片入库后预先生成
+WARM_VARIANTS = ((96, 'webp'), (96, 'jpeg'))
+
+# 缩略图编码方式变化时递增，使旧缓存自动失效
+CACHE_FORMAT_VERSION = 2
+
+
+def snap_width(width):
+    """
+    请求的宽度取到 WIDTH_LADDER 中的一档
+    :param width: 请求的宽度（为空时使用 THUMBNAIL_WIDTH）
+    """
+    if not width:
+        return THUMBNAIL_WIDTH
+    for step in WIDTH_LADDER:
+        if width <= step:
+            return step
+    return WIDTH_LADDER[-1]
+
+
+class Thumbnail:
+    """一张已生成的缩略图"""
+
+    __slots__ = ('path', 'mimetype', 'etag', 'last_modified', 'version')
+
+    def __init__(self, path, mimetype, etag, last_modified, version):
+        """
+        :param path: 缩略图文件
+        :param mimetype: 缩略图的 MIME 类型
+        :param etag: 缓存键的哈希（同一原图、同一宽度不变）
+        :param last_modified: 原图修改时间
+        :param version: 原图版本号（修改时间，纳秒），用于图片 URL 的 ?v= 参数
+        """
+        self.path = path
+        self.mimetype = mimetype
+        self.etag = etag
+        self.last_modified = last_modified
+        self.version = version
+
+
+class ThumbnailCache:
+    """按 (MSKU, 宽度, 原图修改时间) 缓存的缩略图"""
+
+    def __init__(self, image_folder, cache_dir=DEFAULT_CACHE_DIR, width=THUMBNAIL_WIDTH, max_bytes=128 * 1024 * 1024,
+                 image_index=None):
+        """
+        :param image_folder: 产品图片目录
+        :param image_index: 产品图片目录索引（可选，默认使用该目录的共享索引）
+        :param cache_dir: 缓存目录
+        :param width: 缩略图宽度
+        :param max_bytes: 缓存目录总大小上限（字节）
+        """
+        self.image_folder = image_folder
+        self.image_index = image_index if image_index else image_index_for(image_folder)
+        self.cache_dir = cache_dir
+        self.width = width
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # 正在生成的缩略图，同一张缩略图只由一个线程生成
+        self._building = {}
+
+    def version(self, msku):
+        """原图版本号（修改时间），没有图片时返回 None"""
+        entry = self.image_index.lookup(msku)
+        return str(entry.mtime_ns) if entry is not None else None
+
+    def get(self, msku, width=None, fmt='jpeg'):
+        """
+        获取缩略图（不存在时生成）
+        :param msku: 产品MSKU
+        :param width: 缩略图宽度（默认 self.width）
+        :param fmt: 编码格式 'webp' 或 'jpeg'（有透明通道时为 PNG）；不支持 WebP 时使用 'jpeg'
+        :return: Thumbnail；没有产品图片时返回 None
+        """
+        width = width or self.width
+        if fmt not in OUTPUT_FORMATS or (fmt == 'webp' and not WEBP_SUPPORTED):
+            fmt = 'jpeg'
+        entry = self.image_index.lookup(msku)
+        if entry is None:
+            return None
+        raw = f"v{CACHE_FORMAT_VERSION}|{msku}|{width}|{fmt}|{entry.mtime_ns}|{entry.size}"
+        key = hashlib.sha1(raw.encode('utf-8')).hexdigest()
+        last_modified = datetime.fromtimestamp(entry.mtime_ns / 1e9, tz=timezone.utc)
+        version = str(entry.mtime_ns)
+
+        for ext, mimetype in OUTPUT_FORMATS[fmt]:
+            path = os.path.join(self.cache_dir, f"{key}{ext}")
+            try:
+                os.utime(path, None)  # 更新最近使用时间，用于淘汰
+            except FileNotFoundError:
+                continue
+            self.hits += 1
+            return Thumbnail(path, mimetype, key, last_modified, version)
+
+        with self._lock:
+            event = self._building.get(key)
+            owner = event is None
+            if owner:
+                event = self._building[key] = threading.Event()
+        if not owner:
+            # 其他线程正在生成同一张缩略图，等待结果
+            event.wait(timeout=30)
+            return self.get(msku, width, fmt)
+
+        try:
+            self.misses += 1
+            path, mimetype = self._build(entry.path, key, width, fmt)
+            self._evict()
+            return Thumbnail(path, mimetype, key, last_modified, version)
+        finally:
+            with self._lock:
+                self._building.pop(key, None)
+            event.set()
+
+    def warm(self, msku):
+        """预先生成表格中显示的缩略图（新图片入库后调用）"""
+        for width, fmt in WARM_VARIANTS:
+            self.get(msku, width, fmt)
+
+    def _build(self, source, key, width, fmt):
+        """解码原图生成缩略图：WebP；或者有透明通道的图片保存为 PNG，其余保存为 JPEG"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with Image.open(source) as img:
+            # JPEG 解码时直接按比例缩小，不解码整张原图
+            img.draft('RGB', (width, max(1, img.height * width // max(1, img.width))))
+            has_alpha = img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info)
+            img = img.convert('RGBA' if has_alpha else 'RGB')
+            if img.width > width:
+                img.thumbnail((width, img.height), Image.Resampling.LANCZOS)
+            if fmt == 'webp':
+                ext, mimetype, options = '.webp', 'image/webp', {'format': 'WEBP', 'quality': 80, 'method': 4}
+            elif has_alpha:
+                ext, mimetype, options = '.png', 'image/png', {'format': 'PNG', 'optimize': True}
+            else:
+                ext, mimetype, options = '.jpg', 'image/jpeg', {'format': 'JPEG', 'quality': 85, 'optimize': True}
+            path = os.path.join(self.cache_dir, f"{key}{ext}")
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            img.save(tmp_path, **options)
+        os.replace(tmp_path, path)
+        return path, mimetype
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            total = 0
+            for entry in os.scandir(self.cache_dir):
+                if entry.name.endswith(('.jpg', '.png', '.webp')):
+                    st = entry.stat()
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+                    total += st.st_size
+            if total <= self.max_bytes:
+                return
+            for _, size, path in sorted(entries):
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                if total <= self.max_bytes:
+                    break
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
@@ -7,28 +7,45 @@ import time
 from datetime import datetime, timedelta
 import json
 import shutil
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 from generator import InvoiceGenerator, ProcessingError
-from get_ticket_data import PackingListProcessor, SimplePackingListProcessor
+from get_ticket_data import PackingListProcessor, SimplePackingListProcessor, process_workbook
+from box_specs import box_spec_catalog
+from packing_sniffer import sniff_packing_list, PackingListFormatError
+from template_manifest import TemplateManifest, TemplateUnavailableError
+from thumbnail_cache import ThumbnailCache, snap_width
+from image_cache import embed_image_cache
+from image_ingest import ImageIngest, ImageIngestError
+from image_index import image_index_for
 from STA_data import get_address_info
-from PIL import Image
-from io import BytesIO
+from product_cache import ProductTableRefresher
+from db_connector import MongoDBConnector
+from task_log import get_logger, task_context, get_task_log, task_log_buffer
+
+logger = get_logger(__name__)
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
 app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'invoice_files', 'uploads')
 app.config['OUTPUT_FOLDER'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'invoice_files', 'output')
 app.config['TEMPLATE_FOLDER'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), '表格模版')
+app.config['TEMPLATE_CACHE_FOLDER'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'invoice_files', 'templates')
 app.config['HISTORY_FILE'] = 'history.json'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 app.config['MAX_HISTORY_DAYS'] = 90  # 历史记录保留天数
 
-# 确保必要的目录存在
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
+NO_IMAGE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'no.png')
 
-# 初始化发票生成器
-invoice_generator = InvoiceGenerator(app.config['UPLOAD_FOLDER'], app.config['OUTPUT_FOLDER'])
+# 以下服务由 create_app() 创建并启动。模块顶层不能有这些副作用：并行渲染的子进程以 spawn 方式启动，
+# 会重新导入启动模块，顶层的初始化代码会在每个子进程中再启动一套服务（数据库连接、刷新器、工作线程）
+invoice_generator = None
+template_manifest = None
+product_image_index = None
+thumbnail_cache = None
+image_ingest = None
+product_table_refresher = None
 
 # 创建任务队列和状态字典
 task_queue = Queue()
@@ -55,6 +72,7 @@ def clean_old_files():
                     new_history.append(record)
                     if 'output_file' in record:
                         files_to_keep.add(record['output_file'])
+                    files_to_keep.update(record.get('output_files', []))
             except (ValueError, KeyError):
                 continue
 
@@ -79,7 +97,7 @@ def clean_old_files():
                 continue
 
     except Exception as e:
-        print(f"清理文件时发生错误: {str(e)}")
+        logger.error("清理文件时发生错误: %s", str(e))
 
 
 def load_history():
@@ -99,75 +117,146 @@ def save_history(history):
         with open(app.config['HISTORY_FILE'], 'w', encoding='utf-8') as f:
             json.dump(history, f, ensure_ascii=False, indent=2)
     except Exception as e:
-        print(f"保存历史记录时发生错误: {str(e)}")
+        logger.error("保存历史记录时发生错误: %s", str(e))
 
 
 def process_task(task_info):
     """处理任务"""
+    with task_context(task_info['task_id']):
+        _process_task(task_info)
+
+
+def _parse_key(template_type, processor_class=None):
+    """装箱单的解析方式（只有依诺达模板的简单装箱单多一列），同一种解析方式只解析一次"""
+    if processor_class is not None and processor_class is not SimplePackingListProcessor:
+        return None
+    return '依诺达' in template_type
+
+
+def _requires_code(template_type):
+    template_config = invoice_generator.template_config.get(template_type, {})
+    return template_config.get('requires_code', True)  # 默认需要编码
+
+
+def _render_template(template_type, shipments, code, address_info, products, fan_out):
+    """
+    用一个模板生成一次上传中每票货的发票
+    :param fan_out: 同一次上传生成多个模板时为 True（文件名中加模板名称区分）
+    :return: 生成的文件名列表
+    """
+    template_path = template_manifest.resolve(template_type)
+    output_files = []
+    with invoice_generator.shared_products(products):
+        for shipment in shipments:
+            # 多个模板或多票货时用模板名称、Shipment ID 区分文件名
+            parts = ([template_type] if fan_out else []) + ([shipment.shipment_id] if len(shipments) > 1 else [])
+            name_suffix = ''.join(f"-{part}" for part in parts) or None
+            output_path = invoice_generator.generate_invoice(template_path, shipment.boxes, code, address_info,
+                                                             name_suffix=name_suffix)
+            if not output_path:
+                raise ProcessingError(f"发票生成失败: {shipment.shipment_id}")
+            logger.info("发票生成成功: %s", output_path)
+            output_files.append(os.path.basename(output_path))
+    return output_files
+
+
+def _render_templates(template_types, template_shipments, code, address_info, products):
+    """
+    多个模板并行生成（共用解析好的装箱单和产品信息），单个模板失败不影响其他模板
+    :return: [{'template': 模板名称, 'files': [文件名], 'error': 错误信息或None}]
+    """
+    fan_out = len(template_types) > 1
+
+    def render(template_type):
+        template_address = address_info if _requires_code(template_type) else None
+        return _render_template(template_type, template_shipments[template_type], code, template_address,
+                                products, fan_out)
+
+    futures = {}
+    with ThreadPoolExecutor(max_workers=len(template_types), thread_name_prefix='template') as executor:
+        for template_type in template_types:
+            # 每个线程复制一份上下文，日志仍记入当前任务
+            futures[template_type] = executor.submit(contextvars.copy_context().run, render, template_type)
+
+    results = []
+    for template_type, future in futures.items():
+        try:
+            results.append({'template': template_type, 'files': future.result(), 'error': None})
+        except Exception as e:
+            logger.error("模板 %s 生成失败: %s", template_type, str(e))
+            results.append({'template': template_type, 'files': [], 'error': str(e)})
+    return results
+
+
+def _process_task(task_info):
+    """处理任务（在任务日志上下文中执行）"""
     task_id = task_info['task_id']
+    template_types = task_info.get('template_types') or [task_info.get('template_type', '')]
+    output_files = []
 
     try:
         with task_lock:
             task_status[task_id]['status'] = 'processing'
             task_status[task_id]['message'] = 'Processing started'
 
-        # 根据文件格式选择处理器并处理
-        if task_info.get('is_simple_format', False):
-            processor = SimplePackingListProcessor(task_info['files'])
-            template_type = task_info.get('template_type', '')
-            box_data = processor.process(template_name=template_type)
-        else:
-            processor = PackingListProcessor(task_info['files'])
-            box_data = processor.process()
-
-        if not box_data:
+        # 根据文件格式选择处理器，工作簿中每个工作表为一票货；多个模板共用解析结果
+        processor_class = SimplePackingListProcessor if task_info.get('is_simple_format', False) else PackingListProcessor
+        parsed = {}
+        template_shipments = {}
+        for template_type in template_types:
+            key = _parse_key(template_type, processor_class)
+            if key not in parsed:
+                parsed[key] = process_workbook(task_info['files'], processor_class, template_name=template_type)
+            template_shipments[template_type] = parsed[key]
+
+        if not all(template_shipments.values()):
             raise ProcessingError("处理装箱单失败")
 
-        # 根据模板类型决定是否需要处理编码
-        template_type = task_info.get('template_type', '')
+        # 根据模板类型决定是否需要处理编码（多个模板时地址信息只获取一次）
         code = task_info.get('code')
         address_info = None
+        requiring_code = [t for t in template_types if _requires_code(t)]
 
-        # 检查模板是否需要编码
-        template_config = invoice_generator.template_config.get(template_type, {})
-        requires_code = template_config.get('requires_code', True)  # 默认需要编码
-
-        if requires_code:
+        if requiring_code:
             if not code:
-                print(f"警告：模板 {template_type} 需要编码，但未提供编码")
+                logger.warning("模板 %s 需要编码，但未提供编码", '、'.join(requiring_code))
             else:
                 try:
                     address_info = get_address_info(code)
                     if address_info:
-                        print(f"获取到地址信息: {address_info}")
+                        logger.info("获取到地址信息", extra={'fields': {'address_info': address_info}})
                     else:
-                        print(f"未能获取到地址信息，将继续生成发票")
+                        logger.warning("未能获取到地址信息，将继续生成发票")
                 except Exception as e:
-                    print(f"获取地址信息时发生错误: {str(e)}，将继续生成发票")
+                    logger.error("获取地址信息时发生错误: %s，将继续生成发票", str(e))
                     # 记录错误但不影响发票生成
                     pass
         else:
-            print(f"模板 {template_type} 不需要编码，跳过地址信息获取")
+            logger.info("模板 %s 不需要编码，跳过地址信息获取", '、'.join(template_types))
+
+        # 产品信息只查询一次，各模板共用
+        products = invoice_generator.prefetch_products(
+            shipment.boxes for shipments in parsed.values() for shipment in shipments)
 
         # 生成发票
-        template_path = os.path.join(app.config['TEMPLATE_FOLDER'], f"{task_info['template_type']}.xlsx")
-        try:
-            output_path = invoice_generator.generate_invoice(template_path, box_data, code, address_info)
-            if output_path:
-                print(f"发票生成成功: {output_path}")
-                with task_lock:
-                    task_status[task_id]['status'] = 'completed'
-                    task_status[task_id]['message'] = 'Processing completed'
-                    task_status[task_id]['output_file'] = os.path.basename(output_path)
+        results = _render_templates(template_types, template_shipments, code, address_info, products)
+        output_files = [f for result in results for f in result['files']]
+        errors = [f"{result['template']}: {result['error']}" for result in results if result['error']]
+        with task_lock:
+            task_status[task_id]['results'] = results
+            if output_files:
+                task_status[task_id]['status'] = 'completed'
+                task_status[task_id]['message'] = 'Processing completed'
+                task_status[task_id]['output_file'] = output_files[0]
+                task_status[task_id]['output_files'] = output_files
+                if errors:
+                    task_status[task_id]['warnings'] = errors
             else:
-                raise ProcessingError("发票生成失败")
-        except Exception as e:
-            error_msg = f"处理任务时发生错误: {str(e)}"
-            print(error_msg)
-            with task_lock:
+                error_msg = f"处理任务时发生错误: {'; '.join(errors)}"
+                logger.error(error_msg)
                 task_status[task_id]['status'] = 'error'
                 task_status[task_id]['message'] = error_msg
-                task_status[task_id]['error'] = str(e)
+                task_status[task_id]['error'] = '; '.join(errors)
 
         history = load_history()
         history_record = {
@@ -175,12 +264,16 @@ def process_task(task_info):
             'type': 'packing_list',
             'timestamp': datetime.now().strftime("%Y%m%d_%H%M%S"),
             'input_file': os.path.basename(task_info['files']),
-            'output_file': os.path.basename(output_path) if 'output_file' in task_status[task_id] else None,
+            'output_file': output_files[0] if output_files else None,
             'code_input': code,
-            'template_name': task_info.get('template_type', ''),
+            'template_name': '、'.join(template_types),
             'status': task_status[task_id]['status'],
-            'result_file': os.path.basename(output_path) if 'output_file' in task_status[task_id] else None
+            'result_file': output_files[0] if output_files else None
         }
+        if len(output_files) > 1:
+            history_record['output_files'] = output_files
+        if len(template_types) > 1:
+            history_record['template_names'] = template_types
 
         # 如果获取地址信息失败，记录到历史记录中
         if code and not address_info:
@@ -191,7 +284,7 @@ def process_task(task_info):
 
     except Exception as e:
         error_msg = f"Error processing task {task_id}: {str(e)}"
-        print(error_msg)
+        logger.error(error_msg)
         with task_lock:
             task_status[task_id]['status'] = 'error'
             task_status[task_id]['message'] = error_msg
@@ -205,7 +298,7 @@ def process_task(task_info):
             'timestamp': datetime.now().strftime("%Y%m%d_%H%M%S"),
             'input_file': os.path.basename(task_info['files']),
             'code_input': task_info.get('code', ''),
-            'template_name': task_info.get('template_type', ''),
+            'template_name': '、'.join(template_types),
             'status': 'failed',
             'error': str(e)
         })
@@ -222,18 +315,58 @@ def process_worker():
 
             process_task(task_info)
         except Exception as e:
-            print(f"工作线程出错: {str(e)}")
+            logger.error("工作线程出错: %s", str(e))
         finally:
             task_queue.task_done()
 
 
-# 启动工作线程
+# 任务工作线程数量
 NUM_WORKER_THREADS = 3
 worker_threads = []
-for _ in range(NUM_WORKER_THREADS):
-    t = threading.Thread(target=process_worker, daemon=True)
-    t.start()
-    worker_threads.append(t)
+
+
+def create_app():
+    """
+    创建并启动服务：发票生成器、模板清单、图片索引、产品表刷新器和任务工作线程
+    只在服务进程中调用（重复调用直接返回已初始化的应用）
+    :return: Flask 应用
+    """
+    global invoice_generator, template_manifest, product_image_index, thumbnail_cache, image_ingest, \
+        product_table_refresher
+    if invoice_generator is not None:
+        return app
+
+    # 确保必要的目录存在
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
+
+    # 初始化发票生成器
+    invoice_generator = InvoiceGenerator(app.config['UPLOAD_FOLDER'], app.config['OUTPUT_FOLDER'],
+                                         template_folder=app.config['TEMPLATE_FOLDER'])
+    os.makedirs(invoice_generator.image_folder, exist_ok=True)
+
+    # 模板清单：识别模板格式、转换旧版 .xls、校验工作表，之后在后台预载模板
+    template_manifest = TemplateManifest(app.config['TEMPLATE_FOLDER'], app.config['TEMPLATE_CACHE_FOLDER'],
+                                         invoice_generator.template_sheet, invoice_generator.template_cache).build()
+    threading.Thread(target=template_manifest.warm, daemon=True).start()
+
+    # 产品图片目录索引：启动时扫描一次，之后按 MSKU 查找图片不再访问文件系统
+    product_image_index = image_index_for(invoice_generator.image_folder).scan()
+    # 产品图片缩略图缓存（MSKU 编辑页）
+    thumbnail_cache = ThumbnailCache(invoice_generator.image_folder, image_index=product_image_index)
+    # 产品图片入库：上传时标准化主图，并在后台预先生成缩略图和发票插图
+    image_ingest = ImageIngest(invoice_generator.image_folder, thumbnail_cache, embed_image_cache,
+                               image_index=product_image_index)
+
+    # 产品共享表刷新器（同一台机器上只有一个进程会真正执行刷新，使用独立的数据库连接）
+    product_table_refresher = ProductTableRefresher(MongoDBConnector(), invoice_generator.product_table.path).start()
+
+    # 启动工作线程
+    for _ in range(NUM_WORKER_THREADS):
+        t = threading.Thread(target=process_worker, daemon=True)
+        t.start()
+        worker_threads.append(t)
+    return app
 
 
 @app.route('/')
@@ -298,24 +431,29 @@ def download_file(filename):
 def upload():
     """处理文件上传"""
     try:
-        print("\n=== 开始处理上传请求 ===")
-        print(f"请求表单数据: {request.form}")
-        print(f"请求文件: {request.files}")
+        # 获取模板类型（可以选择多个模板，同一票货一次生成多份发票）
+        template_types = list(dict.fromkeys(t for t in request.form.getlist('template_type') if t))
+        if not template_types:
+            template_types = ['dingdang']  # 默认使用叮铛模板
+        template_type = template_types[0]
 
-        # 获取模板类型
-        template_type = request.form.get('template_type', 'dingdang')  # 默认使用叮铛模板
-        print(f"模板类型: {template_type}")
+        # 不可用的模板（不存在、格式无法识别、缺少工作表）直接拒绝，不再等到任务执行时才失败
+        try:
+            for name in template_types:
+                template_manifest.resolve(name)
+        except TemplateUnavailableError as e:
+            logger.warning("模板不可用: %s", str(e))
+            return jsonify({'error': str(e)}), 400
 
         # 获取编码（可选）
         code = request.form.get('code', '')
-        print(f"编码: {code}")
 
         # 检查是否有文件上传
         packing_list = request.files.get('packing_list')
         invoice_info = request.files.get('invoice_info')
 
         if not packing_list and not invoice_info:
-            print("错误：没有上传任何文件")
+            logger.warning("没有上传任何文件")
             return jsonify({'error': '请至少上传一个文件'}), 400
 
         # 确保上传目录存在
@@ -345,9 +483,25 @@ def upload():
             invoice_info.save(file_path)
             is_simple_format = True
 
+        # 入队前只读前几行识别格式并校验结构，格式错误的文件直接拒绝，不占用工作线程
+        # （每种解析方式校验一次）
+        try:
+            sniff_templates = {}
+            for name in template_types:
+                sniff_templates.setdefault(_parse_key(name), name)
+            for name in sniff_templates.values():
+                sniffed = sniff_packing_list(file_path, name)
+        except PackingListFormatError as e:
+            logger.warning("装箱单格式校验失败: %s", str(e))
+            if file_path and os.path.exists(file_path):
+                os.remove(file_path)
+            return jsonify({'error': f'装箱单格式不正确: {str(e)}'}), 400
+        if sniffed.is_simple_format != is_simple_format:
+            logger.info("按文件内容识别为%s装箱单", '简单' if sniffed.is_simple_format else '领星')
+            is_simple_format = sniffed.is_simple_format
+
         # 生成任务ID
         task_id = datetime.now().strftime("%Y%m%d%H%M%S")
-        print(f"任务ID: {task_id}")
 
         # 创建任务信息
         task_info = {
@@ -356,9 +510,9 @@ def upload():
             'files': file_path,
             'code': code,
             'template_type': template_type,
+            'template_types': template_types,
             'is_simple_format': is_simple_format
         }
-        print(f"任务信息: {task_info}")
 
         # 初始化任务状态
         with task_lock:
@@ -369,21 +523,33 @@ def upload():
 
         # 将任务添加到队列
         task_queue.put(task_info)
-        print(f"任务已添加到队列")
-        print("=== 上传处理完成 ===\n")
+        logger.info("任务已添加到队列", extra={'task_id': task_id, 'fields': {
+            'template_type': template_types, 'code': code, 'file': os.path.basename(file_path or ''),
+            'is_simple_format': is_simple_format, 'shipment_id': sniffed.shipment_id,
+            'skipped_sheets': dict(sniffed.sheet_errors)}})
 
-        return jsonify({
+        response = {
             'success': True,
             'message': '文件已上传，正在处理中',
             'task_id': task_id
-        })
+        }
+        if sniffed.sheet_errors:
+            # 多工作表的装箱单中不可用的工作表会被跳过
+            response['skipped_sheets'] = [{'sheet': name, 'error': error} for name, error in sniffed.sheet_errors]
+        return jsonify(response)
 
     except Exception as e:
         error_msg = f"处理上传请求时出错: {str(e)}"
-        print(error_msg)
+        logger.error(error_msg)
         return jsonify({'error': error_msg}), 500
 
 
+@app.route('/api/templates', methods=['GET'])
+def get_templates():
+    """模板清单"""
+    return jsonify(template_manifest.to_list())
+
+
 @app.route('/api/generate_invoice', methods=['POST'])
 def generate_invoice():
     try:
@@ -448,12 +614,24 @@ def get_status(task_id):
                     'message': '处理失败'
                 })
 
-            # 如果任务完成，返回文件下载链接
-            return jsonify({
+            # 如果任务完成，返回文件下载链接（一个工作簿包含多票货时有多个文件）
+            output_files = task.get('output_files') or [output_file]
+            response = {
                 'status': 'completed',
                 'download_url': f'/download/{os.path.basename(output_file)}',
+                'download_urls': [f'/download/{os.path.basename(f)}' for f in output_files],
                 'message': '处理完成'
-            })
+            }
+            # 多个模板时按模板列出结果，部分模板失败时附带错误信息
+            if len(task.get('results') or []) > 1:
+                response['results'] = [{
+                    'template': result['template'],
+                    'download_urls': [f'/download/{os.path.basename(f)}' for f in result['files']],
+                    'error': result['error'],
+                } for result in task['results']]
+            if task.get('warnings'):
+                response['warnings'] = task['warnings']
+            return jsonify(response)
         elif task['status'] in ['failed', 'error']:
             return jsonify({
                 'status': 'failed',
@@ -474,6 +652,19 @@ def get_status(task_id):
             })
 
 
+@app.route('/status/<task_id>/log')
+def get_task_log_view(task_id):
+    """获取任务的结构化日志（内存环形缓冲区，可用 ?level=WARNING 过滤）"""
+    with task_lock:
+        known = task_id in task_status
+    if not known and not task_log_buffer.has_task(task_id):
+        return jsonify({'error': '任务不存在'}), 404
+    return jsonify({
+        'task_id': task_id,
+        'entries': get_task_log(task_id, request.args.get('level'))
+    })
+
+
 @app.route('/api/get_msku_info/', methods=['POST'])
 def get_msku_info():
     try:
@@ -485,11 +676,11 @@ def get_msku_info():
             products = collection.find(filters).sort('_id',-1).skip((page - 1) * page_size).limit(page_size)
             results = []
             for i in products:
-                results.append({
-                    field[0]: i.get(field[0], None) for field in FIELDS
-                })
+                result = {field[0]: i.get(field[0], None) for field in FIELDS}
+                # 图片版本号，图片地址带上后浏览器可以长期缓存
+                result['image_version'] = thumbnail_cache.version(i.get('msku'))
+                results.append(result)
             count = collection.count_documents(filters)
-            print(count)
         return jsonify(status='success', data=results, total=count)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -505,60 +696,103 @@ def save_msku_info():
                 "msku": data.get("msku")},
                 {'$set': data},
                 upsert=True)
+        product_table_refresher.request_refresh()
+        return jsonify(status='success')
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/box_specs/', methods=['GET'])
+def get_box_specs():
+    """获取当前生效的箱规目录"""
+    return jsonify(status='success', data=box_spec_catalog.all(), version=box_spec_catalog.version)
+
+
+@app.route('/api/save_box_spec/', methods=['POST'])
+def save_box_spec():
+    """新增或修改箱规：{name, aliases, length, width, height, weight}"""
+    try:
+        data = request.json or {}
+        name = str(data.get('name', '')).strip()
+        if not name:
+            return jsonify({'error': '箱规名称不能为空'}), 400
+        spec = {'name': name, 'aliases': [str(a).strip() for a in data.get('aliases') or [] if str(a).strip()]}
+        for field in ('length', 'width', 'height', 'weight'):
+            spec[field] = float(data[field])
+        if 'disabled' in data:
+            spec['disabled'] = bool(data['disabled'])
+        with MongoDBConnector() as db:
+            collection = db['box_specs']
+            if collection.count_documents({'name': name}) == 0:
+                spec['order'] = collection.count_documents({})
+            collection.update_one({'name': name}, {'$set': spec}, upsert=True)
+        box_spec_catalog.invalidate()
         return jsonify(status='success')
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'error': f'箱规数据不正确: {str(e)}'}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+
 @app.route('/api/images/<string:msku>', methods=['GET'])
 def show_image(msku):
+    """
+    产品图片缩略图（带版本号 ?v= 请求时允许浏览器长期缓存，否则每次用 ETag 校验）
+    ?w= 指定宽度（取到 WIDTH_LADDER 中的一档）；浏览器声明支持 WebP 时返回 WebP，否则返回 JPEG
+    """
+    width = snap_width(request.args.get('w', type=int))
+    # 只看明确列出的 image/webp，*/* 不代表浏览器能解码 WebP
+    accepts_webp = any(value == 'image/webp' and quality > 0 for value, quality in request.accept_mimetypes)
+    thumbnail = None
     try:
-        image_path_jpg = os.path.join(invoice_generator.image_folder, f"{msku}.jpg")
-        image_path_png = os.path.join(invoice_generator.image_folder, f"{msku}.png")
-        if os.path.exists(image_path_jpg):
-            file_min = Image.open(image_path_jpg)
-
-        elif os.path.exists(image_path_png):
-            file_min = Image.open(image_path_jpg)
-        else:
-            image_data = open("static/no.png", "rb").read()
-            response = make_response(image_data)
-            response.headers['Content-Type'] = 'image/jpg'
-            return response
-        # 获取原图尺寸
-        w, h = file_min.size
-        # 计算压缩比
-        bili = int(w / 300)
-        if bili == 0:
-            bili = 1
-        # 按比例对宽高压缩
-        file_min.thumbnail((w // bili, h // bili))
-        bytesIO = BytesIO()
-        file_min.save(bytesIO, format='PNG')
-        response = make_response(bytesIO.getvalue())
-        response.headers['Content-Type'] = 'image/jpg'
-        return response
+        thumbnail = thumbnail_cache.get(msku, width, 'webp' if accepts_webp else 'jpeg')
     except Exception as e:
-        image_data = open("static/no.png", "rb").read()
-        response = make_response(image_data)
-        response.headers['Content-Type'] = 'image/jpg'
+        logger.warning("生成缩略图失败 %s: %s", msku, str(e))
+    if thumbnail is None:
+        response = send_file(NO_IMAGE_PATH, mimetype='image/png')
+        response.headers['Cache-Control'] = 'no-cache'
         return response
 
+    response = send_file(thumbnail.path, mimetype=thumbnail.mimetype, etag=thumbnail.etag,
+                         last_modified=thumbnail.last_modified, conditional=True)
+    if request.args.get('v') == thumbnail.version:
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        response.headers['Cache-Control'] = 'no-cache'
+    response.headers['Vary'] = 'Accept'
+    return response
+
+
 @app.route('/api/upload/', methods=['POST'])
 def upload_image():
     if 'file' not in request.files:
-        print("no file")
+        logger.warning("no file")
+        return jsonify({'error': '没有上传文件'}), 400
     file = request.files['file']
-    msku = request.form['msku']
-    filename = f"{msku}.jpg"
-    file.save(os.path.join(invoice_generator.image_folder, filename))
-    return {"code": 200, "name": filename,
-            "url": f"/api/images/{msku}"}, 200
+    msku = request.form.get('msku', '')
+    try:
+        result = image_ingest.ingest(msku, file.read())
+    except ImageIngestError as e:
+        return jsonify({'error': str(e)}), 400
+    return {"code": 200, "name": os.path.basename(result['path']),
+            "url": f"/api/images/{msku}?v={thumbnail_cache.version(msku) or ''}"}, 200
     # return {"code": 200, "name": filename,
     #         "url": f"https://em-erp-1252538772.cos.ap-nanjing.myqcloud.com/{filename}"},  200
 
 
+@app.route('/api/upload/zip', methods=['POST'])
+def upload_image_zip():
+    """批量导入产品图片：zip 中的图片按文件名（MSKU）入库"""
+    if 'file' not in request.files:
+        return jsonify({'error': '没有上传文件'}), 400
+    try:
+        imported, failed = image_ingest.ingest_zip(request.files['file'].stream)
+    except ImageIngestError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'code': 200, 'imported': [item['msku'] for item in imported], 'failed': failed})
+
+
 if __name__ == '__main__':
-    os.makedirs(invoice_generator.image_folder,exist_ok=True)
+    create_app()
     FIELDS = [
         ["msku", 0],  # sku必有
         ["productNameZh", 1],
@@ -0,0 +1,72 @@
+"""
+工作簿保存
+openpyxl 保存时每张插入的图片都写成一个独立的 media 部件：同一个 MSKU 分布在 40 个箱子里，
+输出文件中就有 40 份相同的图片。这里按图片内容去重，内容相同的图片只写一个 media 部件，
+各个绘图锚点的关系都指向它，输出文件大小和保存时间只与不同产品的数量有关。
+"""
+import datetime
+import hashlib
+from zipfile import ZipFile, ZIP_DEFLATED
+
+from openpyxl.packaging.relationship import get_rels_path
+from openpyxl.writer.excel import ExcelWriter
+from openpyxl.xml.functions import tostring
+
+
+def media_key(image_format, data):
+    """图片内容的去重键"""
+    return image_format, hashlib.sha1(data).digest()
+
+
+class SharedMediaWriter(ExcelWriter):
+    """内容相同的图片共用一个 media 部件的 ExcelWriter"""
+
+    def __init__(self, workbook, archive):
+        super().__init__(workbook, archive)
+        # 图片内容 -> media 编号
+        self._media_ids = {}
+        # media 编号 -> 图片字节
+        self._media_data = {}
+
+    def _write_drawing(self, drawing):
+        """与 ExcelWriter._write_drawing 相同，只是图片按内容分配 media 编号"""
+        self._drawings.append(drawing)
+        drawing._id = len(self._drawings)
+        for chart in drawing.charts:
+            self._charts.append(chart)
+            chart._id = len(self._charts)
+        for img in drawing.images:
+            img._id = self._media_id(img)
+        rels_path = get_rels_path(drawing.path)[1:]
+        self._archive.writestr(drawing.path[1:], tostring(drawing._write()))
+        self._archive.writestr(rels_path, tostring(drawing._write_rels()))
+        self.manifest.append(drawing)
+
+    def _media_id(self, img):
+        data = img._data()
+        key = media_key(img.format, data)
+        media_id = self._media_ids.get(key)
+        if media_id is None:
+            self._images.append(img)
+            media_id = self._media_ids[key] = len(self._images)
+            self._media_data[media_id] = data
+        return media_id
+
+    def _write_images(self):
+        for img in self._images:
+            self._archive.writestr(img.path[1:], self._media_data[img._id])
+
+
+def save_workbook(workbook, filename):
+    """
+    保存工作簿（代替 Workbook.save，相同的图片只保存一份）
+    :param workbook: openpyxl Workbook（普通或只写模式）
+    :param filename: 输出文件路径
+    """
+    if workbook.read_only:
+        raise TypeError("只读工作簿不能保存")
+    if workbook.write_only and not workbook.worksheets:
+        workbook.create_sheet()
+    with ZipFile(filename, 'w', ZIP_DEFLATED, allowZip64=True) as archive:
+        workbook.properties.modified = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        SharedMediaWriter(workbook, archive).save()
@@ -0,0 +1,713 @@
+"""
+XLSX 直接改写填充
+数据区是简单重复行的模板不需要完整走一遍 openpyxl 的 加载 → 填充 → 保存：
+模板 .xlsx 按 zip 包读取，只改写目标工作表的 sheetData / mergeCells / drawing 以及需要追加样式的 styles.xml，
+数据行直接生成行 XML，其他部件（共享字符串、主题、页面设置、自定义属性等）原样复制。
+
+- 模板包按文件路径缓存，工作表只解析一次；每次填充在副本上修改
+- 新写入的字符串使用内联字符串，不改动 sharedStrings.xml
+- 命名样式（cell_styles）与单元格原有样式组合后追加到 styles.xml，每种组合只追加一次
+- 产品图片通过 openpyxl 的绘图对象序列化后写入新的 drawing 部件
+- 遇到不支持的模板结构时抛出 XlsxPatchError，由调用方改用 openpyxl 填充
+"""
+import os
+import re
+import posixpath
+import threading
+import zipfile
+from collections import OrderedDict
+from datetime import date, datetime, time
+from decimal import Decimal
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from openpyxl.compat import safe_string
+from openpyxl.drawing.spreadsheet_drawing import SpreadsheetDrawing
+from openpyxl.styles import Alignment, Protection
+from openpyxl.utils import column_index_from_string, get_column_letter
+from openpyxl.utils.cell import coordinate_from_string
+from openpyxl.utils.datetime import to_excel
+from openpyxl.worksheet.cell_range import CellRange, MultiCellRange
+from openpyxl.xml.functions import tostring
+
+from task_log import get_logger
+from workbook_writer import media_key
+
+logger = get_logger(__name__)
+
+SHEET_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+REL_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+PKG_REL_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+DRAWING_REL = f'{REL_NS}/drawing'
+CALC_CHAIN_REL = f'{REL_NS}/calcChain'
+DRAWING_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.drawing+xml'
+IMAGE_CONTENT_TYPES = {'png': 'image/png', 'jpeg': 'image/jpeg', 'gif': 'image/gif'}
+
+# 内置日期格式（m/d/yy 与 m/d/yy h:mm）
+_DATE_FORMAT_ID = 14
+_DATETIME_FORMAT_ID = 22
+
+_SHEET_DATA_RE = re.compile(r'<sheetData\s*/>|<sheetData>(.*?)</sheetData>', re.S)
+_ROW_RE = re.compile(r'<row\b([^>]*?)(?:/>|>(.*?)</row>)', re.S)
+_CELL_RE = re.compile(r'<c\b([^>]*?)(?:/>|>(.*?)</c>)', re.S)
+_ATTR_RE = re.compile(r'([\w:]+)="([^"]*)"')
+_COLS_RE = re.compile(r'<col\b([^>]*?)/>')
+_DIMENSION_RE = re.compile(r'<dimension\b[^>]*?/>')
+_MERGE_CELLS_RE = re.compile(r'<mergeCells\b[^>]*?(?:/>|>.*?</mergeCells>)', re.S)
+_MERGE_REF_RE = re.compile(r'<mergeCell\b[^>]*?ref="([^"]+)"')
+_DRAWING_RE = re.compile(r'<drawing\b[^>]*?/>')
+# CT_Worksheet 中排在 mergeCells / drawing 之后的元素（新元素插入到第一个出现的元素之前）
+_AFTER_MERGE_CELLS = re.compile(
+    r'<(?:phoneticPr|conditionalFormatting|dataValidations|hyperlinks|printOptions|pageMargins|pageSetup|'
+    r'headerFooter|rowBreaks|colBreaks|customProperties|cellWatches|ignoredErrors|smartTags|drawing|'
+    r'legacyDrawing|legacyDrawingHF|drawingHF|picture|oleObjects|controls|webPublishItems|tableParts|extLst)\b')
+_AFTER_DRAWING = re.compile(
+    r'<(?:legacyDrawing|legacyDrawingHF|drawingHF|picture|oleObjects|controls|webPublishItems|tableParts|extLst)\b')
+
+
+class XlsxPatchError(Exception):
+    """模板结构不支持直接改写"""
+    pass
+
+
+def _attrs(text):
+    return dict(_ATTR_RE.findall(text))
+
+
+def _format_attrs(attrs):
+    return ''.join(f' {name}="{value}"' for name, value in attrs.items())
+
+
+def _resolve(base_dir, target):
+    """关系文件中的目标路径 -> zip 内路径"""
+    if target.startswith('/'):
+        return target[1:]
+    return posixpath.normpath(posixpath.join(base_dir, target))
+
+
+def _rels_path(part):
+    directory, name = posixpath.split(part)
+    return posixpath.join(directory, '_rels', f'{name}.rels')
+
+
+def _read_rels(parts, part):
+    """读取部件的关系 {Id: (Type, zip 内路径)}"""
+    data = parts.get(_rels_path(part))
+    if data is None:
+        return {}
+    base_dir = posixpath.dirname(part)
+    rels = {}
+    for rel in ElementTree.fromstring(data):
+        if rel.get('TargetMode') == 'External':
+            continue
+        rels[rel.get('Id')] = (rel.get('Type'), _resolve(base_dir, rel.get('Target')))
+    return rels
+
+
+class _Cell:
+    """模板中的一个单元格（s: 样式索引，attrs: r/s 以外的属性，inner: 原始子元素）"""
+
+    __slots__ = ('s', 'attrs', 'inner')
+
+    def __init__(self, s=0, attrs='', inner=None):
+        self.s = s
+        self.attrs = attrs
+        self.inner = inner
+
+    def render(self, coord):
+        style = f' s="{self.s}"' if self.s else ''
+        if self.inner is None:
+            return f'<c r="{coord}"{style}{self.attrs}/>'
+        return f'<c r="{coord}"{style}{self.attrs}>{self.inner}</c>'
+
+
+class _SheetTemplate:
+    """解析后的模板工作表（只读，多次填充共用）"""
+
+    def __init__(self, name, part, xml):
+        self.name = name
+        self.part = part
+        match = _SHEET_DATA_RE.search(xml)
+        if match is None:
+            raise XlsxPatchError(f"工作表 {name} 中没有找到 sheetData")
+        self.head = xml[:match.start()]
+        self.tail = xml[match.end():]
+        self.rows = {}
+        self.cells = {}
+        for row_match in _ROW_RE.finditer(match.group(1) or ''):
+            attrs = _attrs(row_match.group(1))
+            if 'r' not in attrs:
+                raise XlsxPatchError(f"工作表 {name} 的行缺少行号")
+            row = int(attrs.pop('r'))
+            attrs.pop('spans', None)
+            self.rows[row] = attrs
+            for cell_match in _CELL_RE.finditer(row_match.group(2) or ''):
+                cell_attrs = _attrs(cell_match.group(1))
+                coord = cell_attrs.pop('r', None)
+                if coord is None:
+                    raise XlsxPatchError(f"工作表 {name} 的单元格缺少地址")
+                column, _ = coordinate_from_string(coord)
+                s = int(cell_attrs.pop('s', 0))
+                self.cells[(row, column_index_from_string(column))] = _Cell(
+                    s, _format_attrs(cell_attrs), cell_match.group(2))
+
+        self.merged = [CellRange(ref) for ref in _MERGE_REF_RE.findall(self.tail)]
+        self.has_drawing = _DRAWING_RE.search(self.tail) is not None
+
+        # 列宽（用于计算图片大小），未设置的列使用 openpyxl 的默认列宽
+        self.widths = {}
+        for col_match in _COLS_RE.finditer(self.head):
+            attrs = _attrs(col_match.group(1))
+            if 'width' in attrs:
+                for col in range(int(attrs['min']), min(int(attrs['max']), 256) + 1):
+                    self.widths[col] = float(attrs['width'])
+
+
+class XlsxTemplate:
+    """按 zip 包读取的模板文件"""
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            with zipfile.ZipFile(path) as zf:
+                self.parts = OrderedDict((info.filename, zf.read(info)) for info in zf.infolist()
+                                         if not info.is_dir())
+            self.sheet_parts = self._sheet_parts()
+        except XlsxPatchError:
+            raise
+        except Exception as e:
+            raise XlsxPatchError(f"无法读取模板 {os.path.basename(path)}: {str(e)}")
+        self._sheets = {}
+        self._lock = threading.Lock()
+
+    def _sheet_parts(self):
+        workbook_part = 'xl/workbook.xml'
+        for rel in ElementTree.fromstring(self.parts['_rels/.rels']):
+            if rel.get('Type', '').endswith('/officeDocument'):
+                workbook_part = _resolve('', rel.get('Target'))
+        rels = _read_rels(self.parts, workbook_part)
+        sheets = {}
+        for sheet in ElementTree.fromstring(self.parts[workbook_part]).iter(f'{{{SHEET_NS}}}sheet'):
+            rel = rels.get(sheet.get(f'{{{REL_NS}}}id'))
+            if rel is not None:
+                sheets[sheet.get('name')] = rel[1]
+        self.workbook_part = workbook_part
+        return sheets
+
+    def sheet(self, name) -> _SheetTemplate:
+        """解析后的工作表（首次使用时解析）"""
+        with self._lock:
+            sheet = self._sheets.get(name)
+            if sheet is None:
+                part = self.sheet_parts.get(name)
+                if part is None:
+                    raise XlsxPatchError(f"模板中没有工作表: {name}")
+                try:
+                    xml = self.parts[part].decode('utf-8')
+                except Exception as e:
+                    raise XlsxPatchError(f"无法读取工作表 {name}: {str(e)}")
+                sheet = self._sheets[name] = _SheetTemplate(name, part, xml)
+            return sheet
+
+
+class _Dimension:
+    __slots__ = ('width', 'height')
+
+    def __init__(self, width=None, height=None):
+        self.width = width
+        self.height = height
+
+
+class _ColumnDimensions:
+    """按列字母读取列宽（与 openpyxl 的 column_dimensions 用法一致）"""
+
+    def __init__(self, widths):
+        self._widths = widths
+
+    def __getitem__(self, letter):
+        return _Dimension(width=self._widths.get(column_index_from_string(letter), 13))
+
+
+class _RowDimensions:
+    """按行号读取行高（与 openpyxl 的 row_dimensions 用法一致）"""
+
+    def __init__(self, sheet):
+        self._sheet = sheet
+
+    def __getitem__(self, row):
+        return _Dimension(height=self._sheet.row_height(row))
+
+
+class _StyleSheet:
+    """styles.xml：读取已有的单元格格式，追加命名样式组合出的新格式"""
+
+    def __init__(self, xml: bytes, registry):
+        self.xml = xml.decode('utf-8')
+        self.registry = registry
+        root = ElementTree.fromstring(xml)
+        counts = {}
+        for tag in ('fonts', 'borders', 'cellXfs'):
+            element = root.find(f'{{{SHEET_NS}}}{tag}')
+            if element is None or f'</{tag}>' not in self.xml:
+                raise XlsxPatchError(f"styles.xml 中没有 {tag}")
+            counts[tag] = len(element)
+        self._counts = counts
+        self._xfs = [self._read_xf(xf) for xf in root.find(f'{{{SHEET_NS}}}cellXfs')]
+        self._added = {'fonts': [], 'borders': [], 'cellXfs': []}
+        self._ids = {'fonts': {}, 'borders': {}}
+        self._composed = {}
+
+    @staticmethod
+    def _read_xf(element):
+        attrs = dict(element.attrib)
+        alignment = element.find(f'{{{SHEET_NS}}}alignment')
+        protection = element.find(f'{{{SHEET_NS}}}protection')
+        return (attrs,
+                Alignment.from_tree(alignment) if alignment is not None else None,
+                Protection.from_tree(protection) if protection is not None else None)
+
+    def _add(self, table, obj):
+        ids = self._ids[table]
+        if obj not in ids:
+            ids[obj] = self._counts[table] + len(self._added[table])
+            self._added[table].append(tostring(obj.to_tree()).decode('utf-8'))
+        return ids[obj]
+
+    def _add_xf(self, attrs, alignment, protection):
+        xf_id = len(self._xfs)
+        self._xfs.append((attrs, alignment, protection))
+        children = ''.join(tostring(child.to_tree()).decode('utf-8')
+                           for child in (alignment, protection) if child is not None)
+        if alignment is not None:
+            attrs['applyAlignment'] = '1'
+        self._added['cellXfs'].append(
+            f'<xf{_format_attrs(attrs)}>{children}</xf>' if children else f'<xf{_format_attrs(attrs)}/>')
+        return xf_id
+
+    def compose(self, base, name):
+        """
+        在单元格原有格式上叠加命名样式
+        :param base: 原有格式索引
+        :param name: 命名样式
+        :return: 新格式索引
+        """
+        key = (base, name)
+        xf_id = self._composed.get(key)
+        if xf_id is None:
+            try:
+                style = self.registry.styles[name]
+            except KeyError:
+                raise XlsxPatchError(f"未定义的样式: {name}")
+            attrs, alignment, protection = self._xfs[base]
+            attrs = dict(attrs)
+            if 'font' in style:
+                attrs['fontId'] = str(self._add('fonts', style['font']))
+                attrs['applyFont'] = '1'
+            if 'border' in style:
+                attrs['borderId'] = str(self._add('borders', style['border']))
+                attrs['applyBorder'] = '1'
+            if 'alignment' in style:
+                alignment = style['alignment']
+            xf_id = self._composed[key] = self._add_xf(attrs, alignment, protection)
+        return xf_id
+
+    def with_number_format(self, base, number_format_id):
+        """在原有格式上设置内置数字格式（写入日期时使用）"""
+        key = (base, number_format_id)
+        xf_id = self._composed.get(key)
+        if xf_id is None:
+            attrs, alignment, protection = self._xfs[base]
+            attrs = dict(attrs, numFmtId=str(number_format_id), applyNumberFormat='1')
+            xf_id = self._composed[key] = self._add_xf(attrs, alignment, protection)
+        return xf_id
+
+    def render(self) -> bytes:
+        xml = self.xml
+        for tag, added in self._added.items():
+            if not added:
+                continue
+            count = self._counts[tag] + len(added)
+            xml = re.sub(rf'<{tag}\b[^>]*?>', lambda m: re.sub(r'\bcount="\d+"', f'count="{count}"', m.group(0)),
+                         xml, count=1)
+            end = xml.index(f'</{tag}>')
+            xml = xml[:end] + ''.join(added) + xml[end:]
+        return xml.encode('utf-8')
+
+
+def _cell_value(value):
+    """Python 值 -> (t 属性, 子元素, 日期格式)"""
+    if value is None or value == '':
+        return None, None, None
+    if isinstance(value, bool):
+        return 'b', f'<v>{int(value)}</v>', None
+    if isinstance(value, (int, float, Decimal)):
+        return None, f'<v>{safe_string(value)}</v>', None
+    if isinstance(value, (datetime, date, time)):
+        number_format = _DATETIME_FORMAT_ID if isinstance(value, datetime) else _DATE_FORMAT_ID
+        return None, f'<v>{to_excel(value)}</v>', number_format
+    text = str(value)
+    if ILLEGAL_CHARACTERS_RE.search(text):
+        raise XlsxPatchError(f"单元格内容包含非法字符: {text!r}")
+    space = ' xml:space="preserve"' if text != text.strip() or '\n' in text else ''
+    return 'inlineStr', f'<is><t{space}>{escape(text)}</t></is>', None
+
+
+class _CellStore:
+    """按 (行, 列) 保存单元格、按行保存行属性，写入值和样式时组合出新的单元格格式"""
+
+    def __init__(self, cells, rows, stylesheet):
+        self._cells = cells
+        self._rows = rows
+        self.stylesheet = stylesheet
+
+    @staticmethod
+    def _shared_formula(cell):
+        return cell.inner is not None and '<f' in cell.inner and 't="shared"' in cell.inner
+
+    def set_value(self, row, col, value, style=None):
+        """写入单元格的值（可同时叠加命名样式）"""
+        cell = self._cells.get((row, col))
+        if cell is not None and self._shared_formula(cell):
+            raise XlsxPatchError(f"{get_column_letter(col)}{row} 是共享公式单元格")
+        s = cell.s if cell is not None else 0
+        t, inner, number_format = _cell_value(value)
+        if number_format is not None:
+            s = self.stylesheet.with_number_format(s, number_format)
+        if style:
+            s = self.stylesheet.compose(s, style)
+        self._cells[(row, col)] = _Cell(s, f' t="{t}"' if t else '', inner)
+        self._rows.setdefault(row, {})
+
+    def apply_style(self, row, col, style):
+        """给单元格叠加命名样式，保留原有的值"""
+        cell = self._cells.get((row, col))
+        if cell is None:
+            self._cells[(row, col)] = _Cell(self.stylesheet.compose(0, style))
+            self._rows.setdefault(row, {})
+        else:
+            self._cells[(row, col)] = _Cell(self.stylesheet.compose(cell.s, style), cell.attrs, cell.inner)
+
+    def write_row(self, row, values, columns, style):
+        """
+        写入一个数据行
+        :param values: [(col, value), ...]
+        :param columns: 需要设置样式的列
+        :param style: 命名样式
+        """
+        for col, value in values:
+            self.set_value(row, col, value)
+        for col in columns:
+            self.apply_style(row, col, style)
+
+    def set_row_height(self, row, height):
+        attrs = self._rows.setdefault(row, {})
+        attrs['ht'] = f'{height:g}' if isinstance(height, float) else str(height)
+        attrs['customHeight'] = '1'
+
+    def row_height(self, row):
+        ht = self._rows.get(row, {}).get('ht')
+        return float(ht) if ht is not None else None
+
+    def format_merged(self, ranges):
+        """
+        新合并的区域：左上角单元格居中，其余单元格清空值（与 openpyxl 合并单元格的效果一致）
+        :param ranges: 新合并的区域
+        """
+        for merged_range in ranges:
+            coords = merged_range.cells
+            self.apply_style(*next(coords), 'center')
+            for coord in coords:
+                cell = self._cells.get(coord)
+                if cell is not None and cell.inner is not None:
+                    self._cells[coord] = _Cell(cell.s)
+
+    def _render_rows(self):
+        """
+        生成行 XML
+        :return: ([(行号, 行 XML), ...], 最大列号)
+        """
+        by_row = {}
+        for (row, col) in sorted(self._cells):
+            by_row.setdefault(row, []).append(col)
+
+        parts = []
+        max_col = 0
+        for row in sorted(set(self._rows) | set(by_row)):
+            attrs = _format_attrs(self._rows.get(row, {}))
+            cols = by_row.get(row)
+            if not cols:
+                parts.append((row, f'<row r="{row}"{attrs}/>'))
+                continue
+            max_col = max(max_col, cols[-1])
+            cells = ''.join(self._cells[(row, col)].render(f'{get_column_letter(col)}{row}') for col in cols)
+            parts.append((row, f'<row r="{row}"{attrs}>{cells}</row>'))
+        return parts, max_col
+
+
+class _ChunkStyles:
+    """子进程中使用的单元格格式：只能使用主进程预先组合好的格式"""
+
+    def __init__(self, composed):
+        """
+        :param composed: {(原有格式索引, 命名样式): 新格式索引}
+        """
+        self.composed = composed
+
+    def compose(self, base, name):
+        try:
+            return self.composed[(base, name)]
+        except KeyError:
+            raise XlsxPatchError(f"格式 {base} + {name} 未预先组合")
+
+    def with_number_format(self, base, number_format_id):
+        raise XlsxPatchError("并行渲染的数据行不支持日期单元格")
+
+
+class RowChunk(_CellStore):
+    """
+    一段连续的数据行，可以在子进程中生成行 XML 后交给 SheetPatch.add_rendered_rows 拼接
+    """
+
+    def __init__(self, cells, rows, composed):
+        """
+        :param cells: 这些行中原有的模板单元格（SheetPatch.rows_in）
+        :param rows: 这些行原有的行属性
+        :param composed: 预先组合好的单元格格式 {(原有格式索引, 命名样式): 新格式索引}
+        """
+        super().__init__(dict(cells), {row: dict(attrs) for row, attrs in rows.items()}, _ChunkStyles(composed))
+
+    def render(self):
+        """
+        :return: (行 XML, 最大列号, {行号: 行高})
+        """
+        parts, max_col = self._render_rows()
+        heights = {row: self.row_height(row) for row in self._rows if 'ht' in self._rows[row]}
+        return ''.join(xml for _, xml in parts), max_col, heights
+
+
+class SheetPatch(_CellStore):
+    """
+    对一个模板工作表的修改
+    _cells / merged_cells 的结构与 openpyxl 工作表一致，可以直接交给 MergedRangeIndex 解除/登记合并区域；
+    column_dimensions / row_dimensions / add_image 供 InvoiceGenerator.insert_product_image 插入图片
+    """
+
+    def __init__(self, template: _SheetTemplate, stylesheet: _StyleSheet):
+        super().__init__(dict(template.cells), {row: dict(attrs) for row, attrs in template.rows.items()},
+                         stylesheet)
+        self.template = template
+        self.title = template.name
+        self.merged_cells = MultiCellRange()
+        self.merged_cells.ranges = set(template.merged)
+        self.column_dimensions = _ColumnDimensions(template.widths)
+        self.row_dimensions = _RowDimensions(self)
+        self.images = []
+        # 已在其他进程中生成 XML 的行段 [(首行, 末行, 行 XML)]
+        self._rendered = []
+        self._rendered_heights = {}
+        self._rendered_max_col = 0
+
+    @property
+    def has_drawing(self):
+        return self.template.has_drawing
+
+    def rows_in(self, first_row, last_row):
+        """
+        指定行范围内的单元格和行属性（交给 RowChunk 在其他进程中渲染）
+        :return: ({(行, 列): 单元格}, {行号: 行属性})
+        """
+        cells = {key: cell for key, cell in self._cells.items() if first_row <= key[0] <= last_row}
+        rows = {row: attrs for row, attrs in self._rows.items() if first_row <= row <= last_row}
+        return cells, rows
+
+    def add_rendered_rows(self, first_row, last_row, xml, max_col, heights):
+        """
+        拼接 RowChunk 生成的行 XML，替换该范围内原有的单元格和行
+        :param heights: {行号: 行高}（插入图片时计算图片大小）
+        """
+        for key in [key for key in self._cells if first_row <= key[0] <= last_row]:
+            del self._cells[key]
+        for row in [row for row in self._rows if first_row <= row <= last_row]:
+            del self._rows[row]
+        self._rendered.append((first_row, last_row, xml))
+        self._rendered_heights.update(heights)
+        self._rendered_max_col = max(self._rendered_max_col, max_col)
+
+    def row_height(self, row):
+        height = super().row_height(row)
+        return height if height is not None else self._rendered_heights.get(row)
+
+    def add_image(self, image):
+        if self.has_drawing:
+            raise XlsxPatchError(f"工作表 {self.title} 已有绘图，暂不支持追加图片")
+        self.images.append(image)
+
+    def render(self, drawing_rel_id=None) -> bytes:
+        parts, max_col = self._render_rows()
+        max_row = parts[-1][0] if parts else 0
+        if self._rendered:
+            parts.extend((first_row, xml) for first_row, _, xml in self._rendered)
+            parts.sort(key=lambda part: part[0])
+            max_col = max(max_col, self._rendered_max_col)
+            max_row = max(max_row, max(last_row for _, last_row, _ in self._rendered))
+
+        head = self.template.head
+        if parts and max_col:
+            head = _DIMENSION_RE.sub(f'<dimension ref="A1:{get_column_letter(max_col)}{max_row}"/>', head, count=1)
+        sheet_data = f'<sheetData>{"".join(xml for _, xml in parts)}</sheetData>' if parts else '<sheetData/>'
+
+        tail = _MERGE_CELLS_RE.sub('', self.template.tail, count=1)
+        ranges = sorted(self.merged_cells.ranges, key=lambda r: (r.min_row, r.min_col))
+        if ranges:
+            merge_cells = (f'<mergeCells count="{len(ranges)}">'
+                           + ''.join(f'<mergeCell ref="{r.coord}"/>' for r in ranges) + '</mergeCells>')
+            tail = self._insert(tail, _AFTER_MERGE_CELLS, merge_cells)
+        if drawing_rel_id is not None:
+            tail = self._insert(tail, _AFTER_DRAWING, f'<drawing r:id="{drawing_rel_id}"/>')
+            if f'xmlns:r="{REL_NS}"' not in head:
+                head = re.sub(r'<worksheet\b', f'<worksheet xmlns:r="{REL_NS}"', head, count=1)
+        return (head + sheet_data + tail).encode('utf-8')
+
+    @staticmethod
+    def _insert(tail, following, element):
+        match = following.search(tail)
+        index = match.start() if match else tail.rindex('</worksheet>')
+        return tail[:index] + element + tail[index:]
+
+
+class XlsxPatch:
+    """一次填充：在模板包的基础上修改工作表，保存时只重写修改过的部件"""
+
+    def __init__(self, template: XlsxTemplate, registry):
+        """
+        :param template: 模板包
+        :param registry: 命名样式注册表（cell_styles.StyleRegistry）
+        """
+        self.template = template
+        self.stylesheet = _StyleSheet(template.parts['xl/styles.xml'], registry) \
+            if 'xl/styles.xml' in template.parts else None
+        if self.stylesheet is None:
+            raise XlsxPatchError("模板中没有 styles.xml")
+        self._sheets = {}
+
+    def sheet(self, name) -> SheetPatch:
+        sheet = self._sheets.get(name)
+        if sheet is None:
+            sheet = self._sheets[name] = SheetPatch(self.template.sheet(name), self.stylesheet)
+        return sheet
+
+    def save(self, output_path):
+        parts = OrderedDict(self.template.parts)
+        content_types = parts['[Content_Types].xml'].decode('utf-8')
+
+        for sheet in self._sheets.values():
+            drawing_rel_id = None
+            if sheet.images:
+                drawing_rel_id, content_types = self._add_drawing(parts, content_types, sheet)
+            parts[sheet.template.part] = sheet.render(drawing_rel_id)
+
+        content_types = self._drop_calc_chain(parts, content_types)
+        parts['xl/styles.xml'] = self.stylesheet.render()
+        parts['[Content_Types].xml'] = content_types.encode('utf-8')
+
+        with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for name, data in parts.items():
+                zf.writestr(name, data)
+
+    @staticmethod
+    def _next_name(parts, pattern):
+        index = 1
+        while pattern.format(index) in parts:
+            index += 1
+        return index
+
+    def _add_drawing(self, parts, content_types, sheet):
+        """
+        图片写入新的 drawing 部件，返回 (工作表到绘图的关系 Id, 新的 [Content_Types].xml)
+        内容相同的图片只写一个 media 部件，各锚点的关系都指向它
+        """
+        media_index = 1
+        media_ids = {}
+        for image in sheet.images:
+            data = image._data()
+            key = media_key(image.format, data)
+            if key in media_ids:
+                image._id = media_ids[key]
+                continue
+            while any(name.startswith(f'xl/media/image{media_index}.') for name in parts):
+                media_index += 1
+            image._id = media_ids[key] = media_index
+            parts[image.path[1:]] = data
+            media_index += 1
+            extension = image.format
+            if f'Extension="{extension}"' not in content_types:
+                content_types = content_types.replace(
+                    '</Types>', f'<Default Extension="{extension}" '
+                                f'ContentType="{IMAGE_CONTENT_TYPES.get(extension, "image/" + extension)}"/></Types>')
+
+        drawing = SpreadsheetDrawing()
+        drawing.images = sheet.images
+        drawing_part = f'xl/drawings/drawing{self._next_name(parts, "xl/drawings/drawing{}.xml")}.xml'
+        parts[drawing_part] = tostring(drawing._write())
+        parts[_rels_path(drawing_part)] = tostring(drawing._write_rels())
+        content_types = content_types.replace(
+            '</Types>', f'<Override PartName="/{drawing_part}" ContentType="{DRAWING_CONTENT_TYPE}"/></Types>')
+
+        # 工作表关系中追加绘图
+        rels_part = _rels_path(sheet.template.part)
+        existing = parts.get(rels_part)
+        rels_xml = existing.decode('utf-8') if existing is not None else \
+            f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<Relationships xmlns="{PKG_REL_NS}"></Relationships>'
+        rel_ids = set(re.findall(r'\bId="([^"]+)"', rels_xml))
+        rel_index = 1
+        while f'rId{rel_index}' in rel_ids:
+            rel_index += 1
+        rel_id = f'rId{rel_index}'
+        rels_xml = rels_xml.replace(
+            '</Relationships>', f'<Relationship Id="{rel_id}" Type="{DRAWING_REL}" Target="/{drawing_part}"/></Relationships>')
+        parts[rels_part] = rels_xml.encode('utf-8')
+        return rel_id, content_types
+
+    def _drop_calc_chain(self, parts, content_types):
+        """删除计算链（改写单元格后计算链可能失效，Excel 打开时会自动重建，openpyxl 保存时同样不保留）"""
+        calc_chain = 'xl/calcChain.xml'
+        if calc_chain not in parts:
+            return content_types
+        del parts[calc_chain]
+        rels_part = _rels_path(self.template.workbook_part)
+        if rels_part in parts:
+            rels_xml = parts[rels_part].decode('utf-8')
+            parts[rels_part] = re.sub(rf'<Relationship\b[^>]*?Type="{re.escape(CALC_CHAIN_REL)}"[^>]*?/>', '',
+                                      rels_xml).encode('utf-8')
+        return re.sub(r'<Override\b[^>]*?PartName="/xl/calcChain.xml"[^>]*?/>', '', content_types)
+
+
+class XlsxTemplateCache:
+    """按文件路径缓存解析后的模板包，模板文件的修改时间或大小变化后重新读取"""
+
+    def __init__(self, max_entries=32):
+        self.max_entries = max_entries
+        self._templates = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, template_path) -> XlsxTemplate:
+        path = os.path.abspath(template_path)
+        st = os.stat(path)
+        stat_key = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            cached = self._templates.get(path)
+            if cached is not None and cached[0] == stat_key:
+                self._templates.move_to_end(path)
+                return cached[1]
+        template = XlsxTemplate(path)
+        with self._lock:
+            self._templates[path] = (stat_key, template)
+            self._templates.move_to_end(path)
+            while len(self._templates) > self.max_entries:
+                self._templates.popitem(last=False)
+        return template
+
+
+# 默认模板包缓存
+xlsx_template_cache = XlsxTemplateCache()